@@ -0,0 +1,551 @@
+"""
+Generate synthetic KMyMoney SQL files, and measure the time taken by the
+reports of kmymoney.py on them.
+
+    python benchmark.py --sizes small medium --output results.json
+    python benchmark.py --compare results.json   # check for regressions
+
+Results are emitted as JSON, so that runs can be compared across versions.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import kmymoney
+from kmymoney import ACCOUNT_TYPE
+
+
+# A subset of the schema created by KMyMoney, with the tables and columns
+# used by kmymoney.py
+SCHEMA = """
+CREATE TABLE kmmFileInfo (
+   version varchar(16), created date, lastModified date,
+   baseCurrency char(3), accounts bigint unsigned,
+   transactions bigint unsigned, splits bigint unsigned,
+   prices bigint unsigned, hiTransactionId bigint unsigned,
+   fixLevel int unsigned
+);
+CREATE TABLE kmmAccounts (
+   id varchar(32) NOT NULL, institutionId varchar(32),
+   parentId varchar(32), lastModified timestamp, openingDate date,
+   accountType varchar(16) NOT NULL, accountTypeString text,
+   isStockAccount char(1), accountName text, description text,
+   currencyId varchar(32), balance text, balanceFormatted text,
+   transactionCount bigint unsigned,
+   PRIMARY KEY (id)
+);
+CREATE TABLE kmmTransactions (
+   id varchar(32) NOT NULL, txType char(1), postDate timestamp,
+   memo mediumtext, entryDate timestamp, currencyId char(3),
+   bankId mediumtext,
+   PRIMARY KEY (id)
+);
+CREATE TABLE kmmSplits (
+   transactionId varchar(32) NOT NULL, txType char(1),
+   splitId smallint unsigned NOT NULL, payeeId varchar(32),
+   reconcileDate timestamp, action varchar(50), reconcileFlag char(1),
+   value text NOT NULL, valueFormatted text, shares text NOT NULL,
+   sharesFormatted mediumtext, price text, priceFormatted mediumtext,
+   memo mediumtext, accountId varchar(32) NOT NULL,
+   costCenterId varchar(32), checkNumber varchar(32),
+   postDate timestamp, bankId mediumtext,
+   PRIMARY KEY (transactionId, splitId)
+);
+CREATE TABLE kmmPrices (
+   fromId varchar(32) NOT NULL, toId varchar(32) NOT NULL,
+   priceDate date NOT NULL, price text NOT NULL,
+   priceFormatted text, priceSource text,
+   PRIMARY KEY (fromId, toId, priceDate)
+);
+CREATE TABLE kmmSecurities (
+   id varchar(32) NOT NULL, name text NOT NULL, symbol mediumtext,
+   type smallint unsigned NOT NULL, typeString mediumtext,
+   smallestAccountFraction varchar(24), pricePrecision smallint unsigned,
+   tradingMarket mediumtext, tradingCurrency char(3),
+   roundingMethod smallint unsigned,
+   PRIMARY KEY (id)
+);
+CREATE TABLE kmmCurrencies (
+   ISOcode char(3) NOT NULL, name text NOT NULL, type smallint unsigned,
+   typeString mediumtext, symbol1 smallint unsigned,
+   symbol2 smallint unsigned, symbol3 smallint unsigned,
+   symbolString varchar(255), smallestCashFraction varchar(24),
+   smallestAccountFraction varchar(24), pricePrecision smallint unsigned,
+   PRIMARY KEY (ISOcode)
+);
+CREATE TABLE kmmPayees (
+   id varchar(32) NOT NULL, name mediumtext, reference mediumtext,
+   email mediumtext, addressStreet mediumtext, addressCity mediumtext,
+   addressZipcode mediumtext, addressState mediumtext,
+   telephone mediumtext, notes longtext, defaultAccountId varchar(32),
+   matchData tinyint unsigned, matchIgnoreCase char(1),
+   matchKeys mediumtext,
+   PRIMARY KEY (id)
+);
+"""
+
+
+def _amount(value):
+    """
+    Format an amount as stored by KMyMoney ("n/100")
+    """
+    return '{}/100'.format(int(round(value * 100)))
+
+
+def generate(
+    filename,
+    years=5,
+    checking=2,
+    categories=20,
+    splits_per_day=4,
+    securities=5,
+    foreign_securities=1,
+    quote_frequency='B',
+    trades_per_year=12,
+    split_categories=3,
+    payees=200,
+    seed=1,
+):
+    """
+    Create a KMyMoney SQL file with random data. An existing file is
+    overwritten.
+
+    :param years: number of years of transactions, ending today
+    :param checking: number of checking accounts
+    :param categories: number of Expense accounts
+    :param splits_per_day:
+       average number of expense transactions per day (each has two splits,
+       and one in five is split between `split_categories` categories)
+    :param securities: number of stock accounts, each with its own security
+    :param foreign_securities:
+       how many of those securities are quoted in USD rather than EUR (an
+       USD->EUR exchange rate is then quoted too)
+    :param quote_frequency:
+       how often prices are quoted: "D" (every day), "B" (business days),
+       "W" (weekly) or "M" (monthly)
+    :param trades_per_year:
+       number of buy or sell transactions, per year and per security
+    """
+    if os.path.exists(filename):
+        os.remove(filename)
+    rnd = random.Random(seed)
+    end = datetime.date.today()
+    start = end - datetime.timedelta(days=365 * years)
+    days = [start + datetime.timedelta(days=d)
+            for d in range((end - start).days + 1)]
+
+    conn = sqlite3.connect(filename)
+    conn.executescript(SCHEMA)
+    conn.executemany(
+        "INSERT INTO kmmCurrencies (ISOcode, name) VALUES (?, ?)",
+        [('EUR', 'Euro'), ('USD', 'US Dollar')])
+
+    accounts = [
+        ('AStd::Asset', None, '9', 'Asset', 'EUR'),
+        ('AStd::Liability', None, '10', 'Liability', 'EUR'),
+        ('AStd::Expense', None, ACCOUNT_TYPE.EXPENSE, 'Expense', 'EUR'),
+        ('AStd::Income', None, ACCOUNT_TYPE.INCOME, 'Income', 'EUR'),
+        ('AStd::Equity', None, ACCOUNT_TYPE.EQUITY, 'Equity', 'EUR'),
+        ('A_broker', 'AStd::Asset', '7', 'Brokerage', 'EUR'),
+        ('A_salary', 'AStd::Income', ACCOUNT_TYPE.INCOME, 'Salary', 'EUR'),
+        ('A_dividends', 'AStd::Income', ACCOUNT_TYPE.INCOME, 'Dividends',
+         'EUR'),
+        ('A_fees', 'AStd::Expense', ACCOUNT_TYPE.EXPENSE, 'Bank fees',
+         'EUR'),
+        ('A_opening', 'AStd::Equity', ACCOUNT_TYPE.EQUITY, 'Opening',
+         'EUR'),
+    ]
+    checkings = ['A_chk{}'.format(i) for i in range(checking)]
+    accounts.extend(
+        (a, 'AStd::Asset', '1', 'Checking{}'.format(i), 'EUR')
+        for i, a in enumerate(checkings))
+
+    # Categories are organized in a two-level hierarchy
+    expenses = []
+    for i in range(categories):
+        parent = 'AStd::Expense' if i % 5 == 0 else expenses[i - i % 5]
+        expenses.append('A_exp{}'.format(i))
+        accounts.append((
+            expenses[-1], parent, ACCOUNT_TYPE.EXPENSE,
+            'Category{}'.format(i), 'EUR'))
+
+    stocks = []
+    for i in range(securities):
+        currency = 'USD' if i < foreign_securities else 'EUR'
+        secid = 'E{:06d}'.format(i)
+        conn.execute(
+            """INSERT INTO kmmSecurities
+            (id, name, symbol, type, tradingCurrency) VALUES (?,?,?,?,?)""",
+            (secid, 'Security{}'.format(i), 'SEC{}'.format(i), 0, currency))
+        stocks.append(('A_stk{}'.format(i), secid, currency))
+        accounts.append(('A_stk{}'.format(i), 'A_broker', ACCOUNT_TYPE.STOCK,
+                         'Stock{}'.format(i), secid))
+
+    conn.executemany(
+        """INSERT INTO kmmAccounts
+        (id, parentId, accountType, accountName, currencyId, isStockAccount,
+         openingDate, lastModified)
+        VALUES (?,?,?,?,?,?,?,?)""",
+        [a + ('Y' if a[2] == ACCOUNT_TYPE.STOCK else 'N',
+              start.isoformat(), end.isoformat())
+         for a in accounts])
+    conn.executemany(
+        "INSERT INTO kmmPayees (id, name) VALUES (?,?)",
+        [('P{:06d}'.format(i), 'Payee{}'.format(i)) for i in range(payees)])
+
+    # Prices follow a random walk
+    def _quoted(day):
+        if quote_frequency == 'D':
+            return True
+        elif quote_frequency == 'B':
+            return day.weekday() < 5
+        elif quote_frequency == 'W':
+            return day.weekday() == 4
+        else:
+            return day.day == 1
+
+    prices = []
+    current = {secid: rnd.uniform(20, 200) for _, secid, _ in stocks}
+    usd = 0.9
+    for day in days:
+        for secid in current:
+            current[secid] *= 1 + rnd.gauss(0.0002, 0.015)
+        usd *= 1 + rnd.gauss(0, 0.004)
+        if _quoted(day):
+            for _, secid, currency in stocks:
+                prices.append(
+                    (secid, currency, day.isoformat(),
+                     _amount(current[secid]), 'Yahoo Finance'))
+            if foreign_securities:
+                prices.append((
+                    'USD', 'EUR', day.isoformat(),
+                    '{}/10000'.format(int(usd * 10000)), 'ECB'))
+    conn.executemany(
+        """INSERT INTO kmmPrices
+        (fromId, toId, priceDate, price, priceSource) VALUES (?,?,?,?,?)""",
+        prices)
+
+    transactions = []
+    splits = []
+
+    def _transaction(day, currency, parts):
+        """
+        :param parts: (accountId, action, value, shares, price) tuples
+        """
+        tid = 'T{:018d}'.format(len(transactions) + 1)
+        date = day.isoformat()
+        transactions.append((tid, 'N', date, '', date, currency))
+        payee = 'P{:06d}'.format(rnd.randrange(payees))
+        for idx, (account, action, value, shares, price) in enumerate(parts):
+            splits.append((
+                tid, 'N', idx, payee, action,
+                rnd.choice('0122'), value, shares, price, '', account, date))
+
+    _transaction(days[0], 'EUR', [
+        (checkings[0], '', _amount(10000), _amount(10000), '1/1'),
+        ('A_opening', '', _amount(-10000), _amount(-10000), '1/1'),
+    ])
+
+    # Pre-compute the days of trades, so that the number of trades does not
+    # depend on the number of days
+    trades = {}
+    for stock in stocks:
+        for _ in range(int(trades_per_year * years)):
+            trades.setdefault(rnd.choice(days), []).append(stock)
+    held = {account: 0 for account, _, _ in stocks}
+
+    for day in days:
+        if day.day == 1:
+            for chk in checkings:
+                salary = rnd.uniform(2000, 4000)
+                _transaction(day, 'EUR', [
+                    (chk, '', _amount(salary), _amount(salary), '1/1'),
+                    ('A_salary', '', _amount(-salary), _amount(-salary),
+                     '1/1'),
+                ])
+
+        for _ in range(rnd.randint(0, 2 * splits_per_day)):
+            chk = rnd.choice(checkings)
+            if rnd.random() < 0.2:
+                cats = rnd.sample(
+                    expenses, min(split_categories, len(expenses)))
+            else:
+                cats = [rnd.choice(expenses)]
+            amounts = [rnd.uniform(1, 150) for _ in cats]
+            total = sum(round(a, 2) for a in amounts)
+            _transaction(
+                day, 'EUR',
+                [(chk, '', _amount(-total), _amount(-total), '1/1')]
+                + [(c, '', _amount(a), _amount(a), '1/1')
+                   for c, a in zip(cats, amounts)])
+
+        for account, secid, currency in trades.get(day, []):
+            price = round(current[secid], 2)
+            if held[account] > 0 and rnd.random() < 0.3:
+                qty = -rnd.randint(1, held[account])
+                action = 'Sell'
+            else:
+                qty = rnd.randint(1, 20)
+                action = 'Buy'
+            held[account] += qty
+            value = round(qty * price, 2)
+            fee = round(1 + abs(value) * 0.001, 2)
+            _transaction(day, currency, [
+                (account, action, _amount(value), '{}/1'.format(qty),
+                 _amount(price)),
+                ('A_fees', '', _amount(fee), _amount(fee), '1/1'),
+                (checkings[0], '', _amount(-value - fee),
+                 _amount(-value - fee), '1/1'),
+            ])
+
+    conn.executemany(
+        """INSERT INTO kmmTransactions
+        (id, txType, postDate, memo, entryDate, currencyId)
+        VALUES (?,?,?,?,?,?)""",
+        transactions)
+    conn.executemany(
+        """INSERT INTO kmmSplits
+        (transactionId, txType, splitId, payeeId, action, reconcileFlag,
+         value, shares, price, memo, accountId, postDate)
+        VALUES (?,?,?,?,?,?,?,?,?,?,?,?)""",
+        splits)
+    conn.execute(
+        """INSERT INTO kmmFileInfo VALUES (?,?,?,?,?,?,?,?,?,?)""",
+        ('100', start.isoformat(), end.isoformat(), 'EUR', len(accounts),
+         len(transactions), len(splits), len(prices), len(transactions), 5))
+    conn.commit()
+    conn.close()
+
+
+# Scale of the generated files
+SIZES = {
+    'small': dict(years=3),
+    'medium': dict(years=10, splits_per_day=8, securities=10),
+    'large': dict(years=30, splits_per_day=15, securities=20,
+                  categories=60),
+
+    # 100k trades, for cost_basis
+    'trades': dict(years=20, splits_per_day=1, securities=50,
+                   trades_per_year=100),
+
+    # Very large transactions, for the computation of fees
+    'fanout': dict(years=5, splits_per_day=2, categories=200,
+                   split_categories=100, trades_per_year=50),
+}
+
+# Options of KMyMoney() to compare
+CONFIGS = {
+    'sql': {},
+    'numpy': {'decode_amounts': 'numpy'},
+    'sidecar': {'sidecar': True},    # replaced with a file name
+}
+
+
+def _mid_year(kmm):
+    with kmm._connection() as conn:
+        first, last = conn.execute(
+            "SELECT MIN(postDate), MAX(postDate) FROM kmmSplits").fetchone()
+    year = (int(first[:4]) + int(last[:4])) // 2
+    return '{}-01-01'.format(year), '{}-12-31'.format(year)
+
+
+def _count_detailed_splits(kmm):
+    return kmm._read_sql(
+        "SELECT COUNT(*) AS count, TOTAL(fees) AS fees FROM ({})".format(
+            kmm._query_detailed_splits()),
+        params={'currency': kmymoney.DEFAULT_CURRENCY})
+
+
+# The benchmarks: name -> function(kmm, params). Results are not cached
+# between runs (cache_size=0), though data loaded once per file version
+# (account tree, decoded splits, snapshot,...) is.
+CASES = {
+    'accounts': lambda kmm, p: kmm.accounts(),
+    'split_amounts': lambda kmm, p: kmm.split_amounts(),
+    'ledger_all': lambda kmm, p: kmm.ledger(),
+    'ledger_account': lambda kmm, p: kmm.ledger(accounts=['A_chk0']),
+    'ledger_year': lambda kmm, p: kmm.ledger(
+        accounts=['A_chk0'], mindate=p['mindate'], maxdate=p['maxdate']),
+    'detailed_splits': lambda kmm, p: _count_detailed_splits(kmm),
+    'fees': lambda kmm, p: kmm.fees(),
+    'networth_monthly': lambda kmm, p: kmm.networth(),
+    'networth_yearly': lambda kmm, p: kmm.networth(by_year=True),
+    'networth_daily': lambda kmm, p: kmm.networth(freq='B'),
+    'networth_daily32': lambda kmm, p: kmm.networth(
+        freq='B', dtype='float32'),
+    'categories': lambda kmm, p: kmm._categories(
+        mindate=p['mindate'], maxdate=p['maxdate']),
+    'by_category': lambda kmm, p: kmm.by_category(
+        mindate=p['mindate'], maxdate=p['maxdate']),
+    'price_history': lambda kmm, p: kmm.price_history(),
+    'positions': lambda kmm, p: kmm.positions(),
+    'cost_basis': lambda kmm, p: kmm.cost_basis(by_year=True),
+    'networth_at': lambda kmm, p: kmm.networth_at(p['maxdate']),
+}
+
+# Cold start: commands run in a new python process, which include the time
+# to import modules. They are reported with the 'cli' config.
+COLD_CASES = {
+    'import': ['-c', 'import kmymoney'],
+    'cli_networth': ['-m', 'kmymoney', 'networth', '{filename}'],
+    'cli_networth_yearly': [
+        '-m', 'kmymoney', 'networth', '{filename}', '--freq', 'Y'],
+}
+
+
+def _rows(result):
+    try:
+        return len(result)
+    except TypeError:
+        return None
+
+
+def _cold_start(size, case, filename, repeat=3):
+    """
+    Time one of COLD_CASES in a new python process
+    """
+    command = [sys.executable] + [
+        a.format(filename=filename) for a in COLD_CASES[case]]
+    times = []
+    for _ in range(repeat + 1):
+        start = time.perf_counter()
+        subprocess.run(
+            command, check=True, stdout=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(kmymoney.__file__)))
+        times.append(time.perf_counter() - start)
+    print('{:8} {:8} {:18} {:8.4f}s'.format(
+        size, 'cli', case, min(times[1:])), file=sys.stderr)
+    return {
+        'size': size,
+        'config': 'cli',
+        'case': case,
+        'first': times[0],
+        'best': min(times[1:]),
+        'median': statistics.median(times[1:]),
+        'rows': None,
+    }
+
+
+def run(sizes, configs, cases, repeat=3, directory=None):
+    """
+    Generate a file for each size (or reuse it from `directory`), then time
+    each case with each configuration.
+    Return a list of dicts, one per (size, config, case).
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = directory or tmp
+        for size in sizes:
+            filename = os.path.join(directory, '{}.kmm'.format(size))
+            if not os.path.exists(filename):
+                start = time.perf_counter()
+                generate(filename, **SIZES[size])
+                print('generated {} in {:.1f}s'.format(
+                    filename, time.perf_counter() - start),
+                    file=sys.stderr)
+
+            for case in cases:
+                if case in COLD_CASES:
+                    results.append(_cold_start(
+                        size, case, filename, repeat=repeat))
+
+            for config in configs:
+                options = dict(CONFIGS[config])
+                if options.get('sidecar'):
+                    options['sidecar'] = os.path.join(
+                        tmp, '{}.sidecar'.format(size))
+
+                with kmymoney.KMyMoney(
+                        filename, cache_size=0, **options) as kmm:
+                    mindate, maxdate = _mid_year(kmm)
+                    params = {'mindate': mindate, 'maxdate': maxdate}
+                    for case in cases:
+                        if case in COLD_CASES:
+                            continue
+                        times = []
+                        for _ in range(repeat + 1):
+                            start = time.perf_counter()
+                            result = CASES[case](kmm, params)
+                            times.append(time.perf_counter() - start)
+                        results.append({
+                            'size': size,
+                            'config': config,
+                            'case': case,
+                            'first': times[0],
+                            'best': min(times[1:]),
+                            'median': statistics.median(times[1:]),
+                            'rows': _rows(result),
+                        })
+                        print('{:8} {:8} {:18} {:8.4f}s'.format(
+                            size, config, case, results[-1]['best']),
+                            file=sys.stderr)
+    return results
+
+
+def compare(previous, results, threshold=1.2):
+    """
+    Print the cases which are slower than in a previous run
+    """
+    old = {(r['size'], r['config'], r['case']): r['best']
+           for r in previous['results']}
+    for r in results:
+        before = old.get((r['size'], r['config'], r['case']))
+        if before:
+            ratio = r['best'] / before
+            print('{:8} {:8} {:18} {:8.4f}s -> {:8.4f}s  x{:.2f}{}'.format(
+                r['size'], r['config'], r['case'], before, r['best'], ratio,
+                '   SLOWER' if ratio > threshold else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        '--sizes', nargs='+', default=['small'], choices=list(SIZES))
+    parser.add_argument(
+        '--configs', nargs='+', default=list(CONFIGS), choices=list(CONFIGS))
+    parser.add_argument(
+        '--cases', nargs='+', default=list(CASES) + list(COLD_CASES),
+        choices=list(CASES) + list(COLD_CASES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument(
+        '--directory',
+        help='where generated files are kept, to reuse them across runs')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument(
+        '--compare', help='a JSON file from a previous run')
+    args = parser.parse_args()
+
+    results = run(
+        args.sizes, args.configs, args.cases, repeat=args.repeat,
+        directory=args.directory)
+    output = {
+        'date': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'pandas': kmymoney.pd.__version__,
+        'numpy': kmymoney.np.__version__,
+        'sqlite': sqlite3.sqlite_version,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=1)
+    else:
+        json.dump(output, sys.stdout, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
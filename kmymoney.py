@@ -1,4 +1,84 @@
-import pandas as pd
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
+import importlib
+import inspect
+import itertools
+import logging
+import os
+import queue
+import re
+import sqlite3
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.parse
+import warnings
+from fractions import Fraction
+
+
+class _LazyModule:
+    """
+    A placeholder for a module, which is only imported on first access to
+    one of its attributes. pandas alone takes about half a second to import,
+    which command-line use (see `main`) does not need to pay when it only
+    queries sqlite.
+    The module is then stored in the global variable instead of the
+    placeholder. Unlike importlib's LazyLoader, this is safe when several
+    threads run their first report at the same time.
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, name, variable):
+        self._name = name
+        self._variable = variable
+
+    def __getattr__(self, attr):
+        with self._lock:
+            module = importlib.import_module(self._name)
+            globals()[self._variable] = module
+        return getattr(module, attr)
+
+
+asyncio = _LazyModule('asyncio', 'asyncio')
+np = _LazyModule('numpy', 'np')
+pd = _LazyModule('pandas', 'pd')
+
+
+# Schema of the optional sidecar database, see KMyMoney.__init__. Sidecars
+# with an older SIDECAR_VERSION are recreated.
+SIDECAR_VERSION = 2
+SIDECAR_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (filename TEXT, signature TEXT);
+CREATE TABLE IF NOT EXISTS splits (
+   transactionId TEXT,
+   splitId INTEGER,
+   accountId TEXT,
+   action TEXT,
+   postDate TEXT,
+   quantity REAL,
+   price REAL,
+   value REAL,
+   payeeId TEXT,
+   reconcileFlag TEXT,
+   splitRowid INTEGER,   --  rowid in kmmSplits
+   PRIMARY KEY (transactionId, splitId)
+);
+CREATE INDEX IF NOT EXISTS splits_account_date ON splits (accountId, postDate);
+CREATE INDEX IF NOT EXISTS splits_date ON splits (postDate);
+CREATE TABLE IF NOT EXISTS prices (
+   fromId TEXT,
+   toId TEXT,
+   priceDate TEXT,
+   price REAL,
+   PRIMARY KEY (toId, fromId, priceDate)
+);
+"""
 
 
 class ACCOUNT_TYPE:
@@ -8,163 +88,3197 @@ class ACCOUNT_TYPE:
     EQUITY = '16'
 
 
-DEFAULT_CURRENCY = 'EUR'   # ??? should be computed from FileInfo.baseCurrency
+DEFAULT_CURRENCY = 'EUR'   # ??? should be computed from FileInfo.baseCurrency
+
+
+RATIONAL = re.compile(r'\s*[-+]?\d+\s*/\s*[-+]?\d+\s*')
+
+
+def parse_rationals(values):
+    """
+    Split "n/m" values, as stored by KMyMoney, into two int64 arrays for the
+    numerators and denominators. This is done in bulk, rather than row by row
+    in SQL. Missing values are returned as 0/0.
+    Values that do not fit in int64 are returned exactly, the arrays then
+    have an object dtype.
+    """
+    texts = [
+        (v if '/' in v else v + '/1') if isinstance(v, str) and v else '0/0'
+        for v in values
+    ]
+    # A single pass of numpy's C parser over all values is much faster than
+    # converting strings one at a time. It stops at the first invalid value
+    # though, with only a warning.
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        both = np.fromstring('/'.join(texts), dtype=np.int64, sep='/')
+    if len(both) != 2 * len(texts):
+        bad = [t for t in texts if not RATIONAL.fullmatch(t)]
+        raise ValueError(
+            f"Invalid amount {bad[0] if bad else None!r}")
+
+    # The parser saturates values that are too large
+    limits = np.iinfo(np.int64)
+    big = np.flatnonzero((both == limits.max) | (both == limits.min))
+    if len(big):
+        both = both.astype(object)
+        for idx in big.tolist():
+            both[idx] = int(texts[idx // 2].split('/')[idx % 2])
+    return both[0::2], both[1::2]
+
+
+def rationals_to_float(num, den):
+    """
+    Convert the result of `parse_rationals` to floats, with NaN for missing
+    values.
+    """
+    missing = den == 0
+    result = np.asarray(num / np.where(missing, 1, den), dtype=float)
+    result[missing] = np.nan
+    return result
+
+
+def parse_fractions(values):
+    """
+    Convert "n/m" values to exact Fraction objects, with None for missing
+    values. This is much slower than floats, but suitable to reconcile with
+    the amounts displayed by KMyMoney.
+    """
+    def _fraction(v):
+        if not isinstance(v, str) or not v:
+            return None
+        try:
+            return Fraction(v)
+        except ZeroDivisionError:
+            return None
+
+    return np.array([_fraction(v) for v in values], dtype=object)
+
+
+def _plot_by_category(p, values, kind, subplots, mindate, maxdate):
+    """
+    Group paiements and deposits by category, and plot them.
+    :param p:
+       a DataFrame with columns category, paiement, deposit and amount.
+    """
+    p = p[['category'] + list(values)].groupby(['category']).sum()
+
+    # Unfortunately groupby() sometimes removes "nuisance columns"
+    for v in values:
+        if v not in p.columns:
+            p[v] = 0
+
+    if not p.empty:
+        # Group by category and sum the amounts
+        p = p.sort_values(values)
+
+        if kind == 'pie':
+            params = dict(
+                # no "y" parameter, this fails with pie plots
+                autopct="%.2f%%",
+                kind='pie',
+                subplots=True,
+            )
+        else:
+            params = dict(
+                y=values,
+                kind=kind,
+                subplots=subplots,
+            )
+
+        p.plot(
+            **params,
+            title="{} - {}".format(mindate or "", maxdate or ""),
+            legend=None,
+            figsize=(20, 10),
+            logy=False
+        )
+
+
+def _price_pivot(p):
+    """
+    Transform a list of (date, price, name) into a pivot table
+    """
+    if p.empty:
+        return p
+    return pd.pivot_table(
+        p,
+        values='price',
+        index=['date'],
+        columns=['name'],
+    )
+
+
+def _ledger_dtypes(tree, payees):
+    """
+    Categorical dtypes for the text columns of a ledger, see KMyMoney.dtypes.
+    A single dictionary is used for both full and short account names, so
+    that accountName and category can be compared or joined.
+    :param tree: the AccountTree
+    :param payees: all payee names
+    """
+    names = sorted(
+        {a.name for a in tree} | {a.accountName for a in tree} - {None})
+    return {
+        'accountName': pd.CategoricalDtype(names),
+        'category': pd.CategoricalDtype(names),
+        'payee': pd.CategoricalDtype(
+            sorted({'' if p is None else p for p in payees} | {''})),
+        'reconcile': pd.CategoricalDtype(['', 'C', 'R']),
+    }
+
+
+def _compact(df, dtypes):
+    """
+    Convert a report to compact dtypes: categorical text columns (see
+    _ledger_dtypes) and datetime64 dates. Numbers are only converted to
+    float32 when that does not change any value (e.g. number of shares),
+    since float32 only has about 7 significant digits, not enough to
+    reconcile amounts to the cent.
+    """
+    result = {}
+    for column, values in df.items():
+        if column in dtypes:
+            result[column] = values.astype(dtypes[column])
+        elif column == 'date':
+            result[column] = pd.to_datetime(
+                values, format='%Y-%m-%d', errors='coerce')
+        elif values.dtype == np.float64:
+            small = values.astype(np.float32)
+            lossless = np.array_equal(
+                small.to_numpy(dtype=np.float64), values.to_numpy(),
+                equal_nan=True)
+            result[column] = small if lossless else values
+        else:
+            result[column] = values
+    return pd.DataFrame(result, index=df.index)
+
+
+CacheInfo = collections.namedtuple(
+    'CacheInfo', ['hits', 'misses', 'evictions', 'entries', 'bytes'])
+
+
+def _sizeof(value):
+    """
+    Approximate memory used by a value stored in the ResultCache
+    """
+    if hasattr(value, 'memory_usage'):   # DataFrame or Series
+        return int(np.sum(value.memory_usage(deep=True)))
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    """
+    A least-recently-used cache for the results of reports, bounded both in
+    number of entries and in memory. All entries are discarded when the file
+    changes on disk.
+    """
+
+    def __init__(self, max_entries=32, max_bytes=256 * 2**20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()   # key -> (value, size)
+        self._bytes = 0
+        self._signature = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, signature, key):
+        """
+        Return (True, value) if the key is in the cache, (False, None)
+        otherwise. `signature` identifies the current version of the file.
+        """
+        with self._lock:
+            if signature != self._signature:
+                self._clear()
+                self._signature = signature
+            try:
+                value, _ = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    def put(self, signature, key, value):
+        size = _sizeof(value)
+        with self._lock:
+            if signature != self._signature or size > self.max_bytes:
+                return
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while (len(self._entries) > self.max_entries
+                   or self._bytes > self.max_bytes):
+                _, (_, s) = self._entries.popitem(last=False)
+                self._bytes -= s
+                self.evictions += 1
+
+    def _clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(
+                self.hits, self.misses, self.evictions, len(self._entries),
+                self._bytes)
+
+
+def _hashable(value):
+    """
+    Convert parameters of reports to something that can be used as a key
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(v) for v in value)
+    return value
+
+
+QueryProfile = collections.namedtuple(
+    'QueryProfile',
+    ['sql', 'params', 'rows', 'sql_seconds', 'pandas_seconds', 'plan'])
+
+
+class CallProfile:
+    """
+    What happened during one call to a report, see Profiler
+    """
+
+    def __init__(self, report, args, kwargs):
+        self.report = report
+        self.args = args
+        self.kwargs = kwargs
+        self.queries = []        # QueryProfile for each sql query
+        self.seconds = None      # total duration of the call
+        self.peak_memory = None  # in bytes, if the profiler traces memory
+
+    @property
+    def sql_seconds(self):
+        """
+        Time spent executing queries and fetching their results
+        """
+        return sum(q.sql_seconds for q in self.queries)
+
+    @property
+    def pandas_seconds(self):
+        """
+        Time spent outside of sqlite (building DataFrames, computing,...)
+        """
+        return self.seconds - self.sql_seconds
+
+    def __repr__(self):
+        return (
+            f'<CallProfile {self.report} {self.seconds:.4f}s'
+            f' sql={self.sql_seconds:.4f}s queries={len(self.queries)}>'
+        )
+
+
+def log_profile(call):
+    """
+    A callback for Profiler, which logs each call
+    """
+    logging.getLogger(__name__).info(
+        '%s: %.4fs (sql %.4fs in %d queries, %d rows), peak memory %s',
+        call.report, call.seconds, call.sql_seconds, len(call.queries),
+        sum(q.rows for q in call.queries), call.peak_memory)
+
+
+class Profiler:
+    """
+    Records how long each report takes, split between sqlite and pandas.
+    Only the outermost report is recorded when reports call each other.
+
+        kmm = KMyMoney(filename, profiler=Profiler(callback=log_profile))
+        kmm.ledger(...)
+        kmm.profiler.summary()
+    """
+
+    def __init__(self, callback=None, explain=False, memory=False,
+                 max_calls=1000):
+        """
+        :param callback:
+           called with the CallProfile at the end of each report.
+        :param explain:
+           if True, also store sqlite's plan for each query (see
+           KMyMoney.explain). This runs an extra query each time.
+        :param memory:
+           if True, measure the peak memory used by each report, via
+           tracemalloc. This makes reports significantly slower.
+           ??? Not accurate when multiple threads run reports
+        :param max_calls: only the most recent calls are kept
+        """
+        self.callback = callback
+        self.explain = explain
+        self.memory = memory
+        self.calls = collections.deque(maxlen=max_calls)
+        self._lock = threading.Lock()
+
+    def _record(self, call):
+        with self._lock:
+            self.calls.append(call)
+        if self.callback is not None:
+            self.callback(call)
+
+    def clear(self):
+        with self._lock:
+            self.calls.clear()
+
+    def summary(self):
+        """
+        A DataFrame with one row per call
+        """
+        with self._lock:
+            calls = list(self.calls)
+        return pd.DataFrame(
+            [(c.report, c.seconds, c.sql_seconds, c.pandas_seconds,
+              len(c.queries), sum(q.rows for q in c.queries), c.peak_memory)
+             for c in calls],
+            columns=['report', 'seconds', 'sql_seconds', 'pandas_seconds',
+                     'queries', 'rows', 'peak_memory'],
+        )
+
+    def queries(self):
+        """
+        A DataFrame with one row per query, and the index of its call in
+        `summary()`
+        """
+        with self._lock:
+            calls = list(self.calls)
+        return pd.DataFrame(
+            [(idx, c.report) + tuple(q)
+             for idx, c in enumerate(calls)
+             for q in c.queries],
+            columns=['call', 'report'] + list(QueryProfile._fields),
+        )
+
+
+def _profiled(method):
+    """
+    Decorator for reports of KMyMoney (or of objects with a `kmm`
+    attribute, like SplitQuery), so that they are recorded by its profiler,
+    if any. For generators, only the time spent inside the generator is
+    counted, not the time spent by the caller between items, and the peak
+    memory is that of the most expensive item.
+    """
+    if inspect.isgeneratorfunction(method):
+        @functools.wraps(method)
+        def generator(self, *args, **kwargs):
+            kmm = getattr(self, 'kmm', self)
+            profiler = kmm.profiler
+            if profiler is None or getattr(kmm._profiling, 'call', None):
+                yield from method(self, *args, **kwargs)
+                return
+
+            call = CallProfile(
+                method.__name__ if kmm is self else method.__qualname__,
+                args, kwargs)
+            call.seconds = 0.0
+            items = method(self, *args, **kwargs)
+            try:
+                while True:
+                    tracing = profiler.memory and not tracemalloc.is_tracing()
+                    if tracing:
+                        tracemalloc.start()
+                    if profiler.memory:
+                        tracemalloc.reset_peak()
+                        base = tracemalloc.get_traced_memory()[0]
+
+                    kmm._profiling.call = call
+                    start = time.perf_counter()
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        return
+                    finally:
+                        call.seconds += time.perf_counter() - start
+                        kmm._profiling.call = None
+                        if profiler.memory:
+                            call.peak_memory = max(
+                                call.peak_memory or 0,
+                                tracemalloc.get_traced_memory()[1] - base)
+                        if tracing:
+                            tracemalloc.stop()
+                    yield item
+            finally:
+                # Closing runs the `finally` clauses of the generator
+                kmm._profiling.call = call
+                try:
+                    items.close()
+                finally:
+                    kmm._profiling.call = None
+                    profiler._record(call)
+
+        return generator
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        kmm = getattr(self, 'kmm', self)
+        profiler = kmm.profiler
+        if profiler is None or getattr(kmm._profiling, 'call', None):
+            return method(self, *args, **kwargs)
+
+        call = CallProfile(
+            method.__name__ if kmm is self else method.__qualname__,
+            args, kwargs)
+        tracing = profiler.memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        if profiler.memory:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+
+        kmm._profiling.call = call
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            call.seconds = time.perf_counter() - start
+            kmm._profiling.call = None
+            if profiler.memory:
+                call.peak_memory = tracemalloc.get_traced_memory()[1] - base
+            if tracing:
+                tracemalloc.stop()
+            profiler._record(call)
+
+    return wrapper
+
+
+def _memoized(method):
+    """
+    Decorator for reports of KMyMoney, so that their result is stored in the
+    ResultCache, keyed on the method name and all its parameters.
+    DataFrames are copied on the way out, so that callers can modify them.
+    """
+    sig = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.results.max_entries <= 0:
+            return method(self, *args, **kwargs)
+
+        bound = sig.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        key = (method.__name__, ) + tuple(
+            (name, _hashable(v))
+            for name, v in list(bound.arguments.items())[1:])
+
+        with self._connection() as conn:
+            signature = self._file_signature(conn)
+
+        found, value = self.results.get(signature, key)
+        if not found:
+            value = method(self, *args, **kwargs)
+            self.results.put(signature, key, value)
+        return value.copy() if hasattr(value, 'copy') else value
+
+    return _profiled(wrapper)
+
+
+class Account:
+    """
+    One node in the AccountTree
+    """
+
+    def __init__(self, id, parentId, accountType, accountName, currencyId):
+        self.id = id
+        self.parentId = parentId
+        self.accountType = accountType
+        self.accountName = accountName   # short name
+        self.currencyId = currencyId
+        self.name = accountName          # fully qualified name
+        self.depth = 0
+        self.children = []               # list of Account
+
+    def __repr__(self):
+        return f"<Account {self.id} {self.name}>"
+
+
+class AccountTree:
+    """
+    An in-memory index of the accounts hierarchy, so that we do not need to
+    recompute fully qualified names in each query. Names are of the form
+        Asset:Toplevel:Parent:Child
+    """
+
+    def __init__(self, rows):
+        """
+        :param rows:
+           a list of (id, parentId, accountType, accountName, currencyId)
+        """
+        self.by_id = {r[0]: Account(*r) for r in rows}
+        self.by_name = {}
+        self.roots = []
+
+        for acc in self.by_id.values():
+            parent = self.by_id.get(acc.parentId)
+            if parent is None:
+                self.roots.append(acc)
+            else:
+                parent.children.append(acc)
+
+        def _visit(acc, prefix, depth):
+            acc.name = prefix + acc.accountName
+            acc.depth = depth
+            acc.children.sort(key=lambda c: c.accountName)
+            self.by_name[acc.name] = acc
+            for c in acc.children:
+                _visit(c, acc.name + ':', depth + 1)
+
+        self.roots.sort(key=lambda c: c.accountName)
+        for r in self.roots:
+            _visit(r, '', 0)
+
+    def __iter__(self):
+        """
+        Iterate over all accounts, depth first, parents before children
+        """
+        todo = list(reversed(self.roots))
+        while todo:
+            acc = todo.pop()
+            yield acc
+            todo.extend(reversed(acc.children))
+
+    def __getitem__(self, key):
+        """
+        Find an account by id or fully qualified name
+        """
+        try:
+            return self.by_id[key]
+        except KeyError:
+            return self.by_name[key]
+
+    def subtree(self, key):
+        """
+        The ids of an account and all its descendants, suitable for the
+        `accounts` parameter of the various reports.
+        """
+        result = []
+        todo = [self[key]]
+        while todo:
+            acc = todo.pop()
+            result.append(acc.id)
+            todo.extend(acc.children)
+        return result
+
+    def to_rows(self):
+        return [
+            (a.id, a.accountType, a.name, a.accountName, a.currencyId,
+             a.parentId, a.depth)
+            for a in self
+        ]
+
+    def to_frame(self):
+        return pd.DataFrame(
+            self.to_rows(),
+            columns=['accountId', 'accountType', 'name', 'accountName',
+                     'currencyId', 'parentId', 'depth'],
+        )
+
+
+def _day_numbers(dates):
+    """
+    Convert "YYYY-MM-DD" strings to a number of days since 1970-01-01.
+    Return the days, and a boolean mask of the valid dates.
+    """
+    d = pd.to_datetime(
+        pd.Series(np.asarray(dates, dtype=object)),
+        format='%Y-%m-%d', errors='coerce')
+    valid = d.notna().to_numpy()
+    days = d.to_numpy().astype('datetime64[D]').astype(np.int64)
+    return np.where(valid, days, 0), valid
+
+
+def _quote_graph(pairs):
+    """
+    The graph of conversions between securities and currencies, given the
+    (fromId, toId) pairs that have quotes. A quote can also be used
+    inverted.
+    """
+    # Direct quotes are preferred over inverted ones, then the shortest
+    # path is used.
+    # ??? We could use the path with the most recent quotes instead
+    graph = collections.defaultdict(list)
+    for fromId, toId in pairs:
+        graph[fromId].append((toId, (fromId, toId), False))
+    for fromId, toId in pairs:
+        graph[toId].append((fromId, (fromId, toId), True))
+    return graph
+
+
+def _quote_path(graph, fromId, toId):
+    """
+    The list of ((quoteFrom, quoteTo), inverted) to convert from `fromId` to
+    `toId`, via a breadth-first search in the graph, or None.
+    """
+    previous = {fromId: None}
+    todo = collections.deque([fromId])
+    while todo:
+        node = todo.popleft()
+        if node == toId:
+            result = []
+            while previous[node] is not None:
+                node, pair, inverted = previous[node]
+                result.append((pair, inverted))
+            return result[::-1]
+        for other, pair, inverted in graph.get(node, []):
+            if other not in previous:
+                previous[other] = (node, pair, inverted)
+                todo.append(other)
+    return None
+
+
+class _QuoteHistory:
+    """
+    The same as-of rates as CurrencyConverter, computed one at a time with
+    the standard library only (see KMyMoney.ledger_rows). This is slower
+    for many lookups, but does not need to import pandas.
+    """
+
+    def __init__(self, rows):
+        """
+        :param rows: (fromId, toId, priceDate, price) sorted by date, where
+           price is either decoded or a "n/m" string from kmmPrices.
+        """
+        self._quotes = {}    # (fromId, toId) -> ([dates], [prices])
+        for fromId, toId, date, price in rows:
+            if isinstance(price, str):
+                try:
+                    price = float(Fraction(price))
+                except (ValueError, ZeroDivisionError):
+                    continue
+            if price is None:
+                continue
+            dates, prices = self._quotes.setdefault((fromId, toId), ([], []))
+            dates.append(date)
+            prices.append(price)
+        self._graph = _quote_graph(list(self._quotes))
+        self._paths = {}
+
+    def rate(self, fromId, toId, date):
+        """
+        The rate to convert from `fromId` to `toId` at the end of `date`, or
+        None when unknown.
+        """
+        if fromId == toId:
+            return 1.0
+        if (fromId, toId) not in self._paths:
+            self._paths[(fromId, toId)] = _quote_path(
+                self._graph, fromId, toId)
+        path = self._paths[(fromId, toId)]
+        if path is None:
+            return None
+        result = 1.0
+        for pair, inverted in path:
+            dates, prices = self._quotes[pair]
+            idx = bisect.bisect_right(dates, date) - 1
+            if idx < 0 or (inverted and prices[idx] == 0):
+                return None
+            result = result / prices[idx] if inverted \
+                else result * prices[idx]
+        return result
+
+
+class CurrencyConverter:
+    """
+    Convert amounts between securities and currencies, using all the quotes
+    from kmmPrices.
+
+    Quotes form a graph: a quote from A to B can also be used, inverted, to
+    convert from B to A, and conversions can go through multiple hops (for
+    instance a stock quoted in USD, then USD to EUR). The rates for a given
+    pair are computed once, as a dense array with one as-of rate per day,
+    so that looking up millions of (security, date) is a few numpy
+    operations.
+    """
+
+    def __init__(self, prices):
+        """
+        :param prices: a DataFrame with fromId, toId, priceDate and price
+        """
+        self.prices = prices
+        self._quotes = {}       # (fromId, toId) -> (days, prices)
+        self._rates = {}        # (fromId, toId) -> daily rates, or None
+        self._lock = threading.Lock()
+
+        p = prices[prices['price'].notna()]
+        days, valid = _day_numbers(p['priceDate'])
+        p = p.assign(day=days)[valid].sort_values(
+            ['fromId', 'toId', 'day'], kind='mergesort')
+        for (fromId, toId), g in p.groupby(['fromId', 'toId'], sort=False):
+            self._quotes[(fromId, toId)] = (
+                g['day'].to_numpy(), g['price'].to_numpy())
+
+        self._graph = _quote_graph(self._quotes)
+
+        self._first_day = int(p['day'].min()) if len(p) else 0
+        self._num_days = int(p['day'].max()) - self._first_day + 1 \
+            if len(p) else 0
+
+    def path(self, fromId, toId):
+        """
+        The list of quotes used to convert from `fromId` to `toId`, as
+        ((quoteFrom, quoteTo), inverted) tuples, or None if there is no
+        conversion.
+        """
+        return _quote_path(self._graph, fromId, toId)
+
+    def _daily_quotes(self, pair):
+        days, prices = self._quotes[pair]
+        idx = np.searchsorted(
+            days,
+            np.arange(self._first_day, self._first_day + self._num_days),
+            side='right') - 1
+        return np.where(idx >= 0, prices[np.maximum(idx, 0)], np.nan)
+
+    def daily_rates(self, fromId, toId):
+        """
+        The rate from `fromId` to `toId` for each day between the first and
+        last quote in the file (NaN before quotes are known), or None when
+        there is no conversion.
+        """
+        key = (fromId, toId)
+        with self._lock:
+            if key in self._rates:
+                return self._rates[key]
+
+        path = self.path(fromId, toId)
+        if path is None:
+            rates = None
+        else:
+            rates = np.ones(self._num_days)
+            for pair, inverted in path:
+                q = self._daily_quotes(pair)
+                if inverted:
+                    with np.errstate(divide='ignore'):
+                        rates = rates / q
+                else:
+                    rates = rates * q
+
+        with self._lock:
+            self._rates[key] = rates
+        return rates
+
+    def rates(self, fromIds, dates, toId):
+        """
+        The as-of rate to convert from each of `fromIds` to `toId`, at the
+        corresponding date, or NaN when unknown.
+        """
+        fromIds = np.asarray(fromIds, dtype=object)
+        days, valid = _day_numbers(dates)
+        idx = np.clip(days - self._first_day, 0, max(self._num_days - 1, 0))
+        valid &= days >= self._first_day
+        result = np.full(len(fromIds), np.nan)
+        codes, uniques = pd.factorize(fromIds)
+        for code, fromId in enumerate(uniques):
+            mask = codes == code
+            if fromId == toId:
+                result[mask] = 1.0
+                continue
+            daily = self.daily_rates(fromId, toId)
+            if daily is not None:
+                mask &= valid
+                result[mask] = daily[idx[mask]]
+        return result
+
+    def rates_matrix(self, fromIds, days, toId, dtype='float64'):
+        """
+        The as-of rates to convert from each of `fromIds` (columns) to
+        `toId`, at each of the `days` (rows, as returned by _day_numbers),
+        or NaN when unknown. The daily rates are already forward-filled, so
+        this is only a gather per column.
+        """
+        idx = np.clip(days - self._first_day, 0, max(self._num_days - 1, 0))
+        valid = days >= self._first_day
+        result = np.full((len(days), len(fromIds)), np.nan, dtype=dtype)
+        for col, fromId in enumerate(fromIds):
+            if fromId == toId:
+                result[:, col] = 1.0
+                continue
+            daily = self.daily_rates(fromId, toId)
+            if daily is not None:
+                result[valid, col] = daily[idx[valid]]
+        return result
+
+    def stock_prices(self, stocks, currency):
+        """
+        The price of stocks in `currency`, at each date they were quoted in
+        any currency, in the format of KMyMoney.price_history
+        :param stocks: a DataFrame with currencyId and accountName
+        """
+        p = self.prices[['fromId', 'priceDate']].drop_duplicates().merge(
+            stocks[['currencyId', 'accountName']],
+            left_on='fromId', right_on='currencyId')
+        p = pd.DataFrame({
+            'date': p['priceDate'],
+            'price': self.rates(p['fromId'], p['priceDate'], currency),
+            'name': p['accountName'],
+        })
+        return _price_pivot(p[p['price'].notna()])
+
+
+class ReportJob:
+    """
+    A report running in the background, see KMyMoney.submit
+    """
+
+    def __init__(self, future, cancelled):
+        self.future = future
+        self._cancelled = cancelled
+
+    def cancel(self):
+        """
+        Cancel the report. If it is already running, its current sqlite
+        query is interrupted, and the job raises CancelledError.
+        """
+        self._cancelled.set()
+        self.future.cancel()
+
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+    def add_done_callback(self, fn):
+        """
+        Call fn(job) when the job completes, is cancelled or fails
+        """
+        self.future.add_done_callback(lambda future: fn(self))
+
+
+class Debouncer:
+    """
+    Run a report for a rapid series of requests (for instance from notebook
+    widgets), computing only the most recent one. Each new request cancels
+    the previous one, and waits for `delay` seconds before starting, in
+    case another request comes in.
+
+        show = Debouncer(kmm, 'networth', callback=display)
+        widgets.interact(lambda maxdate: show(maxdate=maxdate), ...)
+    """
+
+    def __init__(self, kmm, report, callback=None, delay=0.3):
+        """
+        :param callback:
+           called with the result of the report, unless it was cancelled.
+           This runs in a background thread.
+        """
+        self.kmm = kmm
+        self.report = report
+        self.callback = callback
+        self.delay = delay
+        self._job = None
+        self._lock = threading.Lock()
+
+    def _done(self, job):
+        if job.cancelled() or job.future.cancelled():
+            return
+        exc = job.future.exception()
+        if exc is not None:
+            logging.getLogger(__name__).error(
+                '%s failed', self.report, exc_info=exc)
+        elif self.callback is not None:
+            self.callback(job.result())
+
+    def __call__(self, *args, **kwargs):
+        """
+        Request the report with new parameters. Return its ReportJob.
+        """
+        with self._lock:
+            if self._job is not None:
+                self._job.cancel()
+            self._job = self.kmm._submit(
+                self.report, args, kwargs, delay=self.delay)
+            job = self._job
+        job.add_done_callback(self._done)
+        return job
+
+    def cancel(self):
+        with self._lock:
+            if self._job is not None:
+                self._job.cancel()
+
+
+class SplitQuery:
+    """
+    A lazy query on the splits, built by chaining filters. Nothing is run
+    until the result is requested, and all filters are combined into a
+    single parameterized sqlite query:
+
+        kmm.splits().accounts(['A000001']).between('2020-01-01').payee(
+            'Supermarket').to_pandas()
+
+    Each method returns a new query, so a partial query can be reused.
+    """
+
+    def __init__(self, kmm, filters=()):
+        self.kmm = kmm
+        self._filters = filters   # tuple of (kind, values)
+
+    def _where(self, kind, *values):
+        return SplitQuery(self.kmm, self._filters + ((kind, values), ))
+
+    def accounts(self, accounts):
+        """
+        Only keep splits in these accounts.
+        :param accounts:
+           a single account id, or a list of ids (see AccountTree.subtree)
+        """
+        if isinstance(accounts, str):
+            accounts = [accounts]
+        return self._where('accounts', *accounts)
+
+    def between(self, mindate=None, maxdate=None):
+        """
+        Only keep splits between the two dates (inclusive). Either can be
+        None.
+        """
+        return self._where('between', _iso_date(mindate), _iso_date(maxdate))
+
+    def payee(self, *names):
+        """
+        Only keep splits whose payee is one of the names
+        """
+        return self._where('payee', *names)
+
+    def category(self, *categories):
+        """
+        Only keep splits whose transaction also has a split in one of the
+        categories (any account id in fact), for instance to find what was
+        paid from each account for some expense. The splits in the
+        categories themselves are not returned.
+        """
+        return self._where('category', *categories)
+
+    def sql(self):
+        """
+        Return the query and its parameters. The text of the query only
+        depends on the kind of filters and the number of values, so that
+        sqlite can reuse its prepared statement.
+        """
+        where = []
+        params = {}
+
+        def placeholders(prefix, values):
+            names = [f"{prefix}_{idx}" for idx in range(len(values))]
+            params.update(zip(names, values))
+            return ",".join(f":{n}" for n in names)
+
+        for num, (kind, values) in enumerate(self._filters):
+            prefix = f"{kind}{num}"
+            if kind == 'accounts':
+                where.append(
+                    f"s.accountId IN ({placeholders(prefix, values)})")
+            elif kind == 'between':
+                mindate, maxdate = values
+                if mindate is not None:
+                    where.append(f"s.postDate >= :{prefix}_min")
+                    params[f"{prefix}_min"] = mindate
+                if maxdate is not None:
+                    where.append(f"s.postDate <= :{prefix}_max")
+                    params[f"{prefix}_max"] = maxdate
+            elif kind == 'payee':
+                where.append(
+                    f"""k.payeeId IN (SELECT id FROM kmmPayees
+                    WHERE name IN ({placeholders(prefix, values)}))""")
+            elif kind == 'category':
+                p = placeholders(prefix, values)
+                where.append(
+                    f"""s.transactionId IN (SELECT c.transactionId
+                    FROM kmmSplits c WHERE c.accountId IN ({p}))
+                    AND s.accountId NOT IN ({p})""")
+
+        return f"""
+        SELECT
+           s.postDate as date,
+           s.transactionId,
+           s.splitId,
+           s.accountId,
+           qAccountName.name as accountName,
+           payee.name as payee,
+           s.action,
+           k.memo,
+           s.quantity,
+           s.price,
+           s.value
+        FROM {self.kmm._splits()} s
+           JOIN qAccountName using (accountId)
+           JOIN kmmSplits k using (transactionId, splitId)
+           LEFT JOIN kmmPayees payee ON (k.payeeId = payee.id)
+        WHERE {" AND ".join(where) or "TRUE"}
+        ORDER BY s.postDate, s.transactionId, s.splitId
+        """, params
+
+    @_profiled
+    def to_pandas(self):
+        return self.kmm._read_sql(*self.sql())
+
+    @_profiled
+    def __iter__(self):
+        """
+        Yield each split as a named tuple. A pooled connection is used until
+        the iteration completes.
+        """
+        query, params = self.sql()
+        with self.kmm._connection() as conn:
+            self.kmm._prepare_sidecar(conn)
+            self.kmm._prepare_temp_tables(conn)
+            batches = self.kmm._fetch_batches(conn, query, params, 1000)
+            row_type = collections.namedtuple('Split', next(batches))
+            for rows in batches:
+                for r in rows:
+                    yield row_type(*r)
+
+    def explain(self):
+        return self.kmm.explain(*self.sql())
+
+
+class KMyMoney:
+    """
+    A python interface to KMyMoney SQL files.
+
+    This assumes your file was saved using the SQL format, not the XML format.
+    It provides a number of high-level queries to create reports using the data
+    from this file.
+
+    This is a read-only interface to the file, always edit it via KMyMoney.
+    As such, it is safe to use this script in parallel with a KMyMoney session.
+
+    Queries are run on a small pool of read-only sqlite connections, which
+    are opened lazily and reused by all reports. The pool can be shared by
+    multiple threads. Call `close()` when done, or use the object as a
+    context manager:
+
+        with KMyMoney(filename) as kmm:
+            kmm.ledger(...)
+
+    Reports return DataFrames, and import pandas on first use. With the
+    default decode_amounts='sql', a small core only needs sqlite and the
+    standard library, which starts much faster (e.g. for scripts):
+       - `account_tree()`: the accounts and their fully qualified names
+       - `networth_at()`: the balance and value of accounts at a date
+       - `ledger_rows()`: the ledger, as named tuples
+       - iterating over `splits()`: the splits, as named tuples
+    """
+
+    def __init__(
+        self, filename, pool_size=4, immutable=False, decode_amounts='sql',
+        cache_size=32, cache_bytes=256 * 2**20, sidecar=None, profiler=None,
+    ):
+        """
+        :param pool_size:
+           maximum number of sqlite connections opened simultaneously. Extra
+           threads wait for a connection to be released.
+        :param immutable:
+           if True, sqlite assumes the file never changes while it is opened,
+           which saves some locking. Only use this when KMyMoney is not
+           running on the same file.
+        :param decode_amounts:
+           how the "n/m" amounts of splits are converted to numbers. With
+           "sql", this is done by sqlite string functions in each query. With
+           "numpy", the splits are fetched and decoded once (until the file
+           changes), and queries use the decoded values.
+        :param cache_size:
+           maximum number of report results kept in memory, so that calling
+           a report again with the same parameters is instant (see
+           `cache_info()`). Use 0 to disable.
+        :param cache_bytes:
+           maximum memory used by those cached results.
+        :param sidecar:
+           the name of an sqlite file, created if needed, where we store
+           indexed copies of splits and prices with decoded amounts, since we
+           cannot add indexes to the KMyMoney file itself. It is rebuilt when
+           the KMyMoney file changes, and reused across sessions otherwise.
+           Reports and snapshots then read from it. Each KMyMoney file needs
+           its own sidecar: using the sidecar of another file raises a
+           ValueError.
+        :param profiler:
+           a Profiler, to record the time spent in sqlite and in pandas by
+           each report. It can also be set later via the `profiler`
+           attribute, and reset to None to stop profiling.
+        """
+        assert decode_amounts in ('sql', 'numpy')
+        self.filename = filename
+
+        # For direct use with sqlalchemy or ipython-sql
+        self.sqlite = 'sqlite:///{}'.format(filename)
+
+        self._uri = 'file:{}?mode=ro{}'.format(
+            urllib.parse.quote(os.path.abspath(filename)),
+            '&immutable=1' if immutable else '',
+        )
+        self._pool = queue.LifoQueue()
+        self._pool_size = pool_size
+        self._connections = []   # all connections opened so far
+        self._lock = threading.Lock()
+        self._closed = False
+        self._decode_amounts = decode_amounts
+        self._sidecar = sidecar
+        self._sidecar_lock = threading.Lock()
+        self._attached = set()           # connections with sidecar attached
+
+        # Data computed once and reused until the file changes on disk
+        self._cache = {}
+        self._cache_signature = None
+        self._cache_lock = threading.Lock()
+        self._last_snapshot = None
+        self.results = ResultCache(
+            max_entries=cache_size, max_bytes=cache_bytes)
+
+        # For each connection, the cached data its temporary tables were
+        # last filled from
+        self._temp_tables = {}
+
+        self.profiler = profiler
+        self._profiling = threading.local()   # the current CallProfile
+
+        # Background reports, see submit()
+        self._executor = None
+        self._job = threading.local()   # the cancel event of the current job
+
+    def __enter__(self):
+        return self
+
+    def cache_info(self):
+        """
+        Statistics on the cache of report results (hits, misses,
+        evictions, number of entries and bytes used).
+        """
+        return self.results.info()
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Close all connections to the database. Connections currently used by
+        other threads are closed when they are released.
+        """
+        with self._lock:
+            self._closed = True
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            while True:
+                try:
+                    conn = self._pool.get_nowait()
+                except queue.Empty:
+                    break
+                conn.close()
+                self._connections.remove(conn)
+                self._temp_tables.pop(conn, None)
+                self._attached.discard(conn)
+
+    @contextlib.contextmanager
+    def _connection(self):
+        """
+        Borrow a connection from the pool for the duration of a `with` block
+        """
+        with self._lock:
+            if self._closed:
+                raise ValueError(f"{self.filename} has been closed")
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                if len(self._connections) < self._pool_size:
+                    conn = sqlite3.connect(
+                        self._uri, uri=True, check_same_thread=False)
+                    self._connections.append(conn)
+                else:
+                    conn = None
+
+        if conn is None:
+            conn = self._pool.get()   # wait for another thread
+
+        # In background jobs, let sqlite abort queries when the job is
+        # cancelled
+        cancelled = getattr(self._job, 'cancelled', None)
+        if cancelled is not None:
+            conn.set_progress_handler(cancelled.is_set, 10000)
+
+        try:
+            yield conn
+        finally:
+            if cancelled is not None:
+                conn.set_progress_handler(None, 0)
+            with self._lock:
+                if self._closed:
+                    conn.close()
+                    self._connections.remove(conn)
+                    self._temp_tables.pop(conn, None)
+                    self._attached.discard(conn)
+                else:
+                    self._pool.put(conn)
+
+    def _read_sql(self, query, params=None):
+        """
+        Execute a query on one of the pooled connections, and return the
+        result as a DataFrame.
+        The query can use the `qAccountName` table (see `_prepare_temp_tables`).
+        """
+        with self._connection() as conn:
+            self._prepare_sidecar(conn)
+            self._prepare_temp_tables(conn)
+            return self._query(conn, query, params=params)
+
+    def _query(self, conn, query, params=None):
+        """
+        Execute a query on the given connection, and return the result as a
+        DataFrame. When a profiler is active, the query is recorded.
+        """
+        call = getattr(self._profiling, 'call', None)
+        if call is None:
+            return pd.read_sql_query(query, conn, params=params)
+
+        start = time.perf_counter()
+        cursor = conn.execute(query, params or ())
+        rows = cursor.fetchall()
+        sql_end = time.perf_counter()
+        df = pd.DataFrame.from_records(
+            rows,
+            columns=[c[0] for c in cursor.description],
+            coerce_float=True,
+        )
+        end = time.perf_counter()
+        self._record_query(
+            conn, query, params, len(df), sql_end - start, end - sql_end)
+        return df
+
+    def _fetchall(self, conn, query, params=None):
+        """
+        Execute a query on the given connection, and return the list of
+        rows, without pandas. When a profiler is active, the query is
+        recorded.
+        """
+        start = time.perf_counter()
+        rows = conn.execute(query, params or ()).fetchall()
+        self._record_query(
+            conn, query, params, len(rows), time.perf_counter() - start)
+        return rows
+
+    def _fetch_batches(self, conn, query, params=None, size=10000):
+        """
+        Execute a query on the given connection, and yield lists of at most
+        `size` rows. The first item is the list of column names. When a
+        profiler is active, the query is recorded once all rows are read.
+        """
+        start = time.perf_counter()
+        cursor = conn.execute(query, params or ())
+        rows = 0
+        seconds = time.perf_counter() - start
+        try:
+            yield [c[0] for c in cursor.description]
+            while True:
+                start = time.perf_counter()
+                batch = cursor.fetchmany(size)
+                seconds += time.perf_counter() - start
+                if not batch:
+                    return
+                rows += len(batch)
+                yield batch
+        finally:
+            self._record_query(conn, query, params, rows, seconds)
+
+    def _record_query(
+            self, conn, query, params, rows, sql_seconds, pandas_seconds=0.0):
+        call = getattr(self._profiling, 'call', None)
+        if call is not None:
+            call.queries.append(QueryProfile(
+                sql=query,
+                params=params,
+                rows=rows,
+                sql_seconds=sql_seconds,
+                pandas_seconds=pandas_seconds,
+                plan=(self._explain(conn, query, params)
+                      if self.profiler.explain else None),
+            ))
+
+    def _explain(self, conn, query, params=None):
+        return pd.read_sql_query(
+            "EXPLAIN QUERY PLAN " + query, conn, params=params)
+
+    def explain(self, query, params=None):
+        """
+        Return sqlite's plan for a query, for instance to check which indexes
+        it uses:
+            kmm.explain(*kmm.splits().accounts('A000001').sql())
+        """
+        with self._connection() as conn:
+            self._prepare_sidecar(conn)
+            self._prepare_temp_tables(conn)
+            return self._explain(conn, query, params=params)
+
+    def _prepare_sidecar(self, conn):
+        """
+        Make sure the sidecar database (if any) is up-to-date with the file,
+        and attached to the connection as `accel`.
+        Return True if the sidecar is available.
+        The sidecar is checked every time, since other sessions or processes
+        might be using it too.
+        """
+        if self._sidecar is None:
+            return False
+
+        signature = repr(self._file_signature(conn))
+        current = (
+            conn.execute("SELECT filename, signature FROM accel.meta")
+            .fetchone()
+            if conn in self._attached else None
+        )
+        if current != (os.path.abspath(self.filename), signature):
+            with self._sidecar_lock:
+                self._build_sidecar(signature)
+
+        if conn not in self._attached:
+            conn.execute(
+                "ATTACH DATABASE ? AS accel",
+                ('file:{}?mode=ro'.format(
+                    urllib.parse.quote(os.path.abspath(self._sidecar))), ))
+            self._attached.add(conn)
+        return True
+
+    def _build_sidecar(self, signature):
+        """
+        Fill the sidecar database, unless it already contains data for this
+        version of the file (for instance from a previous session).
+        The copy is done by sqlite itself, without going through python.
+        A sidecar only ever contains data for one KMyMoney file.
+        """
+        filename = os.path.abspath(self.filename)
+        db = sqlite3.connect(
+            'file:{}'.format(urllib.parse.quote(os.path.abspath(self._sidecar))),
+            uri=True)
+        try:
+            version, = db.execute("PRAGMA user_version").fetchone()
+            if version != SIDECAR_VERSION:
+                db.executescript("""
+                    DROP TABLE IF EXISTS meta;
+                    DROP TABLE IF EXISTS splits;
+                    DROP TABLE IF EXISTS prices;""")
+                db.execute(f"PRAGMA user_version = {SIDECAR_VERSION}")
+            db.executescript(SIDECAR_SCHEMA)
+            row = db.execute("SELECT filename, signature FROM meta").fetchone()
+            if row is not None and row[0] != filename:
+                raise ValueError(
+                    f"{self._sidecar} is the sidecar of {row[0]},"
+                    f" not of {filename}")
+            if row == (filename, signature):
+                return
+
+            db.execute("ATTACH DATABASE ? AS kmm", (self._uri, ))
+            with db:
+                db.execute("DELETE FROM meta")
+                db.execute("DELETE FROM splits")
+                db.execute("DELETE FROM prices")
+                db.execute(f"""INSERT INTO splits
+                    SELECT transactionId, splitId, accountId, action,
+                       postDate,
+                       {self._to_float('shares')},
+                       {self._to_float('price')},
+                       {self._to_float('value')},
+                       payeeId, reconcileFlag, rowid
+                    FROM kmm.kmmSplits""")
+                db.execute(f"""INSERT INTO prices
+                    SELECT fromId, toId, priceDate, {self._to_float('price')}
+                    FROM kmm.kmmPrices""")
+                db.execute(
+                    "INSERT INTO meta VALUES (?, ?)", (filename, signature))
+            db.execute("DETACH DATABASE kmm")
+        finally:
+            db.close()
+
+    def _file_signature(self, conn):
+        """
+        A value that changes whenever KMyMoney saves the file
+        """
+        stats = tuple(
+            (f, os.stat(f).st_mtime_ns, os.stat(f).st_size)
+            for f in (self.filename, self.filename + '-wal')
+            if os.path.exists(f)
+        )
+        try:
+            info = tuple(conn.execute("SELECT * FROM kmmFileInfo").fetchall())
+        except sqlite3.OperationalError:
+            info = None
+        return (stats, info)
+
+    def _cached(self, conn, key, compute):
+        """
+        Return the cached value for `key`, or compute it via `compute(conn)`.
+        The cache is discarded when the file is modified.
+        """
+        signature = self._file_signature(conn)
+        with self._cache_lock:
+            if signature != self._cache_signature:
+                self._cache = {}
+                self._cache_signature = signature
+            try:
+                return self._cache[key]
+            except KeyError:
+                pass
+
+        value = compute(conn)
+
+        with self._cache_lock:
+            if signature == self._cache_signature:
+                self._cache[key] = value
+        return value
+
+    def _account_tree(self, conn):
+        return self._cached(
+            conn,
+            'account_tree',
+            lambda conn: AccountTree(conn.execute(
+                """SELECT id, parentId, accountType, accountName, currencyId
+                FROM kmmAccounts"""
+            ).fetchall()),
+        )
+
+    def account_tree(self):
+        """
+        Return the AccountTree, which is only recomputed when the file
+        changes. Use it to select whole subtrees, for instance:
+            kmm.ledger(accounts=kmm.account_tree().subtree('Asset:Brokerage'))
+        """
+        with self._connection() as conn:
+            return self._account_tree(conn)
+
+    def _dtypes(self, conn):
+        return self._cached(
+            conn,
+            'dtypes',
+            lambda conn: _ledger_dtypes(
+                self._account_tree(conn),
+                [r[0] for r in conn.execute("SELECT name FROM kmmPayees")]),
+        )
+
+    def dtypes(self):
+        """
+        The categorical dtypes used by reports with `compact=True`, which
+        only change when the file changes. All compact results share them,
+        so they can be concatenated, joined or filtered without converting
+        back to strings, for instance:
+            kmm.dtypes()['category'].categories
+        """
+        with self._connection() as conn:
+            return self._dtypes(conn)
+
+    def _converter(self, conn):
+        return self._cached(
+            conn,
+            'converter',
+            lambda conn: CurrencyConverter(self._fetch_prices(conn)),
+        )
+
+    def converter(self):
+        """
+        Return the CurrencyConverter built from all prices in the file,
+        which is only recomputed when the file changes.
+        """
+        with self._connection() as conn:
+            return self._converter(conn)
+
+    def _fetch_split_amounts(self, conn, where="", params=(), exact=False):
+        """
+        Fetch splits from the database and decode their amounts.
+        """
+        if not exact and self._prepare_sidecar(conn):
+            return self._query(
+                conn,
+                f"""SELECT transactionId, splitId, accountId, action,
+                       postDate, quantity, price, value, payeeId,
+                       reconcileFlag, splitRowid AS rowid
+                FROM accel.splits {where}""",
+                params=params,
+            )
+
+        df = self._query(
+            conn,
+            f"""SELECT transactionId, splitId, accountId, action, postDate,
+                   shares, price, value, payeeId, reconcileFlag, rowid
+            FROM kmmSplits {where}""",
+            params=params,
+        )
+        for field, column in (
+                ('shares', 'quantity'), ('price', 'price'),
+                ('value', 'value')):
+            df[column] = (
+                parse_fractions(df[field]) if exact
+                else rationals_to_float(*parse_rationals(df[field])))
+        return df[['transactionId', 'splitId', 'accountId', 'action',
+                   'postDate', 'quantity', 'price', 'value', 'payeeId',
+                   'reconcileFlag', 'rowid']]
+
+    def _fetch_prices(self, conn, where="", params=()):
+        """
+        Fetch prices from the database and decode them.
+        """
+        if self._prepare_sidecar(conn):
+            return self._query(
+                conn,
+                f"""SELECT fromId, toId, priceDate, price
+                FROM accel.prices {where}""",
+                params=params,
+            )
+
+        prices = self._query(
+            conn,
+            f"SELECT fromId, toId, priceDate, price FROM kmmPrices {where}",
+            params=params,
+        )
+        prices['price'] = rationals_to_float(*parse_rationals(prices['price']))
+        return prices
+
+    def _split_amounts(self, conn, exact=False):
+        return self._cached(
+            conn,
+            ('split_amounts', exact),
+            lambda conn: self._fetch_split_amounts(conn, exact=exact),
+        )
+
+    def splits(self):
+        """
+        Start a lazy query on the splits, see SplitQuery:
+            kmm.splits().accounts(ids).between(mindate, maxdate).to_pandas()
+        """
+        return SplitQuery(self)
+
+    @_profiled
+    def split_amounts(self, exact=False):
+        """
+        Return all splits, with their quantity, price and value decoded from
+        the "n/m" fields in the database. The result is cached until the file
+        changes.
+
+        :param exact:
+           if True, amounts are returned as `fractions.Fraction` instead of
+           floats, so they can be reconciled with KMyMoney to the cent.
+        """
+        with self._connection() as conn:
+            return self._split_amounts(conn, exact=exact)
+
+    def _prepare_temp_tables(self, conn):
+        """
+        Make sure the temporary tables are up-to-date for this connection.
+
+        `qAccountName` is similar to kmmAccounts, but account names are also
+        available fully qualified, including the parent accounts.
+
+        `qSplitAmounts` (only when decoding amounts via numpy) contains the
+        splits with their quantity, price and value already decoded.
+        """
+        tree = self._account_tree(conn)
+        amounts = (
+            self._split_amounts(conn)
+            if self._decode_amounts == 'numpy' and self._sidecar is None
+            else None
+        )
+        current = self._temp_tables.get(conn, (None, None))
+
+        if current[0] is not tree:
+            conn.execute(
+                """CREATE TEMP TABLE IF NOT EXISTS qAccountName (
+                   accountId TEXT PRIMARY KEY,
+                   accountType TEXT,
+                   name TEXT,
+                   accountName TEXT,
+                   currencyId TEXT,
+                   parentId TEXT,
+                   depth INTEGER
+                )""")
+            conn.execute("DELETE FROM temp.qAccountName")
+            conn.executemany(
+                "INSERT INTO temp.qAccountName VALUES (?, ?, ?, ?, ?, ?, ?)",
+                tree.to_rows())
+
+        if amounts is not None and current[1] is not amounts:
+            conn.execute(
+                """CREATE TEMP TABLE IF NOT EXISTS qSplitAmounts (
+                   transactionId TEXT,
+                   splitId INTEGER,
+                   accountId TEXT,
+                   action TEXT,
+                   postDate TEXT,
+                   quantity REAL,
+                   price REAL,
+                   value REAL,
+                   PRIMARY KEY (transactionId, splitId)
+                )""")
+            conn.execute("DELETE FROM temp.qSplitAmounts")
+            conn.executemany(
+                "INSERT INTO temp.qSplitAmounts VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                amounts.iloc[:, :8].itertuples(index=False, name=None))
+
+        conn.commit()
+        self._temp_tables[conn] = (tree, amounts)
+
+    @_memoized
+    def accounts(self):
+        """
+        List all accounts
+        """
+        return self.account_tree().to_frame()
+
+    def _to_float(self, fieldname):
+        """
+        Converts a "n/m" value as stored by KMyMoney to a float.
+        The `*Formatted` field in the database seem wrong sometimes.
+        """
+        return (
+            f"1.0 * substr({fieldname}, 0, instr({fieldname}, '/'))"
+            f"/substr({fieldname}, instr({fieldname}, '/') + 1)"
+        )
+
+    def _splits(self):
+        """
+        A table similar to kmmSplits, to be used in a FROM clause, with the
+        quantity, price and value decoded as numbers.
+        """
+        if self._sidecar is not None:
+            return "accel.splits"
+        if self._decode_amounts == 'numpy':
+            return "temp.qSplitAmounts"
+        return f"""(SELECT transactionId, splitId, accountId, action, postDate,
+              {self._to_float('shares')} as quantity,
+              {self._to_float('price')} as price,
+              {self._to_float('value')} as value
+           FROM kmmSplits)"""
+
+    def _fees_query(self):
+        """
+        A query that returns the total fees of each transaction, for the
+        transactions that involve a stock account (since fees only apply
+        to those). The currency is given by the `:currency` parameter.
+        It also returns the total absolute value (`stockValue`) and number
+        (`stockSplits`) of the stock splits of the transaction, so that fees
+        can be shared between them (see _splits_and_fees).
+
+        NOTE:
+        Only fees in the given currency are taken into account (so if you
+        have a mix of currencies for those fees, some will be ignored). See
+        Snapshot._split_fees, which converts the others.
+        """
+        return f"""SELECT fs.transactionId,
+
+          --  fees are computed on Expense accounts
+          --  ??? This is approximate
+          SUM(CASE WHEN ta.accountType = '{ACCOUNT_TYPE.EXPENSE}'
+                    AND ta.currencyId = :currency
+                   THEN fs.value END) as fees,
+
+          TOTAL(CASE ta.accountType WHEN '{ACCOUNT_TYPE.STOCK}'
+                THEN ABS(fs.value) END) as stockValue,
+          SUM(ta.accountType = '{ACCOUNT_TYPE.STOCK}') as stockSplits
+       FROM {self._splits()} fs
+       JOIN kmmAccounts ta ON (fs.accountId = ta.id)
+       WHERE fs.transactionId IN (
+          SELECT st.transactionId
+          FROM {self._splits()} st
+          JOIN kmmAccounts sa
+          ON (st.accountId = sa.id
+              AND sa.accountType = '{ACCOUNT_TYPE.STOCK}')
+       )
+       GROUP BY fs.transactionId
+       HAVING fees IS NOT NULL"""
+
+    @_profiled
+    def fees(self, currency=DEFAULT_CURRENCY):
+        """
+        Return the total fees of each transaction on stock accounts, as a
+        DataFrame with transactionId and fees. The result is cached until
+        the file changes.
+        """
+        def _compute(conn):
+            self._prepare_sidecar(conn)
+            self._prepare_temp_tables(conn)
+            return self._query(
+                conn, self._fees_query(), {"currency": currency}
+            )[['transactionId', 'fees']]
+
+        with self._connection() as conn:
+            return self._cached(conn, ('fees', currency), _compute).copy()
+
+    def _splits_and_fees(self, where=""):
+        """
+        return the Common Table Expression to compute the list of
+        all transactions include their fees. This works for both checking
+        transactions (which have no fee) and transactions on investments.
+
+        :param where:
+           extra conditions on the splits `s` to include.
+
+        Quantities, prices and values are computed from the "n/m" fields in
+        the database (see `_splits`), since the equivalent sharesFormatted,
+        priceFormatted and valueFormatted seem to be wrong sometimes.
+
+        Fees are aggregated once per transaction (see `_fees_query`) and
+        joined back, rather than joining each split with all other splits of
+        its transaction, which was quadratic in the size of transactions.
+        When a transaction has several stock splits (e.g. switching from one
+        fund to another), its fees are shared between them in proportion
+        to their value.
+        """
+        return f"""fees AS (
+       {self._fees_query()}
+    ),
+    splits_and_fees AS (
+       SELECT
+          s.transactionId,
+          s.splitId,
+          s.accountId,
+          s.action,
+          s.quantity,
+          s.price,
+          s.value,
+          s.postDate,
+
+          --   Fees only apply to Stock accounts
+          (CASE kmmAccounts.accountType
+              WHEN '{ACCOUNT_TYPE.STOCK}' THEN fees.fees * (
+                 CASE WHEN fees.stockValue > 0
+                    THEN COALESCE(ABS(s.value), 0) / fees.stockValue
+                    ELSE 1.0 / fees.stockSplits
+                 END)
+              ELSE NULL
+           END) as fees
+       FROM
+          {self._splits()} s
+          JOIN kmmAccounts ON (s.accountId = kmmAccounts.id)
+          LEFT JOIN fees ON (fees.transactionId = s.transactionId)
+       WHERE TRUE{where}
+    )
+         """
+
+    def _test_accounts(self, tablename="kmmSplits", accounts=None):
+        """
+        Restrict a query to a specific set of accounts.
+        The ids are passed as named parameters `:account0`, `:account1`,...
+        which must be added to the query's parameters via `_account_params`.
+        :param accounts:
+           either None (all accounts), a string for the name of a single
+           account, or a list of account ids.
+        """
+        params = self._account_params(accounts)
+        if not params:
+            return ""
+        return (
+            f" AND {tablename}.accountid IN (%s)"
+            % ",".join(f":{name}" for name in params)
+        )
+
+    @staticmethod
+    def _account_params(accounts=None):
+        """
+        The parameters for the placeholders inserted by `_test_accounts`.
+        """
+        return {
+            f"account{idx}": a
+            for idx, a in enumerate(_account_list(accounts) or [])
+        }
+
+    @_memoized
+    def networth(
+        self,
+        accounts=None,
+        currency=DEFAULT_CURRENCY,
+        by_year=False,
+        mindate=None,
+        maxdate=None,  # "2020-12-31"  (end of period)
+        with_total=True,
+        freq=None,
+        dtype='float64',
+    ):
+        """
+        Compute the networth for all accounts at the end of each month or year
+        in the given date range, see Snapshot.networth
+        """
+        return self.snapshot().networth(
+            accounts=accounts, currency=currency, by_year=by_year,
+            mindate=mindate, maxdate=maxdate, with_total=with_total,
+            freq=freq, dtype=dtype)
+
+    def _query_detailed_splits(
+        self,
+        accounts=None,
+        maxdate=None,     # "1900-01-01"
+        mindate=None,     # "1900-01-01"
+    ):
+        """
+        A query that returns data similar to kmmSplits, but each split has
+        detailed compatible with both checkins transactions and investment
+        transactions:
+           `quantity`: the number of units exchanged, in the account's
+              currency. For a checking account, this will be EUR for instance,
+              and for a stock account it will be the number of shares.
+           `price`: the price of each unit for this transaction. For a
+              checking account, it will be "1" in general. For a stock account
+              it will be the price per share, or null in case of
+              "add/remove shares".
+           `value`: the value of the transaction (typically quantity*price),
+              which does not include any fee paid to a third party.
+           `fees`: extra amount paid for banking fees. This is only set for
+              stock accounts, and null otherwise.
+           `balanceShares`: the current amount of units in the account (i.e.
+              the money in the account for a checking account, or the number of
+              shares for a stock account)
+
+        Only splits after `mindate` are returned, but the balance takes all
+        previous splits into account: their total is computed per account in
+        a single aggregate, and used as the opening balance.
+
+        The query expects the `:mindate`, `:maxdate` and `:currency`
+        parameters, as well as those from `_account_params`.
+        """
+        test_max_date = "" if maxdate is None else " AND s.postDate <= :maxdate"
+        if mindate is None:
+            opening = ""
+            opening_balance = ""
+            join_opening = ""
+        else:
+            test_max_date += " AND s.postDate >= :mindate"
+            opening = f""",
+        opening AS (
+           SELECT o.accountId, SUM(o.quantity) as balance
+           FROM {self._splits()} o
+           WHERE o.postDate < :mindate{self._test_accounts('o', accounts)}
+           GROUP BY o.accountId
+        )"""
+            opening_balance = "COALESCE(opening.balance, 0) + "
+            join_opening = "LEFT JOIN opening ON (opening.accountId = s.accountId)"
+
+        return f"""
+        WITH RECURSIVE
+        {self._splits_and_fees(
+            where=self._test_accounts('s', accounts) + test_max_date)}{opening}
+        SELECT
+           kmmAccounts.id as accountId,
+           kmmAccounts.currencyId as currencyId,
+           s.postDate as date,
+           s.transactionId,
+           s.splitId,
+           s.quantity,
+           s.price,
+           s.value,
+           s.fees,
+
+           --  compute a running total of shares, per account
+           {opening_balance}SUM(s.quantity) OVER (
+               PARTITION BY s.accountid ORDER BY s.postDate
+               ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+           ) as balanceShares
+        FROM splits_and_fees s
+          {join_opening}
+          JOIN kmmAccounts ON (kmmAccounts.id = s.accountId)
+        ORDER BY postDate
+            """
+
+    def _ledger_query(
+        self,
+        accounts=None,
+        currency=DEFAULT_CURRENCY,
+        mindate=None,
+        maxdate=None,
+    ):
+        """
+        The query used by ledger() and iter_ledger(), and its parameters.
+        Its result needs to go through _ledger_balance.
+        """
+        mindate, maxdate = _iso_date(mindate), _iso_date(maxdate)
+        q = self._query_detailed_splits(
+            accounts=accounts, maxdate=maxdate, mindate=mindate)
+        return (
+            f"""
+            SELECT
+               qAccountName.name as accountName,
+               s.date,
+               coalesce(payee.name, '') as payee,
+               destAccount.accountName as category,
+               (CASE kmmSplits.reconcileFlag
+                  WHEN '2' THEN 'R' WHEN '1' THEN 'C' ELSE '' END
+               ) as reconcile,
+               s.quantity as shares,  --  in account's currency (EUR, shares,...)
+               s.balanceShares as balanceShares,  --  in account's currency
+               s.price as pricePerShare,
+               (CASE WHEN destS.value > 0 THEN {self._to_float('destS.value')}
+                     ELSE NULL END) as paiement,
+               (CASE WHEN destS.value <= 0 THEN -{self._to_float('destS.value')}
+                     ELSE NULL END) as deposit,
+               s.currencyId
+            FROM ({q}) s
+               JOIN qAccountName using (accountId)
+               JOIN kmmSplits using (transactionId, splitId)
+               LEFT JOIN kmmSplits destS on
+                  (s.transactionId = destS.transactionId
+                   AND s.splitId != destS.splitId)
+               LEFT JOIN kmmAccounts destAccount
+                  ON (destS.accountId = destAccount.id)
+               LEFT JOIN kmmPayees payee on (kmmSplits.payeeId = payee.id)
+            ORDER BY s.date
+            """,
+            {
+                "mindate": mindate,
+                "maxdate": maxdate,
+                "currency": currency,
+                **self._account_params(accounts),
+            }
+        )
+
+    def _ledger_balance(self, ledger, currency, converter):
+        """
+        Add the `balance` column to the result of the ledger query, in the
+        given currency. The price is either from the transaction, or from the
+        historical prices via the converter (which defaults to 1 when the
+        account is already in the proper currency).
+        ??? The transaction price is in the currency of the transaction,
+        which might not be `currency`
+        """
+        currencyId = ledger.pop('currencyId')
+        price = ledger['pricePerShare'].to_numpy(dtype=float, copy=True)
+        missing = np.isnan(price)
+        price[missing] = converter.rates(
+            currencyId[missing], ledger['date'][missing], currency)
+        ledger['balance'] = ledger['balanceShares'].to_numpy() * price
+        return ledger
+
+    @_memoized
+    def ledger(
+        self,
+        accounts=None,
+        currency=DEFAULT_CURRENCY,
+        mindate=None,     # "1900-01-01"
+        maxdate=None,     # "1900-01-01"
+        compact=False,
+    ):
+        """
+        Compute the list of transactions in a given account, with an output
+        similar to kMyMoney. It reports data both in the account's currency
+        (EUR for checking accounts for instance, or number of shares for a
+        stock), and in EUR, using the historical prices to value the position
+        at the time.
+        
+        A split transaction (ie the money is split into multiple destination
+        accounts) will result in multiple lines, with the same balance.
+        For instance:
+            payee    shares   balanceShares   paiement   deposit  balance
+            Kraken   0.01     0.03               -         60.1    1200
+            Bank     0.01     0.03              0.1          -     1200
+
+        :param compact:
+           if True, text columns are categorical (see `dtypes()`), dates are
+           datetime64, and numbers are float32 when this loses no precision
+           (see _compact). This uses much less memory for large ledgers, and
+           makes groupby and filters faster.
+        """
+        query, params = self._ledger_query(
+            accounts=accounts, currency=currency, mindate=mindate,
+            maxdate=maxdate)
+        with self._connection() as conn:
+            converter = self._converter(conn)
+            dtypes = self._dtypes(conn) if compact else None
+        ledger = self._ledger_balance(
+            self._read_sql(query, params=params), currency, converter)
+        return _compact(ledger, dtypes) if compact else ledger
+
+    @_profiled
+    def iter_ledger(
+        self,
+        accounts=None,
+        currency=DEFAULT_CURRENCY,
+        mindate=None,
+        maxdate=None,
+        chunksize=10000,
+        compact=False,
+    ):
+        """
+        Same as ledger(), but yields DataFrames of at most `chunksize` rows,
+        in date order. Running balances are computed by sqlite over the whole
+        range, so they are correct across chunks, and memory usage does not
+        depend on the size of the file.
+        A pooled connection is used until the iteration completes.
+        """
+        query, params = self._ledger_query(
+            accounts=accounts, currency=currency, mindate=mindate,
+            maxdate=maxdate)
+        with self._connection() as conn:
+            self._prepare_sidecar(conn)
+            self._prepare_temp_tables(conn)
+            converter = self._converter(conn)
+            dtypes = self._dtypes(conn) if compact else None
+            batches = self._fetch_batches(conn, query, params, chunksize)
+            columns = next(batches)
+            empty = True
+            for rows in batches:
+                empty = False
+                yield self._ledger_chunk(
+                    rows, columns, currency, converter, dtypes)
+            if empty:
+                yield self._ledger_chunk(
+                    [], columns, currency, converter, dtypes)
+
+    @_profiled
+    def ledger_rows(
+        self,
+        accounts=None,
+        currency=DEFAULT_CURRENCY,
+        mindate=None,
+        maxdate=None,
+    ):
+        """
+        Same as ledger(), but yields each row as a named tuple, with None
+        for missing values. Like networth_at(), this only relies on sqlite
+        and the standard library, so pandas is not imported (with the
+        default decode_amounts='sql'). Rows are fetched in batches, so
+        memory usage does not depend on the size of the file.
+        A pooled connection is used until the iteration completes.
+        """
+        query, params = self._ledger_query(
+            accounts=accounts, currency=currency, mindate=mindate,
+            maxdate=maxdate)
+        with self._connection() as conn:
+            prices = (
+                "accel.prices" if self._prepare_sidecar(conn) else "kmmPrices")
+            self._prepare_temp_tables(conn)
+            quotes = _QuoteHistory(self._fetchall(
+                conn,
+                f"""SELECT fromId, toId, priceDate, price FROM {prices}
+                ORDER BY priceDate"""))
+            batches = self._fetch_batches(conn, query, params)
+            columns = next(batches)
+            date_idx = columns.index('date')
+            currency_idx = columns.index('currencyId')
+            balance_idx = columns.index('balanceShares')
+            price_idx = columns.index('pricePerShare')
+            row_type = collections.namedtuple(
+                'LedgerRow',
+                columns[:currency_idx] + columns[currency_idx + 1:]
+                + ['balance'])
+
+            # See _ledger_balance
+            for rows in batches:
+                for r in rows:
+                    price = r[price_idx]
+                    if price is None:
+                        price = quotes.rate(
+                            r[currency_idx], r[date_idx], currency)
+                    yield row_type(
+                        *r[:currency_idx], *r[currency_idx + 1:],
+                        None if price is None else r[balance_idx] * price)
+
+    def _ledger_chunk(self, rows, columns, currency, converter, dtypes):
+        chunk = self._ledger_balance(
+            pd.DataFrame.from_records(
+                rows, columns=columns, coerce_float=True),
+            currency, converter)
+        return _compact(chunk, dtypes) if dtypes is not None else chunk
+
+    @_profiled
+    def export_ledger_csv(self, filename, chunksize=10000, **kwargs):
+        """
+        Write the ledger to a CSV file, one chunk at a time.
+        :param kwargs: the parameters of ledger()
+        """
+        with open(filename, 'w', newline='') as f:
+            for idx, chunk in enumerate(
+                    self.iter_ledger(chunksize=chunksize, **kwargs)):
+                chunk.to_csv(f, header=(idx == 0), index=False)
+
+    @_profiled
+    def export_ledger_parquet(self, filename, chunksize=10000, **kwargs):
+        """
+        Write the ledger to a Parquet file, one row group per chunk.
+        This requires pyarrow.
+        :param kwargs: the parameters of ledger()
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema(
+            [(c, pa.string()) for c in (
+                'accountName', 'date', 'payee', 'category', 'reconcile')]
+            + [(c, pa.float64()) for c in (
+                'shares', 'balanceShares', 'pricePerShare', 'paiement',
+                'deposit', 'balance')]
+        )
+        chunks = self.iter_ledger(chunksize=chunksize, **kwargs)
+        first = next(chunks, None)
+        if first is not None and kwargs.get('compact'):
+            # Categorical and datetime64 columns (see _compact), whose types
+            # do not depend on the data, so the first chunk gives the schema
+            # of all of them. Numbers may only be float32 in some chunks.
+            schema = pa.Schema.from_pandas(first, preserve_index=False)
+            for idx, field in enumerate(schema):
+                if field.type == pa.float32():
+                    schema = schema.set(idx, field.with_type(pa.float64()))
+
+        with pq.ParquetWriter(filename, schema) as writer:
+            if first is not None:
+                chunks = itertools.chain([first], chunks)
+            for chunk in chunks:
+                writer.write_table(pa.Table.from_pandas(
+                    chunk, schema=schema, preserve_index=False))
+
+    @_profiled
+    def plot_by_category(
+        self,
+        accounts=None,
+        currency=DEFAULT_CURRENCY,
+        mindate=None,
+        maxdate=None,
+        values=['paiement'],  # could include 'deposit'
+        expenses=True,   # or Income
+        kind="pie",
+        subplots=True,   # True if each entry in `values` should be a subplot
+    ):
+        """
+        Generate a plot of paiements and deposits by category, for the given
+        time range.  Those are not the same as Expense and Income, because
+        nothing prevents us from doing a deposit in an Expense account, for
+        instance (e.g. a reimbursement for some earlier expense)
+        """
+        _plot_by_category(
+            self.by_category(
+                accounts=accounts, mindate=mindate, maxdate=maxdate,
+            ).reset_index(),
+            values=values, kind=kind, subplots=subplots,
+            mindate=mindate, maxdate=maxdate)
+
+    @_memoized
+    def by_category(
+        self,
+        accounts=None,
+        mindate=None,
+        maxdate=None,
+        level=None,
+    ):
+        """
+        The total paiements, deposits and amounts for each category in the
+        given time range, as used by plot_by_category, see
+        Snapshot.by_category
+        """
+        return self.snapshot().by_category(
+            accounts=accounts, mindate=mindate, maxdate=maxdate, level=level)
+
+    @_memoized
+    def _categories(
+        self,
+        accounts=None,
+        currency=DEFAULT_CURRENCY,
+        mindate=None,
+        maxdate=None,
+    ):
+        """
+        The amounts paid to or received from each Income or Expense account,
+        computed in sqlite. This is the same as by_category, without
+        grouping.
+        """
+        mindate, maxdate = _iso_date(mindate), _iso_date(maxdate)
+        q = self._query_detailed_splits(
+            accounts=accounts, maxdate=maxdate, mindate=mindate)
+        return self._read_sql(
+            f"""
+            SELECT
+               destAccount.accountName as category,
+               destAccount.accountType as categorytype,
+               (CASE WHEN destS.value > 0 THEN {self._to_float('destS.value')}
+                     ELSE NULL END) as paiement,
+               (CASE WHEN destS.value <= 0 THEN -{self._to_float('destS.value')}
+                     ELSE NULL END) as deposit,
+               -{self._to_float('destS.value')} as amount
+            FROM ({q}) s
+               JOIN kmmSplits destS on
+                  (s.transactionId = destS.transactionId
+                   AND s.splitId != destS.splitId)
+               JOIN kmmAccounts destAccount
+                  ON (destS.accountId = destAccount.id)
+            WHERE destAccount.accountType IN (:income, :expense)
+            """,
+            params={
+                "mindate": mindate,
+                "maxdate": maxdate,
+                "currency": currency,
+                "income": ACCOUNT_TYPE.INCOME,
+                "expense": ACCOUNT_TYPE.EXPENSE,
+                **self._account_params(accounts),
+            }
+        )
+
+    @_memoized
+    def price_history(self, accounts=None, currency=DEFAULT_CURRENCY):
+        """
+        Return a pivot table with a price history for investment accounts.
+        Prices quoted in other currencies are converted (see
+        CurrencyConverter).
+        """
+        with self._connection() as conn:
+            acc = self._account_tree(conn).to_frame()
+            converter = self._converter(conn)
+        acc = acc[acc['accountType'] == ACCOUNT_TYPE.STOCK]
+        ids = _account_list(accounts)
+        if ids is not None:
+            acc = acc[acc['accountId'].isin(ids)]
+        return converter.stock_prices(acc, currency)
+
+    @_memoized
+    def positions(
+        self,
+        accounts=None,
+        currency=DEFAULT_CURRENCY,
+        date=None,
+        method="fifo",
+    ):
+        """
+        Shares, book value, market value and gains of each stock account at
+        a given date, see Snapshot.positions
+        """
+        return self.snapshot().positions(
+            accounts=accounts, currency=currency, date=date, method=method)
+
+    @_memoized
+    def cost_basis(
+        self,
+        accounts=None,
+        currency=DEFAULT_CURRENCY,
+        method="fifo",
+        by_year=False,
+        mindate=None,
+        maxdate=None,
+        freq=None,
+    ):
+        """
+        Realized and unrealized gains of stock accounts for each period,
+        with "fifo" or "average" cost, see Snapshot.cost_basis
+        """
+        return self.snapshot().cost_basis(
+            accounts=accounts, currency=currency, method=method,
+            by_year=by_year, mindate=mindate, maxdate=maxdate, freq=freq)
+
+    @_profiled
+    def snapshot(self, incremental=False):
+        """
+        Load the tables used by the reports in memory, and return a Snapshot
+        that computes the same reports without any further SQL query. This
+        is much faster when reports are refreshed often, for instance from
+        notebook widgets. The snapshot is reused until the file changes.
+
+        :param incremental:
+           if True and a snapshot was loaded before, only read the data that
+           changed since then (see Snapshot for how changes are detected).
+           This is much faster when KMyMoney is running in parallel and only
+           a few transactions are added or modified.
+        """
+        def _load(conn):
+            snapshot = Snapshot(
+                self, conn,
+                previous=self._last_snapshot if incremental else None)
+            self._last_snapshot = snapshot
+            return snapshot
+
+        with self._connection() as conn:
+            return self._cached(conn, 'snapshot', _load)
+
+    @_profiled
+    def balance_at(self, account, date):
+        """
+        The balance of an account at the end of the given day, see
+        Snapshot.balance_at
+        """
+        return self.snapshot().balance_at(account, date)
+
+    @_profiled
+    def balances_at(self, dates, accounts=None):
+        """
+        The balances of accounts at the end of each of the given days, see
+        Snapshot.balances_at
+        """
+        return self.snapshot().balances_at(dates, accounts=accounts)
+
+    @_profiled
+    def networth_at(self, date=None, accounts=None, currency=DEFAULT_CURRENCY):
+        """
+        The value of each account at the end of `date` (today by default),
+        as a list of (accountName, balance, value) tuples sorted by name. The
+        balance is in the account's currency (or number of shares), and the
+        value in `currency`, using the last quotes before that date.
+
+        This is the same as the last column of networth(), but only relies
+        on sqlite and the standard library. pandas is not even imported,
+        which is much faster for command-line scripts.
+        """
+        date = _iso_date(date) or time.strftime('%Y-%m-%d')
+        with self._connection() as conn:
+            # Invalid and zero quotes are ignored
+            if self._prepare_sidecar(conn):
+                prices, valid = "accel.prices", "price != 0"
+            else:
+                prices, valid = "kmmPrices", (
+                    "price != '' AND price NOT LIKE '%/0'"
+                    " AND price NOT LIKE '0/%'")
+            self._prepare_temp_tables(conn)
+            tree = self._account_tree(conn)
+            balances = self._fetchall(
+                conn,
+                f"""SELECT s.accountId, SUM(s.quantity)
+                FROM {self._splits()} s
+                WHERE s.postDate <= :date{self._test_accounts('s', accounts)}
+                GROUP BY s.accountId""",
+                {"date": date, **self._account_params(accounts)},
+            )
+            graph = _quote_graph(self._fetchall(
+                conn,
+                f"""SELECT DISTINCT fromId, toId FROM {prices}
+                WHERE {valid} ORDER BY fromId, toId"""))
+
+            # sqlite returns the price from the row with the MAX date
+            quotes = {
+                (fromId, toId): float(Fraction(price))
+                for fromId, toId, price, _ in self._fetchall(
+                    conn,
+                    f"""SELECT fromId, toId, price, MAX(priceDate)
+                    FROM {prices} WHERE {valid} AND priceDate <= :date
+                    GROUP BY fromId, toId""",
+                    {"date": date})
+            }
+
+        def rate(currencyId):
+            path = _quote_path(graph, currencyId, currency)
+            result = 1.0
+            for pair, inverted in path or []:
+                if pair not in quotes:
+                    return 1.0   # ??? same as networth
+                result = result / quotes[pair] if inverted \
+                    else result * quotes[pair]
+            return result
+
+        rates = {}
+        result = []
+        for accountId, balance in balances:
+            acc = tree.by_id[accountId]
+            if acc.accountType in (
+                    ACCOUNT_TYPE.EXPENSE, ACCOUNT_TYPE.INCOME,
+                    ACCOUNT_TYPE.EQUITY):
+                continue
+            if acc.currencyId not in rates:
+                rates[acc.currencyId] = rate(acc.currencyId)
+            result.append(
+                (acc.name, balance, balance * rates[acc.currencyId]))
+        return sorted(result)
+
+    def _run_job(self, cancelled, delay, report, args, kwargs):
+        if delay:
+            cancelled.wait(delay)
+        if cancelled.is_set():
+            raise concurrent.futures.CancelledError()
+        self._job.cancelled = cancelled
+        try:
+            result = getattr(self, report)(*args, **kwargs)
+        except Exception:
+            if cancelled.is_set():
+                # sqlite was interrupted
+                raise concurrent.futures.CancelledError() from None
+            raise
+        finally:
+            self._job.cancelled = None
+        if cancelled.is_set():
+            raise concurrent.futures.CancelledError()
+        return result
+
+    def _submit(self, report, args, kwargs, delay=0):
+        with self._lock:
+            if self._closed:
+                raise ValueError(f"{self.filename} has been closed")
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self._pool_size,
+                    thread_name_prefix='kmymoney')
+        cancelled = threading.Event()
+        return ReportJob(
+            self._executor.submit(
+                self._run_job, cancelled, delay, report, args, kwargs),
+            cancelled,
+        )
+
+    def submit(self, report, *args, **kwargs):
+        """
+        Run a report (the name of a method, e.g. "networth") on a
+        background thread, and return a ReportJob. Cancelling the job aborts
+        its sqlite queries.
+            job = kmm.submit('ledger', accounts=['A000001'])
+            ...
+            df = job.result()
+        """
+        return self._submit(report, args, kwargs)
+
+    async def report_async(self, report, *args, **kwargs):
+        """
+        Same as submit(), as a coroutine. Cancelling the asyncio task also
+        cancels the report.
+            df = await kmm.report_async('networth', by_year=True)
+        """
+        job = self.submit(report, *args, **kwargs)
+        try:
+            return await asyncio.wrap_future(job.future)
+        except asyncio.CancelledError:
+            job.cancel()
+            raise
+
+
+def _account_list(accounts):
+    """
+    Normalize the `accounts` parameter of the reports (None, a single
+    account id or a list of ids) to either None or a list.
+    """
+    if isinstance(accounts, (list, tuple)):
+        return list(accounts)
+    elif accounts:
+        return [accounts]
+    else:
+        return None
+
+
+def _iso_date(date):
+    """
+    Normalize the date parameters of the reports, which can be given as
+    "YYYY-MM-DD" strings or as datetime.date (as returned by notebook
+    widgets), datetime.datetime or pandas.Timestamp, to strings.
+    """
+    if hasattr(date, 'strftime'):
+        return date.strftime('%Y-%m-%d')
+    return date
+
+
+def _period_ends(freq, first, maxdate):
+    """
+    The last day of each period of the given frequency (a pandas period
+    alias, e.g. "D", "W", "M", "Q" or "Y"), from the period that contains
+    `first` up to `maxdate` (included), as "YYYY-MM-DD" strings.
+    When `maxdate` is in the middle of a period, that partial period is
+    reported as of `maxdate`.
+    """
+    try:
+        last = pd.Timestamp(maxdate)
+    except ValueError:
+        # Dates like "2020-02-31" are accepted, since they compare fine as
+        # strings
+        last = pd.Period(maxdate[:7], freq='M').end_time
+    ends = pd.period_range(first, last, freq=freq).end_time.strftime('%Y-%m-%d')
+    ends = [d for d in ends if d <= maxdate]
+    last = last.strftime('%Y-%m-%d')
+    if last >= first and (not ends or ends[-1] < last):
+        ends.append(last)
+    return ends
+
+
+def _average_cost(quantity, amount):
+    """
+    Book value with the average cost method.
+    :param quantity: the number of shares bought (positive) or sold
+    :param amount:
+       the money paid for each trade including fees (negative for sales,
+       whose proceeds are -amount)
+    :return: (book value after each trade, realized gain of each trade)
+    """
+    # Scalar operations are much faster on lists than on numpy arrays
+    quantity = np.asarray(quantity, dtype=float).tolist()
+    amount = np.asarray(amount, dtype=float).tolist()
+    book = np.zeros(len(quantity))
+    realized = np.zeros(len(quantity))
+    shares = 0.0
+    value = 0.0
+    for i in range(len(quantity)):
+        q = quantity[i]
+        if q > 0:
+            shares += q
+            value += amount[i]
+        elif q < 0:
+            removed = value * min(-q / shares, 1.0) if shares > 0 else 0.0
+            realized[i] = -amount[i] - removed
+            value -= removed
+            shares += q
+            if shares <= 1e-9:
+                shares = value = 0.0
+        book[i] = value
+    return book, realized
+
+
+def _fifo_cost(quantity, amount):
+    """
+    Book value with the first-in first-out method: sold shares are taken
+    from the oldest lots first. Same parameters as _average_cost
+    """
+    # Scalar operations are much faster on lists than on numpy arrays
+    quantity = np.asarray(quantity, dtype=float).tolist()
+    amount = np.asarray(amount, dtype=float).tolist()
+    book = np.zeros(len(quantity))
+    realized = np.zeros(len(quantity))
+    lots = collections.deque()   # [shares, cost per share]
+    value = 0.0
+    for i in range(len(quantity)):
+        q = quantity[i]
+        if q > 0:
+            lots.append([q, amount[i] / q])
+            value += amount[i]
+        elif q < 0:
+            todo = -q
+            removed = 0.0
+            while todo > 1e-9 and lots:
+                lot = lots[0]
+                n = min(lot[0], todo)
+                removed += n * lot[1]
+                lot[0] -= n
+                todo -= n
+                if lot[0] <= 1e-9:
+                    lots.popleft()
+            # ??? Shares sold beyond what we hold have no cost
+            realized[i] = -amount[i] - removed
+            value = value - removed if lots else 0.0
+        book[i] = value
+    return book, realized
+
+
+COST_METHODS = {
+    'average': _average_cost,
+    'fifo': _fifo_cost,
+}
+
+
+class Snapshot:
+    """
+    An in-memory copy of the tables used by the reports, see
+    `KMyMoney.snapshot()`.
+
+    Tables are stored as compact DataFrames (ids are categorical, amounts are
+    decoded to floats), splits are sorted by date, and running balances are
+    computed once. Reports have the same parameters and output as the ones
+    of KMyMoney, but are computed with pandas and numpy only.
+
+    A snapshot never sees changes made to the file after it was loaded, but
+    a new snapshot can be created incrementally from an older one.
+    """
+
+    def __init__(self, kmm, conn, previous=None):
+        """
+        :param previous:
+           an older snapshot of the same file. Only the splits of accounts
+           that changed since then, and the prices of securities that changed,
+           are read from the database. Everything else, including running
+           balances, is reused.
+        """
+        self.tree = kmm._account_tree(conn)
+        self.accounts = self.tree.to_frame().set_index('accountId')
+        self.payees = kmm._query(
+            conn, "SELECT id, name FROM kmmPayees").set_index('id')['name']
+        self.securities = frozenset(
+            r[0] for r in conn.execute("SELECT id FROM kmmSecurities"))
+        self.tx_currency = dict(
+            conn.execute("SELECT id, currencyId FROM kmmTransactions"))
+
+        self._fees = {}              # currency -> fees for each split
+        self._converter = None       # see converter()
+        self._dtypes = None          # see dtypes()
+        self._cube = None            # see _category_cube()
+        self._balance_index = None   # see _balances
+
+        # What we know of the file, to detect changes in later snapshots
+        self._account_rows = {
+            r[0]: r for r in conn.execute("SELECT * FROM kmmAccounts")}
+        self._split_checksums = self._fetch_split_checksums(conn)
+        self._price_checksums = self._fetch_price_checksums(conn)
+
+        if previous is None:
+            self._set_splits(kmm._split_amounts(conn))
+            self._set_prices(kmm._fetch_prices(conn))
+        else:
+            changed = previous._changed_accounts(
+                self._account_rows, self._split_checksums)
+            self._set_splits(
+                kmm._fetch_split_amounts(
+                    conn,
+                    where="WHERE accountId IN ({})".format(
+                        ','.join('?' * len(changed))),
+                    params=list(changed),
+                ),
+                previous=previous,
+                changed=changed,
+            )
+            self._set_prices(previous._updated_prices(
+                kmm, conn, self._price_checksums))
+            if previous._cube is not None:
+                self._cube = self._updated_cube(previous._cube, changed)
+
+    def _changed_accounts(self, account_rows, split_checksums):
+        """
+        The ids of accounts whose splits might have changed since this
+        snapshot was loaded: either their row in kmmAccounts changed (which
+        KMyMoney does whenever it modifies a transaction), or their splits
+        were added, deleted or modified (other tools might not update the
+        account).
+        :param account_rows: the current contents of kmmAccounts
+        :param split_checksums: see _fetch_split_checksums
+        """
+        return set(
+            a for a in set(account_rows) | set(self._account_rows)
+            if account_rows.get(a) != self._account_rows.get(a)
+        ) | set(
+            a for a in set(split_checksums) | set(self._split_checksums)
+            if split_checksums.get(a) != self._split_checksums.get(a)
+        )
+
+    def _fetch_split_checksums(self, conn):
+        """
+        For each account, a digest of all its splits, which changes when
+        splits are added, removed or modified. The raw text is concatenated
+        by sqlite, so that python only hashes one string per account.
+        ??? sqlite does not guarantee the order of group_concat, though it
+        follows the subquery in practice. At worst, an account is reloaded
+        when it did not need to.
+        """
+        return {
+            accountId: hashlib.sha1(rows.encode()).digest()
+            for accountId, rows in conn.execute(
+                """SELECT accountId, group_concat(row, ';') FROM (
+                   SELECT accountId,
+                      transactionId || ',' || splitId || ','
+                      || quote(postDate) || ',' || quote(action) || ','
+                      || quote(shares) || ',' || quote(price) || ','
+                      || quote(value) || ',' || quote(payeeId) || ','
+                      || quote(reconcileFlag) AS row
+                   FROM kmmSplits
+                   ORDER BY accountId, transactionId, splitId)
+                GROUP BY accountId""")
+        }
+
+    def _fetch_price_checksums(self, conn):
+        """
+        For each (fromId, toId) pair, a digest of all its quotes, which
+        changes when quotes are added, removed or modified. The raw text is
+        hashed, which is much cheaper than decoding the prices again.
+        """
+        digests = {}
+        for fromId, toId, priceDate, price in conn.execute(
+                """SELECT fromId, toId, priceDate, price FROM kmmPrices
+                ORDER BY fromId, toId, priceDate"""):
+            key = (fromId, toId)
+            if key not in digests:
+                digests[key] = hashlib.sha1()
+            digests[key].update(f"{priceDate}={price};".encode())
+        return {k: d.digest() for k, d in digests.items()}
+
+    def _updated_prices(self, kmm, conn, checksums):
+        """
+        The prices from this snapshot, where the quotes of each pair whose
+        checksum changed are fetched again.
+        """
+        changed = [
+            k for k, v in checksums.items()
+            if self._price_checksums.get(k) != v
+        ]
+        unchanged = [k for k in checksums if k not in changed]
+        keep = pd.MultiIndex.from_frame(
+            self.prices[['fromId', 'toId']]).isin(unchanged)
+        return pd.concat(
+            [self.prices[keep]]
+            + [kmm._fetch_prices(
+                   conn, where="WHERE fromId = ? AND toId = ?", params=k)
+               for k in changed]
+        )
+
+    def _set_prices(self, prices):
+        self.prices = prices.sort_values(
+            ['toId', 'fromId', 'priceDate']).reset_index(drop=True)
+
+    def _set_splits(self, splits, previous=None, changed=None):
+        """
+        :param splits:
+           the decoded splits, as returned by KMyMoney._fetch_split_amounts.
+           When `previous` is specified, this only contains the splits of
+           the accounts in `changed`, and the other splits are copied from
+           the previous snapshot along with their balances.
+        """
+        columns = list(splits.columns)
+        if previous is not None:
+            keep = ~previous.splits['accountId'].isin(changed).to_numpy()
+            splits = pd.concat([
+                previous.splits.loc[keep, columns + ['balanceShares']]
+                .astype({c: object for c in columns
+                         if c in ('transactionId', 'accountId', 'action',
+                                  'payeeId', 'reconcileFlag')}),
+                splits,
+            ])
+
+        # Sort in the same order as a fresh load would, so that splits on the
+        # same day are in a stable order
+        splits = splits.sort_values(
+            ['postDate', 'rowid'], kind='mergesort').reset_index(drop=True)
+        acc = self.accounts.reindex(splits['accountId'])
+        splits['accountType'] = acc['accountType'].to_numpy()
+        splits['currencyId'] = acc['currencyId'].to_numpy()
+        splits['accountName'] = acc['accountName'].to_numpy()
+        splits['name'] = acc['name'].to_numpy()
+        for col in ('transactionId', 'accountId', 'action', 'payeeId',
+                    'reconcileFlag', 'accountType', 'currencyId',
+                    'accountName', 'name'):
+            splits[col] = splits[col].astype('category')
+
+        # Running total of shares, per account, in date order
+        if previous is None:
+            splits['balanceShares'] = splits.groupby(
+                'accountId', observed=True)['quantity'].cumsum()
+        else:
+            recompute = splits['accountId'].isin(changed).to_numpy()
+            splits.loc[recompute, 'balanceShares'] = splits[recompute].groupby(
+                'accountId', observed=True)['quantity'].cumsum()
+
+        self.splits = splits
+        self._dates = splits['postDate'].to_numpy(dtype=str)
+        self._days = None   # see _split_days
+        self._tx = splits['transactionId'].cat.codes.to_numpy()
+        self._splits_in_tx = np.bincount(
+            self._tx, minlength=len(splits['transactionId'].cat.categories))
+
+        if previous is not None and previous._balance_index is not None:
+            self._balances(
+                reuse={a: v for a, v in previous._balance_index.items()
+                       if a not in changed})
+
+    def memory_usage(self):
+        """
+        Number of bytes used by each of the tables
+        """
+        return pd.Series({
+            'accounts': self.accounts.memory_usage(deep=True).sum(),
+            'splits': self.splits.memory_usage(deep=True).sum(),
+            'prices': self.prices.memory_usage(deep=True).sum(),
+            'payees': self.payees.memory_usage(deep=True),
+        })
+
+    def converter(self):
+        """
+        The CurrencyConverter for the prices of this snapshot
+        """
+        if self._converter is None:
+            self._converter = CurrencyConverter(self.prices)
+        return self._converter
+
+    def _split_fees(self, currency):
+        """
+        For each split in a stock account, the sum of the splits in Expense
+        accounts of the same transaction, in the given currency. When there
+        are several stock splits in the transaction, fees are shared between
+        them in proportion to their value, as in KMyMoney._splits_and_fees.
+        Unlike the latter, fees in other currencies are converted as of the
+        transaction date (and are NaN if there is no known rate).
+        """
+        if currency not in self._fees:
+            s = self.splits
+            is_fee = (s['accountType'] == ACCOUNT_TYPE.EXPENSE).to_numpy()
+            # The quantity is in the currency of the Expense account, the
+            # value in the currency of the transaction
+            fees = s['quantity'].to_numpy()[is_fee]
+            currencyId = s['currencyId'].to_numpy()[is_fee]
+            foreign = (currencyId != currency)
+            if foreign.any():
+                fees = fees.copy()
+                fees[foreign] = (
+                    fees[foreign]
+                    * self.converter().rates(
+                        currencyId[foreign],
+                        s['postDate'].to_numpy()[is_fee][foreign],
+                        currency))
+            count = np.bincount(
+                self._tx[is_fee], minlength=len(self._splits_in_tx))
+            total = np.bincount(
+                self._tx[is_fee], weights=fees,
+                minlength=len(self._splits_in_tx))
+            by_tx = np.where(count > 0, total, np.nan)
+
+            is_stock = (s['accountType'] == ACCOUNT_TYPE.STOCK).to_numpy()
+            value = np.where(
+                is_stock, np.abs(np.nan_to_num(s['value'].to_numpy())), 0.0)
+            stock_value = np.bincount(
+                self._tx, weights=value, minlength=len(self._splits_in_tx))
+            stock_splits = np.bincount(
+                self._tx, weights=is_stock, minlength=len(self._splits_in_tx))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                share = np.where(
+                    stock_value[self._tx] > 0,
+                    value / stock_value[self._tx],
+                    1.0 / stock_splits[self._tx])
+            self._fees[currency] = np.where(
+                is_stock, by_tx[self._tx] * share, np.nan)
+        return self._fees[currency]
+
+    def _detailed_splits(self, accounts, currency, maxdate, mindate=None):
+        """
+        Same as KMyMoney._query_detailed_splits. The running balance is
+        computed on all splits, before filtering on `mindate`.
+        """
+        mindate, maxdate = _iso_date(mindate), _iso_date(maxdate)
+        s = self.splits
+        start = (
+            0 if mindate is None
+            else np.searchsorted(self._dates, mindate, side='left'))
+        end = (
+            len(s) if maxdate is None
+            else np.searchsorted(self._dates, maxdate, side='right'))
+        s = s.iloc[start:end]
+
+        ids = _account_list(accounts)
+        if ids is not None:
+            s = s[s['accountId'].isin(ids).to_numpy()]
+
+        s = s.assign(fees=self._split_fees(currency)[s.index])
+
+        # See KMyMoney._ledger_balance
+        price = s['price'].to_numpy(dtype=float, copy=True)
+        missing = np.isnan(price)
+        price[missing] = self.converter().rates(
+            s['currencyId'].to_numpy()[missing],
+            s['postDate'].to_numpy()[missing],
+            currency)
+        return s.assign(computedPrice=price)
+
+    def _with_destination(self, s, how):
+        """
+        Join each split with the other splits of the same transaction
+        (columns destAccountId, destAccountName, destAccountType and
+        destValue).
+        With how="left", splits alone in their transaction are kept, with
+        null destination.
+        """
+        # Only the transactions of `s` (whose index is the position in
+        # self.splits)
+        in_s = np.zeros(len(self._splits_in_tx), dtype=bool)
+        in_s[self._tx[s.index.to_numpy()]] = True
+        dest = self.splits[in_s[self._tx]]
+        dest = dest[['transactionId', 'splitId', 'accountId',
+                     'accountName', 'accountType', 'value']].rename(
+                            columns={
+                                'splitId': 'destSplitId',
+                                'accountId': 'destAccountId',
+                                'accountName': 'destAccountName',
+                                'accountType': 'destAccountType',
+                                'value': 'destValue',
+                            })
+        m = s.merge(dest, on='transactionId', how='inner')
+        is_self = (m['splitId'] == m['destSplitId']).to_numpy()
+        if how == 'left':
+            alone = self._splits_in_tx[
+                m['transactionId'].cat.codes.to_numpy()] == 1
+            m = m[~is_self | alone]
+            alone = alone[~is_self | alone]
+            m.loc[alone, ['destAccountName', 'destAccountType']] = np.nan
+            m.loc[alone, 'destValue'] = np.nan
+        else:
+            m = m[~is_self]
+        return m
+
+    def ledger(
+        self,
+        accounts=None,
+        currency=DEFAULT_CURRENCY,
+        mindate=None,
+        maxdate=None,
+        compact=False,
+    ):
+        """
+        Same as KMyMoney.ledger
+        """
+        s = self._detailed_splits(
+            accounts=accounts, currency=currency, maxdate=maxdate,
+            mindate=mindate)
+        m = self._with_destination(s, how='left')
+        value = m['destValue'].to_numpy()
+        with np.errstate(invalid='ignore'):
+            ledger = pd.DataFrame({
+                'accountName': m['name'].astype(object).to_numpy(),
+                'date': m['postDate'].to_numpy(),
+                'payee': m['payeeId'].astype(object).map(self.payees)
+                    .fillna('').to_numpy(),
+                'category': m['destAccountName'].astype(object).to_numpy(),
+                'reconcile': m['reconcileFlag'].astype(object)
+                    .map({'2': 'R', '1': 'C'}).fillna('').to_numpy(),
+                'shares': m['quantity'].to_numpy(),
+                'balanceShares': m['balanceShares'].to_numpy(),
+                'pricePerShare': m['price'].to_numpy(),
+                'paiement': np.where(value >= 0, value, np.nan),
+                'deposit': np.where(value < 0, -value, np.nan),
+                'balance': (m['balanceShares'] * m['computedPrice']).to_numpy(),
+            })
+        return _compact(ledger, self.dtypes()) if compact else ledger
+
+    def dtypes(self):
+        """
+        Same as KMyMoney.dtypes
+        """
+        if self._dtypes is None:
+            self._dtypes = _ledger_dtypes(self.tree, self.payees)
+        return self._dtypes
+
+    def plot_by_category(
+        self,
+        accounts=None,
+        currency=DEFAULT_CURRENCY,
+        mindate=None,
+        maxdate=None,
+        values=['paiement'],  # could include 'deposit'
+        expenses=True,   # or Income
+        kind="pie",
+        subplots=True,   # True if each entry in `values` should be a subplot
+    ):
+        """
+        Same as KMyMoney.plot_by_category
+        """
+        _plot_by_category(
+            self.by_category(
+                accounts=accounts, mindate=mindate, maxdate=maxdate,
+            ).reset_index(),
+            values=values, kind=kind, subplots=subplots,
+            mindate=mindate, maxdate=maxdate)
+
+    def _category_rows(self, s):
+        """
+        The amounts paid to or received from Income and Expense accounts by
+        the splits `s`, summed per (accountId, categoryId, month)
+        """
+        m = self._with_destination(s, how='inner')
+        m = m[m['destAccountType'].isin(
+            [ACCOUNT_TYPE.INCOME, ACCOUNT_TYPE.EXPENSE]).to_numpy()]
+        value = m['destValue'].to_numpy()
+        return pd.DataFrame({
+            'accountId': m['accountId'].astype(object).to_numpy(),
+            'categoryId': m['destAccountId'].astype(object).to_numpy(),
+            'month': m['postDate'].to_numpy().astype('U7'),
+            'paiement': np.where(value >= 0, value, 0.0),
+            'deposit': np.where(value < 0, -value, 0.0),
+            'amount': -value,
+        }).groupby(
+            ['accountId', 'categoryId', 'month'], as_index=False, sort=False,
+        ).sum()
+
+    def _category_cube(self):
+        """
+        The rollup used by by_category: for each account, category and
+        month, the sum of paiements, deposits and amounts. It only has a
+        few thousand rows, even for large files.
+        """
+        if self._cube is None:
+            self._cube = self._category_rows(self.splits)
+        return self._cube
+
+    def _updated_cube(self, cube, changed):
+        """
+        The cube of a previous snapshot, where the cells involving a changed
+        account (either as account or category) are recomputed.
+        """
+        splits = self.splits
+        tx = np.zeros(len(self._splits_in_tx), dtype=bool)
+        tx[self._tx[splits['accountId'].isin(changed).to_numpy()]] = True
+        rows = self._category_rows(splits[tx[self._tx]])
+        return pd.concat([
+            cube[~(cube['accountId'].isin(changed)
+                   | cube['categoryId'].isin(changed))],
+            rows[rows['accountId'].isin(changed)
+                 | rows['categoryId'].isin(changed)],
+        ], ignore_index=True)
+
+    def _splits_between(self, mindate, maxdate):
+        return self.splits.iloc[
+            np.searchsorted(self._dates, mindate, side='left'):
+            np.searchsorted(self._dates, maxdate, side='right')]
+
+    def by_category(
+        self,
+        accounts=None,
+        mindate=None,
+        maxdate=None,
+        level=None,
+    ):
+        """
+        The total paiements, deposits and amounts (deposits - paiements) of
+        the given accounts to each Income or Expense category, in the date
+        range. This is the data shown by plot_by_category.
 
+        Whole months are read from a pre-computed rollup (see
+        _category_cube), and only the days at the edges of the range are
+        computed from the splits.
 
-class KMyMoney:
-    """
-    A python interface to KMyMoney SQL files.
+        :param level:
+           if None, categories are identified by their name. Otherwise,
+           they are grouped with their ancestor at that depth in the account
+           tree (0 for "Expense" and "Income", 1 for top-level categories,...),
+           identified by its full name.
+        """
+        mindate, maxdate = _iso_date(mindate), _iso_date(maxdate)
+        cube = self._category_cube()
+        parts = []
+        first_full = last_full = None
 
-    This assumes your file was saved using the SQL format, not the XML format.
-    It provides a number of high-level queries to create reports using the data
-    from this file.
+        if mindate is not None:
+            first_full = mindate[:7]
+            if mindate[8:] > '01':
+                month_end = pd.Period(mindate[:7], freq='M').end_time.strftime(
+                    '%Y-%m-%d')
+                parts.append(self._category_rows(self._splits_between(
+                    mindate,
+                    month_end if maxdate is None else min(month_end, maxdate),
+                )))
+                first_full = (pd.Period(mindate[:7], freq='M') + 1).strftime(
+                    '%Y-%m')
 
-    This is a read-only interface to the file, always edit it via KMyMoney.
-    As such, it is safe to use this script in parallel with a KMyMoney session.
-    """
+        if maxdate is not None:
+            last_full = maxdate[:7]
+            month_end = pd.Period(maxdate[:7], freq='M').end_time.strftime(
+                '%Y-%m-%d')
+            if maxdate < month_end:
+                month_start = maxdate[:7] + '-01'
+                if mindate is None or mindate <= month_start:
+                    parts.append(self._category_rows(self._splits_between(
+                        month_start, maxdate)))
+                last_full = (pd.Period(maxdate[:7], freq='M') - 1).strftime(
+                    '%Y-%m')
 
-    def __init__(self, filename):
-        self.sqlite = 'sqlite:///{}'.format(filename)
+        in_range = np.ones(len(cube), dtype=bool)
+        if first_full is not None:
+            in_range &= (cube['month'] >= first_full).to_numpy()
+        if last_full is not None:
+            in_range &= (cube['month'] <= last_full).to_numpy()
+        p = pd.concat([cube[in_range]] + parts, ignore_index=True)
 
-    def _qaccount_name(self):
-        """
-        Return the Common Table Expression to compute the fully qualified
-        account names, including the parent accounts.
-        The contents is similar to kmmAccounts, but account names are also
-        available as:
-            Assets:Toplevel:Parent:Child
-        """
-        return """
-        qAccountName(
-           accountId, accountType, name, accountName, currencyId
-        ) AS (
-            SELECT kmmAccounts.id, kmmAccounts.accountType,
-                   kmmAccounts.accountName, kmmAccounts.accountName,
-                   kmmAccounts.currencyId
-               FROM kmmAccounts
-               WHERE kmmAccounts.parentId IS NULL
-            UNION ALL
-            SELECT kmmAccounts.id, kmmAccounts.accountType,
-                   qAccountName.name || ':' || kmmAccounts.accountName,
-                   kmmAccounts.accountName, kmmAccounts.currencyId
-               FROM qAccountName, kmmAccounts
-               WHERE kmmAccounts.parentId = qAccountName.accountId
-        )
-        """
-    
-    def accounts(self):
+        ids = _account_list(accounts)
+        if ids is not None:
+            p = p[p['accountId'].isin(ids)]
+
+        if level is None:
+            names = {a.id: a.accountName for a in self.tree}
+        else:
+            names = {}
+            for a in self.tree:
+                ancestor = a
+                while ancestor.depth > level:
+                    ancestor = self.tree[ancestor.parentId]
+                names[a.id] = ancestor.name
+
+        return p.assign(
+            category=p['categoryId'].map(names),
+        ).groupby('category')[['paiement', 'deposit', 'amount']].sum()
+
+    def _split_days(self):
         """
-        List all accounts
+        The date of each split, as a number of days (see _day_numbers), and
+        whether it is valid
         """
-        return pd.read_sql_query(
-            f"""
-            WITH RECURSIVE
-            {self._qaccount_name()}
-            SELECT * FROM qAccountName
-            """,
-            self.sqlite,
-        )
+        if self._days is None:
+            self._days = _day_numbers(self._dates)
+        return self._days
 
-    def _to_float(self, fieldname):
+    def _daily_values(self, acc, ends, currency, dtype):
         """
-        Converts a "n/m" value as stored by KMyMoney to a float.
-        The `*Formatted` field in the database seem wrong sometimes.
+        The value of each account in `acc` (rows) at the end of each day in
+        `ends` (columns), NaN before the first transaction of the account.
+        This builds a dense day x account matrix with the balance after the
+        last split of each day, forward-filled, and multiplies it with a
+        day x currency matrix of rates. With many periods, this is much
+        faster than binary searches per account and period.
         """
-        return (
-            f"1.0 * substr({fieldname}, 0, instr({fieldname}, '/'))"
-            f"/substr({fieldname}, instr({fieldname}, '/') + 1)"
-        )
+        days, valid = self._split_days()
+        end_days, _ = _day_numbers(ends)
+        if not len(end_days) or not valid.any():
+            return np.full((len(acc), len(end_days)), np.nan, dtype=dtype)
+        first = int(days[valid].min())
+        num_days = int(end_days.max()) - first + 1
 
-    def _splits_and_fees(self, currency=DEFAULT_CURRENCY):
-        """
-        return the Common Table Expression to compute the list of
-        all transactions include their fees. This works for both checking
-        transactions (which have no fee) and transactions on investments.
+        cols = pd.Index(acc.index).get_indexer(
+            self.splits['accountId'].astype(object))
+        keep = np.flatnonzero(valid & (cols >= 0) & (days - first < num_days))
 
-        This function also computes quantities, prices and values from
-        the "n/m" fields in the database, since the equivalent sharesFormatted,
-        priceFormatted and valueFormatted seem to be wrong sometimes.
+        # Splits are sorted by date, so we want the last occurrence of each
+        # (day, account), i.e. the first one in reverse order
+        _, last = np.unique(
+            ((days[keep] - first) * len(acc) + cols[keep])[::-1],
+            return_index=True)
+        last = keep[len(keep) - 1 - last]
+        balances = np.full((num_days, len(acc)), np.nan, dtype=dtype)
+        balances[days[last] - first, cols[last]] = \
+            self.splits['balanceShares'].to_numpy()[last]
 
-        NOTE:
-        Only fees in the given currency are taken into account (so if you
-        have a mix of currencies for those fees, some will be ignored).
-        """
-        return f"""splits_and_fees AS (
-       SELECT
-          s.transactionId,
-          s.splitId,
-          s.accountId,
-          s.action,
-          {self._to_float('s.shares')} as quantity,
-          {self._to_float('s.price')} as price,
-          {self._to_float('s.value')} as value,
-          s.postDate,
-          SUM({self._to_float('t.value')}) as fees
-       FROM
-          kmmSplits s
-          JOIN kmmAccounts ON (s.accountId = kmmAccounts.id)
-          LEFT JOIN
-            (kmmSplits
-             JOIN kmmAccounts ta
-             ON (
-                kmmSplits.accountId = ta.id
-
-                --  fees are computed on Expense accounts
-                --  ??? This is approximate
-                AND ta.accountType = {ACCOUNT_TYPE.EXPENSE}
-
-                AND ta.currencyId = "{currency}"
-             )
-         ) t
-         ON (s.transactionId = t.transactionId
-             AND s.splitId != t.splitId
-
-             --   Fees only apply to Stock accounts
-             AND kmmAccounts.accountType = {ACCOUNT_TYPE.STOCK}
-             )
-       GROUP BY 1,2,3,4,5,6,7,8
-    )
-         """
+        # Forward-fill: for each day and account, the row of the last known
+        # balance (row 0 is NaN when there is none)
+        rows = np.where(
+            np.isnan(balances), 0,
+            np.arange(num_days, dtype=np.int32)[:, None]).astype(np.int32)
+        np.maximum.accumulate(rows, axis=0, out=rows)
+        before = end_days < first
+        rows = rows[np.clip(end_days - first, 0, None)]
+        balances = np.take_along_axis(balances, rows, axis=0)
+        balances[before] = np.nan
 
-    def _price_history(
-        self,
-        currency,
-    ):
+        codes, currencies = pd.factorize(acc['currencyId'])
+        prices = self.converter().rates_matrix(
+            currencies, end_days, currency, dtype=dtype)
+        prices[np.isnan(prices)] = 1.0
+        return (balances * prices[:, codes]).T
+
+    def _balances(self, reuse={}):
+        """
+        The balance index: for each account, the sorted dates of its splits
+        and the balance after each split.
+        :param reuse: entries of the index which are known to be up-to-date
         """
-        Return the common table expression to compute the price history for
-        stocks, including the full time range that this price
-        applies.
+        if self._balance_index is None:
+            dates = self._dates
+            balances = self.splits['balanceShares'].to_numpy()
+            self._balance_index = {
+                a: reuse.get(a) or (dates[idx], balances[idx])
+                for a, idx in self.splits.groupby(
+                    'accountId', observed=True).indices.items()
+            }
+        return self._balance_index
+
+    def balance_at(self, account, date):
         """
-        return f"""price_history AS (
-       SELECT kmmPrices.*,
-          {self._to_float('price')} as computedPrice,
-          (
-             SELECT COALESCE(MIN(priceDate), '9000-01-01')
-             FROM kmmPrices m
-             WHERE kmmPrices.fromId = m.fromId
-               AND m.priceDate > kmmPrices.priceDate
-          ) as maxDate
-       FROM kmmPrices
-       WHERE kmmPrices.toId = "{currency}"
-      )
+        The balance of an account (in the account's currency, or number of
+        shares) at the end of the given day.
+        This is a binary search in the balance index.
         """
+        try:
+            dates, balances = self._balances()[account]
+        except KeyError:
+            return 0.0
+        idx = np.searchsorted(dates, _iso_date(date), side='right') - 1
+        return float(balances[idx]) if idx >= 0 else 0.0
 
-    def _test_accounts(self, tablename="kmmSplits", accounts=None):
+    def balances_at(self, dates, accounts=None):
         """
-        Restrict a query to a specific set of accounts.
-        :param accounts:
-           either None (all accounts), a string for the name of a single
-           account, or a list of account ids.
+        The balances of accounts at the end of each of the given days, as a
+        DataFrame with one row per account and one column per date.
         """
-        if isinstance(accounts, (list, tuple)):
-            return (
-                f" AND {tablename}.accountid in (%s)"
-                % ",".join("'%s'" % a for a in accounts)  # ??? unsafe
-            )
-        elif accounts:
-            return f" AND {tablename}.accountid = '{accounts}'"
-        else:
-            return ""
+        ids = _account_list(accounts)
+        if ids is None:
+            ids = list(self.accounts.index)
+        dates = np.asarray([_iso_date(d) for d in dates], dtype=str)
+        index = self._balances()
+        result = np.zeros((len(ids), len(dates)))
+        for row, a in enumerate(ids):
+            if a in index:
+                acc_dates, balances = index[a]
+                idx = np.searchsorted(acc_dates, dates, side='right') - 1
+                result[row] = np.where(
+                    idx >= 0, balances[np.maximum(idx, 0)], 0.0)
+        return pd.DataFrame(
+            result,
+            index=pd.Index(ids, name='accountId'),
+            columns=dates,
+        )
 
     def networth(
         self,
@@ -174,131 +3288,87 @@ class KMyMoney:
         mindate=None,
         maxdate=None,  # "2020-12-31"  (end of period)
         with_total=True,
+        freq=None,
+        dtype='float64',
     ):
         """
-        Compute the networth for all accounts at the end of each month or year
-        in the given date range. The result is a pivot table.
-        """
-
-        if by_year:
-            # this must be the first date in the file with transactions, since
-            # balances are computed by adding all transactions from the
-            # beginning of times.
-            # ??? should be computed
-            # It should be set to end of the periods
-            earliest_date = "2009-12-31"
-            inc = "+1 YEARS"
-            formatted = "%Y"
+        Compute the networth for all accounts at the end of each period in
+        the given date range. The result has one row per account, and one
+        column per period (labelled with the last day of the period). The
+        last period, if still in progress at `maxdate`, is labelled with
+        `maxdate` itself.
 
-        else:
-            earliest_date = "2009-01-01"
-            inc = "+1 MONTHS"
-            formatted = "%Y-%m"
+        Balances and prices are looked up at the end of each period via
+        binary searches in sorted arrays (see `balances_at`). For daily
+        periods, dense day x account matrices are used instead (see
+        `_daily_values`), so that a daily series over many years, e.g. for
+        drawdowns or volatility, only takes a fraction of a second:
+            kmm.networth(freq='B').loc['Total']
 
-        p = pd.read_sql_query(
-            f"""
-        WITH RECURSIVE
+        :param freq:
+           the length of periods, as a pandas period alias ("D", "B" for
+           business days, "W", "M", "Q", "Y",...). Defaults to yearly if
+           `by_year` is true, monthly otherwise.
+        :param dtype:
+           use 'float32' to halve the memory used by the result and the
+           daily matrices. Values then only have about 7 significant
+           digits.
+        :param maxdate:
+           the last day to report. Periods start with the one containing the
+           first transaction in the file.
+        """
+        if not len(self._dates):
+            return None
+        mindate, maxdate = _iso_date(mindate), _iso_date(maxdate)
+        freq = freq or ('Y' if by_year else 'M')
+        ends = _period_ends(
+            freq, str(self._dates[0]), maxdate or str(self._dates[-1]))
+        if not ends:
+            return None   # maxdate is before the first transaction
 
-        --  Generate the set of dates for which we want balances
-        all_dates(d) AS (
-            SELECT "{earliest_date}"
-            UNION ALL
-            SELECT DATE(d, "{inc}") FROM all_dates
-               WHERE DATE(d, "{inc}") <= "{maxdate}"
-        ),
-
-        --  We will need to compute the prices at the end of each period
-        {self._price_history(currency)},
-
-        --  The full list of accounts, including fully qualified names
-        {self._qaccount_name()},
-
-        --  For each account, the balanceShare after the last transaction
-        --  during each year. If there was no transaction, NULL is returned
-        balances AS (
-           SELECT DISTINCT
-               strftime("{formatted}", s.postDate) as date,
-               s.accountId,
-               LAST_VALUE(s.balanceShares)
-                  OVER (PARTITION BY strftime("{formatted}", s.postDate),
-                                     s.accountId
-                        ORDER BY s.postDate ASC
-                        RANGE BETWEEN UNBOUNDED PRECEDING
-                          AND UNBOUNDED FOLLOWING
-                  ) as balanceShares
-           FROM
-              (SELECT
-                  s.postDate,   --  ??? Could use LAST_VALUE, and a GROUP BY
-                  s.accountId,
-                   --  compute a running total of shares, per account
-                  SUM({self._to_float('s.shares')})
-                    OVER (PARTITION BY s.accountid
-                          ORDER BY s.postDate
-                          ROWS BETWEEN UNBOUNDED PRECEDING
-                             AND CURRENT ROW
-                             --  AND UNBOUNDED FOLLOWING
-                         ) as balanceShares
-               FROM kmmSplits s
-              ) s
-        )
+        acc = self.accounts[~self.accounts['accountType'].isin([
+            ACCOUNT_TYPE.EXPENSE, ACCOUNT_TYPE.INCOME, ACCOUNT_TYPE.EQUITY])]
+        ids = _account_list(accounts)
+        if ids is not None:
+            acc = acc[acc.index.isin(ids)]
+        if acc.empty:
+            return None
 
-        SELECT all_dates.d as date,
-           qAccountName.name as accountname,
-           qAccountName.accountId,
-           balances.balanceShares as balanceShares,
-           coalesce(price_history.computedPrice, 1) as computedPrice
-        FROM all_dates
-          JOIN qAccountName
-          LEFT JOIN balances
-            ON (strftime("{formatted}", all_dates.d) = balances.date
-                AND qAccountName.accountId = balances.accountId
-               )
-          LEFT JOIN price_history
-            ON (price_history.fromId = qAccountName.currencyId
-                AND all_dates.d >= price_history.priceDate
-                AND all_dates.d < price_history.maxDate
-            )
+        if freq in ('D', 'B'):
+            values = self._daily_values(acc, ends, currency, dtype)
+        else:
+            # Balances are unknown before the first transaction of an account
+            balances = self.balances_at(
+                ends, accounts=list(acc.index)).to_numpy()
+            index = self._balances()
+            first = np.array(
+                [index[a][0][0] if a in index else '9999' for a in acc.index])
+            balances[np.array(ends)[None, :] < first[:, None]] = np.nan
 
-        WHERE qAccountName.accountType not in (:expense, :income, :equity)
-           {self._test_accounts('qAccountName', accounts)}
-            """,
-            self.sqlite,
-            params={
-                "expense": ACCOUNT_TYPE.EXPENSE,
-                "income": ACCOUNT_TYPE.INCOME,
-                "equity": ACCOUNT_TYPE.EQUITY,
-            }
-        )
+            # Price of each share at the end of each period
+            prices = self.converter().rates(
+                np.repeat(acc['currencyId'].to_numpy(), len(ends)),
+                np.tile(ends, len(acc)),
+                currency,
+            ).reshape(len(acc), len(ends))
+            prices[np.isnan(prices)] = 1.0
+            values = (balances * prices).astype(dtype, copy=False)
 
-        pivot = pd.pivot_table(
-            p,
-            values=['balanceShares', 'computedPrice'],
-            index=['accountname'],
-            columns=['date'],
-            dropna=False,
+        p = pd.DataFrame(
+            values,
+            index=pd.Index(acc['name'], name='accountname'),
+            columns=pd.Index(ends, name='date'),
         )
+        if not p.index.is_unique:
+            p = p.groupby(level=0).sum(min_count=1)
+        p = p.sort_index()
 
-        # ??? If all balances are None, the column disappears
-        if 'balanceShares' not in pivot.columns:
-            return None
-
-        # Replace NaN with the last known value in the same row (propagate
-        # past balances)
-        pivot = pivot.groupby(level=0).fillna(axis=1, method='ffill')
-
-        # Compute the EUR balance, taking the number of shares of the last
-        # transaction, with the price computed at the end of each period.
-        p = pivot['balanceShares'] * pivot['computedPrice']
-
-        # Only remove old columns after we have propagated values
         if mindate:
             p = p[[c for c in p.columns if c >= mindate]]
 
         if with_total:
-            p =  pd.concat([
+            p = pd.concat([
                 p,
-                # pivot.sum(level=0).assign(accountname='Subtotal')
-                #   .set_index('accountname', append=True),
                 p.sum().to_frame().T
                    .assign(accountname='Total')
                    .set_index(['accountname'])
@@ -306,245 +3376,329 @@ class KMyMoney:
 
         return p
 
-    def _query_detailed_splits(
-        self,
-        accounts=None,
-        currency=DEFAULT_CURRENCY,
-        maxdate=None,     # "1900-01-01"
-    ):
+    def _cost_basis(self, accounts, currency, method, maxdate):
         """
-        A query that returns data similar to kmmSplits, but each split has
-        detailed compatible with both checkins transactions and investment
-        transactions:
-           `quantity`: the number of units exchanged, in the account's
-              currency. For a checking account, this will be EUR for instance,
-              and for a stock account it will be the number of shares.
-           `price`: the price of each unit for this transaction. For a
-              checking account, it will be "1" in general. For a stock account
-              it will be the price per share, or null in case of
-              "add/remove shares".
-           `value`: the value of the transaction (typically quantity*price),
-              which does not include any fee paid to a third party.
-           `fees`: extra amount paid for banking fees. This is only set for
-              stock accounts, and null otherwise.
-           `computedPrice`: the price of the unit as of the transaction. This
-              is either the price actually used in the transaction, or a price
-              coming from the price history.
-           `balanceShares`: the current amount of units in the account (i.e.
-              the money in the account for a checking account, or the number of
-              shares for a stock account)
+        Process the trades of stock accounts, in date order.
+        Return a dict {accountId: (dates, shares, book value, cumulative
+        realized gain, total invested)}, with one entry per trade.
+        The amount of a trade is its value plus its fees (see _split_fees),
+        in `currency`. The value is in the currency of the transaction, and
+        converted as of the transaction date (NaN if there is no known rate).
         """
-        test_max_date = "" if maxdate is None else " AND s.postDate <= :maxdate"
-        return f"""
-        WITH RECURSIVE
-        {self._splits_and_fees(currency)},
-        {self._price_history(currency)},
-        {self._qaccount_name()}
-        SELECT
-           kmmAccounts.id as accountId,
-           kmmAccounts.currencyId as currencyId,
-           s.postDate as date,
-           s.transactionId,
-           s.splitId,
-           s.quantity,
-           s.price,
-           s.value,
-           s.fees,
-           kmmSecurities.id as securityId,
-
-           --  price is either from the transaction, or from the historical
-           --  prices. If the account is already in the proper currency, price
-           --  defaults to 1
-           COALESCE(s.price, price_history.computedPrice,
-                    CASE kmmAccounts.currencyId
-                       WHEN "{currency}" THEN 1
-                       ELSE NULL
-                    END
-           ) as computedPrice,
-
-           --  compute a running total of shares, per account
-           SUM(s.quantity) OVER (
-               PARTITION BY s.accountid ORDER BY s.postDate
-               ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
-           ) as balanceShares
-        FROM splits_and_fees s
-          JOIN kmmAccounts ON (kmmAccounts.id = s.accountId)
-          LEFT JOIN kmmSecurities ON (kmmSecurities.id = kmmAccounts.currencyId)
-          LEFT JOIN price_history ON
-             (kmmSecurities.id = price_history.fromId
-              AND s.postDate >= price_history.priceDate
-              AND s.postDate < price_history.maxDate)
-        WHERE TRUE{self._test_accounts('s', accounts)}{test_max_date}
-        ORDER BY postDate
-            """
+        try:
+            compute = COST_METHODS[method]
+        except KeyError:
+            raise ValueError(
+                f"Unknown method {method!r}, expected one of"
+                f" {sorted(COST_METHODS)}") from None
+        s = self._detailed_splits(
+            accounts=accounts, currency=currency, maxdate=maxdate)
+        s = s[((s['accountType'] == ACCOUNT_TYPE.STOCK)
+               & (s['quantity'] != 0)).to_numpy()]
+        value = s['value'].fillna(0).to_numpy() * self.converter().rates(
+            s['transactionId'].map(self.tx_currency).to_numpy(dtype=object),
+            s['postDate'].to_numpy(),
+            currency)
+        amount = value + s['fees'].fillna(0).to_numpy()
+        quantity = s['quantity'].to_numpy()
+        result = {}
+        for a, idx in s.groupby('accountId', observed=True).indices.items():
+            book, realized = compute(quantity[idx], amount[idx])
+            result[a] = (
+                s['postDate'].to_numpy()[idx],
+                s['balanceShares'].to_numpy()[idx],
+                book,
+                np.cumsum(realized),
+                np.cumsum(np.where(quantity[idx] > 0, amount[idx], 0.0)),
+            )
+        return result
 
-    def ledger(
+    def positions(
         self,
         accounts=None,
         currency=DEFAULT_CURRENCY,
-        mindate=None,     # "1900-01-01"
-        maxdate=None,     # "1900-01-01"
+        date=None,
+        method="fifo",
     ):
         """
-        Compute the list of transactions in a given account, with an output
-        similar to kMyMoney. It reports data both in the account's currency
-        (EUR for checking accounts for instance, or number of shares for a
-        stock), and in EUR, using the historical prices to value the position
-        at the time.
-        
-        A split transaction (ie the money is split into multiple destination
-        accounts) will result in multiple lines, with the same balance.
-        For instance:
-            payee    shares   balanceShares   paiement   deposit  balance
-            Kraken   0.01     0.03               -         60.1    1200
-            Bank     0.01     0.03              0.1          -     1200
+        The position in each stock account at the end of `date` (defaults to
+        the last transaction), with one row per account:
+           `shares`: number of shares held
+           `invested`: total paid for all purchases, fees included
+           `bookValue`: cost of the shares currently held
+           `averagePrice`: bookValue / shares
+           `price`: price of a share as of `date`
+           `marketValue`: shares * price
+           `realized`: gains realized by sales up to `date`
+           `unrealized`: marketValue - bookValue
+           `return`: marketValue / bookValue - 1
+        :param method: how sold shares are matched with purchases, see
+           COST_METHODS
         """
-        test_min_date = "" if mindate is None else " AND s.date >= :mindate"
-        q = self._query_detailed_splits(
-            accounts=accounts, currency=currency, maxdate=maxdate)
-        return pd.read_sql_query(
-            f"""
-            WITH RECURSIVE {self._qaccount_name()}
-            SELECT
-               qAccountName.name as accountName,
-               s.date,
-               coalesce(payee.name, '') as payee,
-               destAccount.accountName as category,
-               (CASE kmmSplits.reconcileFlag
-                  WHEN '2' THEN 'R' WHEN '1' THEN 'C' ELSE '' END
-               ) as reconcile,
-               s.quantity as shares,  --  in account's currency (EUR, shares,...)
-               s.balanceShares as balanceShares,  --  in account's currency
-               s.price as pricePerShare,
-               (CASE WHEN destS.value > 0 THEN {self._to_float('destS.value')}
-                     ELSE NULL END) as paiement,
-               (CASE WHEN destS.value <= 0 THEN -{self._to_float('destS.value')}
-                     ELSE NULL END) as deposit,
-               s.balanceShares * s.computedPrice as balance
-            FROM ({q}) s
-               JOIN qAccountName using (accountId)
-               JOIN kmmSplits using (transactionId, splitId)
-               LEFT JOIN kmmSplits destS on
-                  (s.transactionId = destS.transactionId
-                   AND s.splitId != destS.splitId)
-               LEFT JOIN kmmAccounts destAccount
-                  ON (destS.accountId = destAccount.id)
-               LEFT JOIN kmmPayees payee on (kmmSplits.payeeId = payee.id)
-            WHERE TRUE{test_min_date}
-            """,
-            self.sqlite,
-            params={
-                "mindate": mindate,
-                "maxdate": maxdate,
-            }
+        date = _iso_date(date)
+        trades = self._cost_basis(accounts, currency, method, date)
+        if date is None:
+            date = str(self._dates[-1]) if len(self._dates) else ''
+        rows = []
+        for a, (dates, shares, book, realized, invested) in trades.items():
+            i = np.searchsorted(dates, date, side='right') - 1
+            if i >= 0:
+                rows.append((a, shares[i], invested[i], book[i], realized[i]))
+        p = pd.DataFrame(
+            rows,
+            columns=['accountId', 'shares', 'invested', 'bookValue',
+                     'realized'],
         )
+        acc = self.accounts.loc[p['accountId']]
+        p['price'] = self.converter().rates(
+            acc['currencyId'], np.repeat(date, len(p)), currency)
+        p['marketValue'] = p['shares'] * p['price']
+        p['unrealized'] = p['marketValue'] - p['bookValue']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            p['averagePrice'] = p['bookValue'] / p['shares']
+            p['return'] = p['marketValue'] / p['bookValue'] - 1
+        p.index = pd.Index(acc['name'].to_numpy(), name='accountname')
+        return p[['shares', 'invested', 'bookValue', 'averagePrice', 'price',
+                  'marketValue', 'realized', 'unrealized', 'return']
+                 ].sort_index()
 
-    def plot_by_category(
+    def cost_basis(
         self,
         accounts=None,
         currency=DEFAULT_CURRENCY,
+        method="fifo",
+        by_year=False,
         mindate=None,
         maxdate=None,
-        values=['paiement'],  # could include 'deposit'
-        expenses=True,   # or Income
-        kind="pie",
-        subplots=True,   # True if each entry in `values` should be a subplot
+        freq=None,
     ):
         """
-        Generate a plot of paiements and deposits by category, for the given
-        time range.  Those are not the same as Expense and Income, because
-        nothing prevents us from doing a deposit in an Expense account, for
-        instance (e.g. a reimbursement for some earlier expense)
+        The gains of stock accounts for each period (see networth for the
+        parameters), with one row per account and period:
+           `shares`, `bookValue` and `marketValue` at the end of the period
+           `realized`: gains realized by sales during the period
+           `unrealized`: marketValue - bookValue at the end of the period
         """
-        test_min_date = "" if mindate is None else " AND s.date >= :mindate"
-        q = self._query_detailed_splits(
-            accounts=accounts, currency=currency, maxdate=maxdate)
-        p = pd.read_sql(
-            f"""
-            SELECT
-               destAccount.accountName as category,
-               destAccount.accountType as categorytype,
-               (CASE WHEN destS.value > 0 THEN {self._to_float('destS.value')}
-                     ELSE NULL END) as paiement,
-               (CASE WHEN destS.value <= 0 THEN -{self._to_float('destS.value')}
-                     ELSE NULL END) as deposit,
-               -{self._to_float('destS.value')} as amount
-            FROM ({q}) s
-               JOIN kmmSplits destS on
-                  (s.transactionId = destS.transactionId
-                   AND s.splitId != destS.splitId)
-               JOIN kmmAccounts destAccount
-                  ON (destS.accountId = destAccount.id)
-            WHERE TRUE{test_min_date}
-               AND destAccount.accountType IN (:income, :expense)
-            """,
-            self.sqlite,
-            params={
-                "mindate": mindate,
-                "maxdate": maxdate,
-                "income": ACCOUNT_TYPE.INCOME,
-                "expense": ACCOUNT_TYPE.EXPENSE,
-            }
-        )
+        if not len(self._dates):
+            return None
+        mindate, maxdate = _iso_date(mindate), _iso_date(maxdate)
+        freq = freq or ('Y' if by_year else 'M')
+        ends = np.array(_period_ends(
+            freq, str(self._dates[0]), maxdate or str(self._dates[-1])))
+        if mindate:
+            ends = ends[ends >= mindate]
 
-        p = p[['category'] + list(values)].groupby(['category']).sum()
-        
-        # Unfortunately groupby() sometimes removes "nuisance columns"
-        for v in values:
-            if v not in p.columns:
-                p[v] = 0
-
-        if not p.empty:
-            # Group by category and sum the amounts
-            p = p.sort_values(values)
-            
-            if kind == 'pie':
-                params = dict(
-                    # no "y" parameter, this fails with pie plots
-                    autopct="%.2f%%",
-                    kind='pie',
-                    subplots=True,
-                )
+        frames = []
+        for a, (dates, shares, book, realized, _) in self._cost_basis(
+                accounts, currency, method, maxdate).items():
+            i = np.searchsorted(dates, ends, side='right') - 1
+            known = i >= 0
+            i = np.maximum(i, 0)
+            total = np.where(known, realized[i], 0.0)
+            if mindate:
+                j = np.searchsorted(dates, mindate, side='left') - 1
+                before = realized[j] if j >= 0 else 0.0
             else:
-                params = dict(
-                    y=values,
-                    kind=kind,
-                    subplots=subplots,
-                )
-            
-            p.plot(
-                **params,
-                title="{} - {}".format(mindate or "", maxdate or ""),
-                legend=None,
-                figsize=(20, 10),
-                logy=False
-            )
+                before = 0.0
+            frames.append(pd.DataFrame({
+                'accountname': self.accounts.at[a, 'name'],
+                'date': ends,
+                'shares': np.where(known, shares[i], 0.0),
+                'bookValue': np.where(known, book[i], 0.0),
+                'realized': np.diff(total, prepend=before),
+                'currencyId': self.accounts.at[a, 'currencyId'],
+            }))
+        if not frames:
+            return None
+        p = pd.concat(frames, ignore_index=True)
+        p['marketValue'] = p['shares'] * self.converter().rates(
+            p.pop('currencyId'), p['date'], currency)
+        p['unrealized'] = p['marketValue'] - p['bookValue']
+        return p.set_index(['accountname', 'date']).sort_index()[
+            ['shares', 'bookValue', 'marketValue', 'realized', 'unrealized']]
 
-    def price_history(self, accounts=None):
+    def price_history(self, accounts=None, currency=DEFAULT_CURRENCY):
         """
-        Return a pivot table with a price history for investment accounts
+        Same as KMyMoney.price_history
         """
-        p = pd.read_sql_query(
-            f"""
-            WITH RECURSIVE
-            {self._price_history('EUR')},
-            {self._qaccount_name()}
-            SELECT priceDate as date, computedPrice as price,
-                qAccountName.accountName as name
-            FROM price_history,
-               qAccountName
-            WHERE 
-               qAccountName.currencyId = price_history.fromId
-               AND qAccountName.accountType = 15
-               {self._test_accounts('qAccountName', accounts)}
-            """,
-            self.sqlite,
-        )
-        if p.empty:
-            return p
-        return pd.pivot_table(
-            p,
-            values='price',
-            index=['date'],
-            columns=['name'],
-        )
\ No newline at end of file
+        acc = self.accounts[
+            self.accounts['accountType'] == ACCOUNT_TYPE.STOCK]
+        ids = _account_list(accounts)
+        if ids is not None:
+            acc = acc[acc.index.isin(ids)]
+        return self.converter().stock_prices(acc, currency)
+
+
+JobTiming = collections.namedtuple(
+    'JobTiming',
+    ['filename', 'currency', 'report', 'seconds', 'rows', 'error'])
+
+
+def _run_job(filename, currency, report, kwargs, options):
+    """
+    Run one report in a worker process, on its own read-only connection
+    """
+    start = time.perf_counter()
+    with KMyMoney(filename, pool_size=1, cache_size=0, **options) as kmm:
+        method = getattr(kmm, report)
+        if 'currency' in inspect.signature(method).parameters:
+            kwargs = dict(kwargs, currency=currency)
+        result = method(**kwargs)
+    return result, time.perf_counter() - start
+
+
+def run_reports(
+    filenames,
+    currencies=(DEFAULT_CURRENCY, ),
+    reports=('networth', ),
+    max_workers=None,
+    **options,
+):
+    """
+    Run the same reports over several files and currencies, in parallel on
+    a pool of processes, and merge the results.
+
+    :param reports:
+       a list of report names (methods of KMyMoney), or of (name, kwargs)
+       tuples, for instance:
+           ['ledger', ('networth', {'by_year': True})]
+       A dict {label: spec} can be used instead to run the same report with
+       different parameters. Reports without a `currency` parameter (e.g.
+       accounts) give the same result for each currency.
+    :param max_workers: number of processes, defaults to the number of CPUs
+    :param options:
+       passed to KMyMoney(), for instance immutable=True. Since each file
+       needs its own sidecar, `sidecar` is a directory here, where the
+       sidecar of each file is created.
+    :return:
+       (results, timings).
+       `results` maps each report label to a DataFrame that concatenates the
+       results of all files and currencies, with two extra index levels
+       'file' and 'currency'. Results that are not DataFrames or Series
+       (e.g. for networth_at or balance_at) cannot be concatenated, and are
+       returned as a dict {(file, currency): result} instead.
+       `timings` is a DataFrame with one JobTiming per job. Jobs that failed
+       have their exception in the 'error' column, and are not merged.
+    """
+    if not isinstance(reports, dict):
+        reports = {
+            (r if isinstance(r, str) else r[0]): r for r in reports}
+    specs = {
+        label: (r, {}) if isinstance(r, str) else r
+        for label, r in reports.items()
+    }
+    unknown = [
+        name for name, _ in specs.values()
+        if name.startswith('_') or not callable(getattr(KMyMoney, name, None))
+    ]
+    if unknown:
+        raise ValueError(f"Unknown reports {unknown}")
+
+    file_options = {f: options for f in filenames}
+    if options.get('sidecar'):
+        os.makedirs(options['sidecar'], exist_ok=True)
+        for f in filenames:
+            file_options[f] = dict(options, sidecar=os.path.join(
+                options['sidecar'],
+                '{}-{}.sidecar'.format(
+                    os.path.basename(f),
+                    hashlib.sha1(os.path.abspath(f).encode()).hexdigest()[:8]),
+            ))
+            # Build it now, rather than in several workers at the same time
+            with KMyMoney(f, pool_size=1, **file_options[f]) as kmm:
+                with kmm._connection() as conn:
+                    kmm._prepare_sidecar(conn)
+
+    results = collections.defaultdict(dict)
+    timings = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as pool:
+        jobs = {
+            pool.submit(_run_job, f, cur, name, kwargs, file_options[f]):
+                (f, cur, label, name)
+            for f in filenames
+            for cur in currencies
+            for label, (name, kwargs) in specs.items()
+        }
+        for job in concurrent.futures.as_completed(jobs):
+            f, cur, label, name = jobs[job]
+            try:
+                result, seconds = job.result()
+            except Exception as e:
+                timings.append(JobTiming(f, cur, label, None, None, e))
+                continue
+            try:
+                rows = len(result)
+            except TypeError:   # networth() returns None when empty
+                rows = None
+            if result is not None:
+                results[label][(f, cur)] = result
+            timings.append(JobTiming(f, cur, label, seconds, rows, None))
+
+    merged = {}
+    for label in specs:
+        # Keep the order in which files and currencies were given
+        keys = [(f, cur) for f in filenames for cur in currencies
+                if (f, cur) in results[label]]
+        values = [results[label][k] for k in keys]
+        if not values:
+            continue
+        if all(isinstance(v, (pd.DataFrame, pd.Series)) for v in values):
+            merged[label] = pd.concat(
+                values, keys=keys, names=['file', 'currency'])
+        else:
+            merged[label] = dict(zip(keys, values))
+    return merged, pd.DataFrame(timings, columns=JobTiming._fields)
+
+
+def main(argv=None):
+    """
+    Command-line interface, for instance for a nightly cron job:
+        python -m kmymoney networth file.kmy --date 2020-12-31
+    Unless --freq is given, pandas is not imported.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='kmymoney', description="Reports on KMyMoney's SQL files")
+    commands = parser.add_subparsers(dest='command', required=True)
+    nw = commands.add_parser(
+        'networth', help='the value of each account at a given date')
+    nw.add_argument('filename')
+    nw.add_argument('--date', help='YYYY-MM-DD, defaults to today')
+    nw.add_argument('--currency', default=DEFAULT_CURRENCY)
+    nw.add_argument(
+        '--accounts', nargs='+',
+        help='names or ids of accounts, including their sub-accounts')
+    nw.add_argument(
+        '--freq',
+        help='report the value at the end of each period ("M", "Y",...) '
+             'instead of a single date')
+    nw.add_argument('--mindate', help='first period to report with --freq')
+    nw.add_argument('--sidecar', help='see KMyMoney(sidecar=...)')
+    args = parser.parse_args(argv)
+
+    with KMyMoney(args.filename, sidecar=args.sidecar) as kmm:
+        accounts = None
+        if args.accounts:
+            tree = kmm.account_tree()
+            accounts = [a for key in args.accounts for a in tree.subtree(key)]
+
+        if args.freq:
+            p = kmm.networth(
+                accounts=accounts, currency=args.currency, freq=args.freq,
+                mindate=args.mindate, maxdate=args.date)
+            if p is not None:
+                print(p.to_string(float_format='{:.2f}'.format))
+            return 0
+
+        rows = kmm.networth_at(
+            date=args.date, accounts=accounts, currency=args.currency)
+        rows.append(('Total', None, sum(r[2] for r in rows)))
+        width = max(len(r[0]) for r in rows)
+        for name, _, value in rows:
+            print(f'{name:{width}}  {value:14.2f}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,40 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark  # noqa: E402
+import kmymoney  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def filename(tmp_path_factory):
+    """
+    A small random file, shared by all tests (which must not modify it)
+    """
+    filename = str(tmp_path_factory.mktemp('data') / 'small.kmm')
+    benchmark.generate(filename, years=2, splits_per_day=2)
+    return filename
+
+
+@pytest.fixture
+def copy(filename, tmp_path):
+    """
+    A copy of the small file, which the test can modify
+    """
+    return shutil.copy(filename, str(tmp_path / 'copy.kmm'))
+
+
+@pytest.fixture(params=sorted(benchmark.CONFIGS))
+def kmm(request, filename, tmp_path):
+    """
+    The small file, opened with each of the configurations of the benchmark
+    """
+    options = dict(benchmark.CONFIGS[request.param])
+    if options.get('sidecar'):
+        options['sidecar'] = str(tmp_path / 'small.sidecar')
+    with kmymoney.KMyMoney(filename, cache_size=0, **options) as kmm:
+        yield kmm
@@ -0,0 +1,51 @@
+from fractions import Fraction
+
+import numpy as np
+import pytest
+
+import kmymoney
+
+
+def test_parse_rationals():
+    num, den = kmymoney.parse_rationals(['1/100', '-250/100', '3', '', None])
+    assert num.tolist() == [1, -250, 3, 0, 0]
+    assert den.tolist() == [100, 100, 1, 0, 0]
+    result = kmymoney.rationals_to_float(num, den)
+    np.testing.assert_array_equal(result, [0.01, -2.5, 3.0, np.nan, np.nan])
+
+
+def test_parse_rationals_invalid():
+    with pytest.raises(ValueError, match="'3/x'"):
+        kmymoney.parse_rationals(['1/2', '3/x', '4/5'])
+
+
+def test_parse_rationals_beyond_int64():
+    big = 2**70
+    num, den = kmymoney.parse_rationals(['1/2', f'{big}/{big * 4}'])
+    assert num.tolist() == [1, big]
+    assert den.tolist() == [2, big * 4]
+    np.testing.assert_array_equal(
+        kmymoney.rationals_to_float(num, den), [0.5, 0.25])
+
+
+def test_parse_fractions():
+    result = kmymoney.parse_fractions(['1/3', '', None, '5/0', '-7/100'])
+    assert result.tolist() == [
+        Fraction(1, 3), None, None, None, Fraction(-7, 100)]
+
+
+def test_decode_amounts(filename):
+    with kmymoney.KMyMoney(filename) as sql, \
+            kmymoney.KMyMoney(filename, decode_amounts='numpy') as numpy:
+        query = 'SELECT {}, {} FROM kmmSplits ORDER BY rowid'.format(
+            sql._to_float('shares'), sql._to_float('value'))
+        with sql._connection() as conn:
+            expected = np.array(conn.execute(query).fetchall(), dtype=float)
+        amounts = numpy.split_amounts().sort_values('rowid')
+        exact = numpy.split_amounts(exact=True).sort_values('rowid')
+
+    np.testing.assert_allclose(
+        amounts[['quantity', 'value']].to_numpy(), expected)
+    assert all(isinstance(v, Fraction) for v in exact['value'])
+    np.testing.assert_allclose(
+        exact[['quantity', 'value']].to_numpy(dtype=float), expected)
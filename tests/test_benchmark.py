@@ -0,0 +1,60 @@
+import json
+import shutil
+import sqlite3
+import subprocess
+import sys
+
+import benchmark
+import kmymoney
+
+
+def test_generate(tmp_path):
+    filename = str(tmp_path / 'tiny.kmm')
+    benchmark.generate(filename, years=1, splits_per_day=1, securities=2)
+    with sqlite3.connect(filename) as c:
+        for table in ('kmmAccounts', 'kmmTransactions', 'kmmSplits',
+                      'kmmPrices', 'kmmSecurities', 'kmmPayees'):
+            assert c.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        assert c.execute(
+            """SELECT COUNT(*) FROM kmmSplits s
+            LEFT JOIN kmmTransactions t ON (t.id = s.transactionId)
+            LEFT JOIN kmmAccounts a ON (a.id = s.accountId)
+            WHERE t.id IS NULL OR a.id IS NULL""").fetchone()[0] == 0
+
+    # Transactions are balanced
+    with kmymoney.KMyMoney(filename) as kmm:
+        s = kmm.split_amounts()
+    assert (s.groupby('transactionId')['value'].sum().abs() < 1e-6).all()
+
+
+def test_run(filename, tmp_path):
+    shutil.copy(filename, str(tmp_path / 'small.kmm'))
+    results = benchmark.run(
+        ['small'], ['sql', 'sidecar'], ['accounts', 'ledger_year'],
+        repeat=1, directory=str(tmp_path))
+    assert [(r['config'], r['case']) for r in results] == [
+        ('sql', 'accounts'), ('sql', 'ledger_year'),
+        ('sidecar', 'accounts'), ('sidecar', 'ledger_year')]
+    assert all(r['best'] > 0 and r['rows'] for r in results)
+    assert results[1]['rows'] == results[3]['rows']
+
+
+def test_command_line(filename, tmp_path):
+    shutil.copy(filename, str(tmp_path / 'small.kmm'))
+    output = str(tmp_path / 'results.json')
+    subprocess.run(
+        [sys.executable, benchmark.__file__, '--configs', 'sql',
+         '--cases', 'accounts', '--repeat', '1', '--directory',
+         str(tmp_path), '--output', output],
+        check=True, stderr=subprocess.DEVNULL)
+    with open(output) as f:
+        results = json.load(f)
+    assert [r['case'] for r in results['results']] == ['accounts']
+
+    compared = subprocess.run(
+        [sys.executable, benchmark.__file__, '--configs', 'sql',
+         '--cases', 'accounts', '--repeat', '1', '--directory',
+         str(tmp_path), '--compare', output],
+        check=True, stderr=subprocess.DEVNULL, stdout=subprocess.PIPE,
+        text=True).stdout
+    assert 'accounts' in compared.splitlines()[-1]
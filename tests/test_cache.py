@@ -0,0 +1,65 @@
+import sqlite3
+
+import kmymoney
+
+
+def _store(cache, signature, key, value):
+    # Values are only stored after a lookup, on the same version of the file
+    assert cache.get(signature, key) == (False, None)
+    cache.put(signature, key, value)
+
+
+def test_result_cache_lru():
+    cache = kmymoney.ResultCache(max_entries=2)
+    _store(cache, 'v1', 'a', 1)
+    _store(cache, 'v1', 'b', 2)
+    assert cache.get('v1', 'a') == (True, 1)     # 'b' is now the oldest
+    _store(cache, 'v1', 'c', 3)
+    assert cache.get('v1', 'b') == (False, None)
+    assert cache.get('v1', 'c') == (True, 3)
+    info = cache.info()
+    assert (info.hits, info.misses, info.evictions, info.entries) \
+        == (2, 4, 1, 2)
+
+    # A new version of the file discards everything
+    assert cache.get('v2', 'a') == (False, None)
+    assert cache.info().entries == 0
+    cache.put('v1', 'a', 1)     # result computed on the old version
+    assert cache.info().entries == 0
+
+
+def test_result_cache_bytes():
+    cache = kmymoney.ResultCache(max_bytes=1000)
+    _store(cache, 'v1', 'big', 'x' * 2000)
+    assert cache.info().entries == 0
+    _store(cache, 'v1', 'a', 'x' * 400)
+    _store(cache, 'v1', 'b', 'x' * 400)
+    _store(cache, 'v1', 'c', 'x' * 400)
+    assert cache.get('v1', 'a') == (False, None)
+    assert cache.info().entries == 2
+    assert cache.info().bytes <= 1000
+
+
+def test_memoized_reports(copy):
+    with kmymoney.KMyMoney(copy) as kmm:
+        ledger = kmm.ledger(accounts=['A_chk0'])
+        ledger['balance'] = 0      # callers get a copy
+        again = kmm.ledger(['A_chk0'])
+        assert kmm.cache_info().hits == 1
+        assert (again['balance'] != 0).any()
+        kmm.ledger(accounts=['A_chk1'])
+        assert kmm.cache_info().misses == 2
+
+        with sqlite3.connect(copy) as c:
+            c.execute("DELETE FROM kmmSplits WHERE accountId = 'A_chk0'")
+            c.execute("UPDATE kmmFileInfo SET lastModified = 'changed'")
+        assert len(kmm.ledger(accounts=['A_chk0'])) == 0
+        assert kmm.cache_info().misses == 3
+
+
+def test_cache_disabled(filename):
+    with kmymoney.KMyMoney(filename, cache_size=0) as kmm:
+        kmm.accounts()
+        kmm.accounts()
+        assert kmm.cache_info().entries == 0
+        assert kmm.cache_info().hits == 0
@@ -0,0 +1,82 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import kmymoney
+
+
+def test_as_of_quotes(filename):
+    with sqlite3.connect(filename) as c:
+        fromId, toId = c.execute(
+            "SELECT fromId, toId FROM kmmPrices WHERE toId = 'EUR'"
+            " ORDER BY fromId LIMIT 1").fetchone()
+        first, last = c.execute(
+            "SELECT MIN(priceDate), MAX(priceDate) FROM kmmPrices"
+            " WHERE fromId = ? AND toId = ?", (fromId, toId)).fetchone()
+        # Every day, including those without quotes, plus some before and
+        # after all quotes
+        dates = pd.date_range(
+            pd.Timestamp(first) - pd.Timedelta(days=3),
+            pd.Timestamp(last) + pd.Timedelta(days=3),
+        ).strftime('%Y-%m-%d')
+        expected = []
+        for date in dates:
+            price = c.execute(
+                """SELECT price FROM kmmPrices
+                WHERE fromId = ? AND toId = ? AND priceDate <= ?
+                ORDER BY priceDate DESC LIMIT 1""",
+                (fromId, toId, date)).fetchone()
+            expected.append(
+                np.nan if price is None else float(price[0].split('/')[0])
+                / float(price[0].split('/')[1]))
+
+    with kmymoney.KMyMoney(filename) as kmm:
+        rates = kmm.converter().rates([fromId] * len(dates), dates, toId)
+    np.testing.assert_allclose(rates, expected)
+
+
+@pytest.fixture
+def converter():
+    return kmymoney.CurrencyConverter(pd.DataFrame(
+        [
+            ('STOCK', 'USD', '2020-01-02', 10.0),
+            ('STOCK', 'USD', '2020-01-06', 12.0),
+            ('USD', 'EUR', '2020-01-01', 0.5),
+            ('USD', 'EUR', '2020-01-05', 0.8),
+            ('EUR', 'GBP', '2020-01-03', 0.9),
+            ('BAD', 'EUR', '2020-01-03', np.nan),
+        ],
+        columns=['fromId', 'toId', 'priceDate', 'price'],
+    ))
+
+
+def test_conversion_paths(converter):
+    assert converter.path('STOCK', 'EUR') == [
+        (('STOCK', 'USD'), False), (('USD', 'EUR'), False)]
+    assert converter.path('EUR', 'USD') == [(('USD', 'EUR'), True)]
+    assert converter.path('GBP', 'STOCK') == [
+        (('EUR', 'GBP'), True), (('USD', 'EUR'), True),
+        (('STOCK', 'USD'), True)]
+    assert converter.path('BAD', 'EUR') is None
+    assert converter.daily_rates('BAD', 'EUR') is None
+
+
+def test_conversion_rates(converter):
+    dates = ['2019-12-31', '2020-01-02', '2020-01-05', '2020-01-06',
+             '2021-01-01', 'invalid']
+    np.testing.assert_allclose(
+        converter.rates(['STOCK'] * 6, dates, 'EUR'),
+        [np.nan, 5.0, 8.0, 9.6, 9.6, np.nan])
+    np.testing.assert_allclose(
+        converter.rates(['EUR'] * 6, dates, 'USD'),
+        [np.nan, 2.0, 1.25, 1.25, 1.25, np.nan])
+    np.testing.assert_allclose(
+        converter.rates(['STOCK', 'GBP', 'EUR', 'BAD'], ['2020-01-04'] * 4,
+                        'EUR'),
+        [5.0, 1 / 0.9, 1.0, np.nan])
+    days, _ = kmymoney._day_numbers(['2020-01-02', '2020-01-06'])
+    np.testing.assert_allclose(
+        converter.rates_matrix(['STOCK', 'EUR'], days, 'EUR'),
+        [[5.0, 1.0], [9.6, 1.0]])
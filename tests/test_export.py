@@ -0,0 +1,74 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import benchmark
+import kmymoney
+
+
+def test_iter_ledger(kmm):
+    mindate, maxdate = benchmark._mid_year(kmm)
+    expected = kmm.ledger(mindate=mindate, maxdate=maxdate)
+    chunks = list(kmm.iter_ledger(
+        mindate=mindate, maxdate=maxdate, chunksize=100))
+    assert len(chunks) == -(-len(expected) // 100)
+    assert all(len(c) <= 100 for c in chunks)
+    pd.testing.assert_frame_equal(
+        pd.concat(chunks, ignore_index=True), expected)
+
+
+def test_iter_ledger_empty(kmm):
+    chunks = list(kmm.iter_ledger(maxdate='2000-01-01'))
+    assert len(chunks) == 1
+    assert len(chunks[0]) == 0
+    assert list(chunks[0].columns) == list(kmm.ledger().columns)
+
+
+def test_export_csv(kmm, tmp_path):
+    path = str(tmp_path / 'ledger.csv')
+    kmm.export_ledger_csv(path, chunksize=100, accounts=['A_chk0'])
+    text = ['accountName', 'date', 'payee', 'category', 'reconcile']
+    result = pd.read_csv(path, dtype={c: str for c in text})
+    result[text] = result[text].fillna('')
+    pd.testing.assert_frame_equal(result, kmm.ledger(accounts=['A_chk0']))
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_export_parquet(kmm, tmp_path, compact):
+    pytest.importorskip('pyarrow')
+    path = str(tmp_path / 'ledger.parquet')
+    kmm.export_ledger_parquet(
+        path, chunksize=100, accounts=['A_chk0', 'A_stk0'], compact=compact)
+    expected = kmm.ledger(accounts=['A_chk0', 'A_stk0'], compact=compact)
+    pd.testing.assert_frame_equal(
+        pd.read_parquet(path), expected, check_categorical=False)
+
+
+def test_export_compact_parquet(copy, tmp_path):
+    pytest.importorskip('pyarrow')
+    with sqlite3.connect(copy) as c:
+        c.execute(
+            """UPDATE kmmSplits SET shares = '1/3' WHERE rowid = (
+               SELECT MAX(rowid) FROM kmmSplits WHERE accountId = 'A_stk0')""")
+    path = str(tmp_path / 'ledger.parquet')
+    with kmymoney.KMyMoney(copy) as kmm:
+        kmm.export_ledger_parquet(
+            path, chunksize=10, accounts=['A_stk0'], compact=True)
+        expected = kmm.ledger(accounts=['A_stk0'], compact=True)
+        ledger = kmm.ledger(accounts=['A_stk0'])
+        dtypes = [c['shares'].dtype for c in kmm.iter_ledger(
+            accounts=['A_stk0'], chunksize=10, compact=True)]
+
+    # Shares are float32 in the first chunk, but not in all of them
+    assert dtypes[0] == np.float32 and np.float64 in dtypes
+    result = pd.read_parquet(path)
+    pd.testing.assert_frame_equal(
+        result, expected, check_categorical=False, check_dtype=False)
+
+    # No amount is rounded
+    numbers = ['shares', 'balanceShares', 'pricePerShare', 'paiement',
+               'deposit', 'balance']
+    pd.testing.assert_frame_equal(
+        result[numbers], ledger[numbers], check_exact=True)
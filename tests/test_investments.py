@@ -0,0 +1,130 @@
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import kmymoney
+
+
+def _switch_funds(filename):
+    """
+    Sell shares of one fund to buy another one, with a single fee for the
+    whole transaction.
+    """
+    with sqlite3.connect(filename) as c:
+        date = c.execute(
+            "SELECT MAX(postDate) FROM kmmSplits WHERE accountId = 'A_stk0'"
+        ).fetchone()[0]
+        c.execute(
+            """INSERT INTO kmmTransactions (id, txType, postDate, memo,
+               entryDate, currencyId) VALUES ('T_switch', 'N', ?, '', ?,
+               'EUR')""",
+            (date, date))
+        for splitId, accountId, value, shares in (
+                (0, 'A_stk0', '-300/1', '-3/1'),
+                (1, 'A_stk1', '290/1', '5/1'),
+                (2, 'A_fees', '10/1', '10/1')):
+            c.execute(
+                """INSERT INTO kmmSplits (transactionId, txType, splitId,
+                   payeeId, action, reconcileFlag, value, shares, price, memo,
+                   accountId, postDate) VALUES
+                   ('T_switch', 'N', ?, 'P000001', '', '0', ?, ?, '1/1', '',
+                    ?, ?)
+                """,
+                (splitId, value, shares, accountId, date))
+        c.execute("UPDATE kmmFileInfo SET lastModified = 'changed'")
+
+
+def _fees(kmm):
+    """The fees of each stock split, computed in sqlite"""
+    return kmm._read_sql(
+        f"""SELECT transactionId, accountId, fees
+        FROM ({kmm._query_detailed_splits()}) s
+        WHERE fees IS NOT NULL
+        ORDER BY transactionId, accountId""",
+        {"currency": kmymoney.DEFAULT_CURRENCY},
+    )
+
+
+def test_fees_shared_between_funds(copy):
+    _switch_funds(copy)
+    with kmymoney.KMyMoney(copy) as kmm:
+        fees = _fees(kmm).set_index(['transactionId', 'accountId'])['fees']
+        switch = fees.loc['T_switch']
+        assert switch.sum() == pytest.approx(10)
+        assert switch['A_stk0'] == pytest.approx(10 * 300 / 590)
+
+        snapshot = kmm.snapshot()._detailed_splits(
+            accounts=None, currency=kmymoney.DEFAULT_CURRENCY, maxdate=None)
+        snapshot = snapshot[snapshot['fees'].notna().to_numpy()]
+        np.testing.assert_allclose(
+            snapshot.set_index(['transactionId', 'accountId'])['fees']
+            .sort_index().loc[fees.index],
+            fees)
+
+        # The total of fees is unchanged
+        total = kmm._read_sql(
+            """SELECT SUM(CAST(substr(value, 1, instr(value, '/') - 1) AS REAL)
+                  / CAST(substr(value, instr(value, '/') + 1) AS REAL))
+            FROM kmmSplits WHERE accountId = 'A_fees'""").iloc[0, 0]
+        assert fees.sum() == pytest.approx(total)
+
+
+def test_positions_method(kmm):
+    fifo = kmm.positions()
+    pd.testing.assert_frame_equal(fifo, kmm.positions(method='fifo'))
+    average = kmm.positions(method='average')
+    pd.testing.assert_series_equal(fifo['shares'], average['shares'])
+    pd.testing.assert_series_equal(fifo['invested'], average['invested'])
+
+    # Positions match the last period of cost_basis, with the same default
+    basis = kmm.cost_basis(by_year=True).groupby(level='accountname').last()
+    np.testing.assert_allclose(
+        fifo['bookValue'], basis.loc[fifo.index, 'bookValue'])
+
+
+def test_unknown_method(kmm):
+    with pytest.raises(ValueError, match='Unknown method'):
+        kmm.positions(method='lifo')
+    with pytest.raises(ValueError, match='Unknown method'):
+        kmm.cost_basis(method='lifo')
+
+
+def test_cost_methods():
+    quantity = np.array([10.0, 10.0, -15.0, 5.0, -10.0])
+    amount = np.array([100.0, 200.0, -300.0, 50.0, -100.0])
+
+    book, realized = kmymoney.COST_METHODS['fifo'](quantity, amount)
+    np.testing.assert_allclose(book, [100, 300, 100, 150, 0])
+    np.testing.assert_allclose(realized, [0, 0, 100, 0, -50])
+
+    book, realized = kmymoney.COST_METHODS['average'](quantity, amount)
+    np.testing.assert_allclose(book, [100, 300, 75, 125, 0])
+    np.testing.assert_allclose(realized, [0, 0, 75, 0, -25])
+
+
+def test_fees(filename):
+    with sqlite3.connect(filename) as c:
+        expected = pd.read_sql(
+            """SELECT transactionId,
+                  SUM(CAST(substr(value, 1, instr(value, '/') - 1) AS REAL)
+                      / CAST(substr(value, instr(value, '/') + 1) AS REAL))
+                  as fees
+            FROM kmmSplits WHERE accountId = 'A_fees'
+            GROUP BY transactionId ORDER BY transactionId""", c)
+    assert len(expected) > 0
+
+    # A single connection is enough (fees used to wait for a second one)
+    result = []
+    with kmymoney.KMyMoney(filename, pool_size=1) as kmm:
+        thread = threading.Thread(target=lambda: result.append(
+            (kmm.fees(), kmm.ledger(accounts=['A_stk0']))), daemon=True)
+        thread.start()
+        thread.join(timeout=60)
+        assert not thread.is_alive()
+    fees, ledger = result[0]
+    pd.testing.assert_frame_equal(
+        fees.sort_values('transactionId', ignore_index=True), expected)
+    assert len(ledger) > 0
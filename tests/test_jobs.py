@@ -0,0 +1,136 @@
+import asyncio
+import concurrent.futures
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+import benchmark
+import kmymoney
+
+
+def test_run_reports(filename, copy):
+    with sqlite3.connect(copy) as c:
+        c.execute("DELETE FROM kmmSplits WHERE accountId = 'A_chk0'")
+    with kmymoney.KMyMoney(filename) as kmm:
+        maxdate = benchmark._mid_year(kmm)[1]
+        accounts = kmm.accounts()
+
+    files, currencies = [filename, copy], ['EUR', 'USD']
+    results, timings = kmymoney.run_reports(
+        files, currencies,
+        reports={
+            'networth': ('networth', {'maxdate': maxdate}),
+            'networth_at': ('networth_at', {'date': maxdate}),
+            'balance': ('balance_at', {'account': 'A_chk0', 'date': maxdate}),
+            'accounts': 'accounts',
+            'broken': ('balance_at', {}),
+        },
+        max_workers=2,
+    )
+
+    assert len(timings) == 2 * 2 * 5
+    assert timings[timings['report'] != 'broken']['error'].isna().all()
+    assert timings[timings['report'] == 'broken']['error'].map(
+        lambda e: isinstance(e, TypeError)).all()
+    assert 'broken' not in results
+
+    keys = [(f, cur) for f in files for cur in currencies]
+    networth = results['networth']
+    assert networth.index.names == ['file', 'currency', 'accountname']
+    assert list(networth.index.droplevel(2).unique()) == keys
+    for f, cur in keys:
+        with kmymoney.KMyMoney(f) as kmm:
+            pd.testing.assert_frame_equal(
+                networth.loc[(f, cur)],
+                kmm.networth(maxdate=maxdate, currency=cur))
+            assert results['networth_at'][(f, cur)] == kmm.networth_at(
+                maxdate, currency=cur)
+
+    assert list(results['balance']) == keys
+    assert results['balance'][(copy, 'EUR')] == 0.0
+    assert results['balance'][(filename, 'EUR')] != 0.0
+    assert len(results['accounts']) == 4 * len(accounts)
+
+
+def test_run_reports_unknown(filename):
+    with pytest.raises(ValueError, match='Unknown reports'):
+        kmymoney.run_reports([filename], reports=['networth', 'nothing'])
+    with pytest.raises(ValueError, match='Unknown reports'):
+        kmymoney.run_reports([filename], reports=['_splits'])
+
+
+# A query that takes forever, unless sqlite interrupts it
+ENDLESS = """WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c)
+   SELECT MAX(x) FROM (SELECT x FROM c LIMIT 1000000000000)"""
+
+
+def test_submit(filename):
+    with kmymoney.KMyMoney(filename, cache_size=0) as kmm:
+        job = kmm.submit('ledger', accounts=['A_chk0'])
+        pd.testing.assert_frame_equal(
+            job.result(timeout=60), kmm.ledger(accounts=['A_chk0']))
+        assert job.done() and not job.cancelled()
+
+        done = threading.Event()
+        job = kmm.submit('_read_sql', ENDLESS)
+        job.add_done_callback(lambda j: done.set())
+        time.sleep(0.2)
+        assert not job.done()
+        job.cancel()
+        with pytest.raises(concurrent.futures.CancelledError):
+            job.result(timeout=10)
+        assert done.wait(10)
+
+        # The connection can still be used
+        assert len(kmm.ledger(accounts=['A_chk0'])) > 0
+
+    with pytest.raises(ValueError, match='closed'):
+        kmm.submit('ledger')
+
+
+def test_report_async(filename):
+    async def run(kmm):
+        networth = await kmm.report_async('networth', by_year=True)
+        task = asyncio.ensure_future(kmm.report_async('_read_sql', ENDLESS))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return networth
+
+    with kmymoney.KMyMoney(filename) as kmm:
+        pd.testing.assert_frame_equal(
+            asyncio.run(run(kmm)), kmm.networth(by_year=True))
+
+
+def test_debouncer(filename):
+    results = []
+    received = threading.Event()
+
+    def callback(result):
+        results.append(result)
+        received.set()
+
+    with kmymoney.KMyMoney(filename) as kmm:
+        debounced = kmymoney.Debouncer(
+            kmm, 'balance_at', callback=callback, delay=0.2)
+        jobs = [debounced('A_chk0', date) for date in
+                ('2000-01-01', '2100-01-01', benchmark._mid_year(kmm)[1])]
+        jobs[-1].result(timeout=60)
+        expected = kmm.balance_at('A_chk0', benchmark._mid_year(kmm)[1])
+
+        # Only the last request was computed
+        assert [j.cancelled() for j in jobs] == [True, True, False]
+        for job in jobs[:-1]:
+            with pytest.raises(concurrent.futures.CancelledError):
+                job.result(timeout=10)
+        assert received.wait(10)
+        time.sleep(0.1)
+        assert results == [expected]
+
+        job = debounced('A_chk0', '2000-01-01')
+        debounced.cancel()
+        assert job.cancelled()
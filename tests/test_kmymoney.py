@@ -0,0 +1,60 @@
+import concurrent.futures
+import sqlite3
+
+import pytest
+
+import kmymoney
+
+
+def test_connection_pool(filename):
+    kmm = kmymoney.KMyMoney(filename, pool_size=2, cache_size=0)
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(
+            lambda _: len(kmm.accounts()), range(32)))
+    assert len(set(results)) == 1
+    assert len(kmm._connections) <= 2
+
+    with kmm._connection() as conn:
+        with pytest.raises(sqlite3.OperationalError, match='readonly'):
+            conn.execute("DELETE FROM kmmSplits")
+
+    kmm.close()
+    assert kmm._connections == []
+    with pytest.raises(ValueError, match='closed'):
+        kmm.accounts()
+
+
+def test_context_manager(filename):
+    with kmymoney.KMyMoney(filename) as kmm:
+        kmm.accounts()
+    assert kmm._connections == []
+
+
+def test_account_tree(filename):
+    with kmymoney.KMyMoney(filename) as kmm:
+        tree = kmm.account_tree()
+    assert tree['A_stk0'] is tree['Asset:Brokerage:Stock0']
+    assert tree['A_stk0'].depth == 2
+    assert sorted(tree.subtree('Asset:Brokerage')) == [
+        'A_broker', 'A_stk0', 'A_stk1', 'A_stk2', 'A_stk3', 'A_stk4']
+    assert tree.subtree('A_stk0') == ['A_stk0']
+
+    # Parents are listed before their children
+    seen = set()
+    for acc in tree:
+        assert acc.parentId in seen or acc in tree.roots
+        seen.add(acc.id)
+
+
+def test_account_tree_reloaded(copy):
+    with kmymoney.KMyMoney(copy) as kmm:
+        tree = kmm.account_tree()
+        assert kmm.account_tree() is tree
+        with sqlite3.connect(copy) as c:
+            c.execute(
+                "UPDATE kmmAccounts SET accountName = 'Shares'"
+                " WHERE id = 'A_broker'")
+            c.execute("UPDATE kmmFileInfo SET lastModified = 'changed'")
+        assert kmm.account_tree()['A_stk0'].name == 'Asset:Shares:Stock0'
+        accounts = kmm.accounts().set_index('accountId')
+        assert accounts.loc['A_stk1', 'name'] == 'Asset:Shares:Stock1'
@@ -0,0 +1,95 @@
+import math
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+import benchmark
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(*args):
+    """
+    Run python in a new process, where pandas has not been imported yet
+    """
+    result = subprocess.run(
+        [sys.executable] + list(args), cwd=ROOT, capture_output=True,
+        text=True)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+
+def test_lazy_import_threads(filename):
+    # Each thread runs the first report that needs pandas
+    output = run_python('-c', f"""if 1:
+        import concurrent.futures, kmymoney
+        def ledger(_):
+            with kmymoney.KMyMoney({filename!r}) as kmm:
+                return len(kmm.ledger(accounts=['A_chk0']))
+        with concurrent.futures.ThreadPoolExecutor(8) as executor:
+            print(set(executor.map(ledger, range(8))))
+    """)
+    assert output.count(',') == 0   # all threads got the same ledger
+
+
+def test_networth_at_without_pandas(filename):
+    output = run_python('-c', f"""if 1:
+        import sys, kmymoney
+        with kmymoney.KMyMoney({filename!r}) as kmm:
+            kmm.account_tree()
+            kmm.networth_at()
+        print('pandas' in sys.modules, 'numpy' in sys.modules)
+    """)
+    assert output.split() == ['False', 'False']
+
+
+def test_ledger_rows_without_pandas(filename):
+    output = run_python('-c', f"""if 1:
+        import sys, kmymoney
+        with kmymoney.KMyMoney({filename!r}) as kmm:
+            rows = list(kmm.ledger_rows(accounts=['A_stk0'], currency='USD'))
+        print(len(rows), rows[-1].balance > 0)
+        print('pandas' in sys.modules, 'numpy' in sys.modules)
+    """)
+    assert output.split()[1:] == ['True', 'False', 'False']
+    assert int(output.split()[0]) > 0
+
+
+@pytest.mark.parametrize('currency', ['EUR', 'USD'])
+def test_ledger_rows(kmm, currency):
+    mindate, maxdate = benchmark._mid_year(kmm)
+    expected = kmm.ledger(currency=currency, mindate=mindate, maxdate=maxdate)
+    rows = list(kmm.ledger_rows(
+        currency=currency, mindate=mindate, maxdate=maxdate))
+    assert len(rows) == len(expected) > 0
+    assert rows[0]._fields == tuple(expected.columns)
+    got = pd.DataFrame.from_records(rows, columns=rows[0]._fields)
+    pd.testing.assert_frame_equal(got, expected, check_dtype=False)
+
+
+def test_command_line(filename):
+    output = run_python('-m', 'kmymoney', 'networth', filename)
+    assert output.splitlines()[-1].startswith('Total')
+    assert 'Asset:Checking0' in output
+
+
+@pytest.mark.parametrize('currency', ['EUR', 'USD'])
+def test_networth_at(kmm, currency):
+    maxdate = benchmark._mid_year(kmm)[1]
+    networth = kmm.networth(
+        maxdate=maxdate, currency=currency, with_total=False)
+    assert networth.columns[-1] == maxdate
+    expected = {
+        name: value for name, value in networth[maxdate].items()
+        if not math.isnan(value)
+    }
+    got = {
+        name: value
+        for name, _, value in kmm.networth_at(maxdate, currency=currency)
+    }
+    assert got.keys() == expected.keys()
+    for name in expected:
+        assert got[name] == pytest.approx(expected[name], rel=1e-9, abs=1e-6)
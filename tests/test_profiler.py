@@ -0,0 +1,54 @@
+import kmymoney
+
+
+def test_profiler(filename):
+    calls = []
+    profiler = kmymoney.Profiler(callback=calls.append, memory=True)
+    with kmymoney.KMyMoney(
+            filename, cache_size=0, profiler=profiler) as kmm:
+        ledger = kmm.ledger(accounts=['A_chk0'])
+        chunks = list(kmm.iter_ledger(accounts=['A_chk0'], chunksize=100))
+        splits = kmm.splits().accounts(['A_chk0']).to_pandas()
+        kmm.networth_at('2100-01-01')
+
+    # Reports calling other reports are recorded once
+    assert [c.report for c in calls] == [
+        'ledger', 'iter_ledger', 'SplitQuery.to_pandas', 'networth_at']
+    assert list(profiler.calls) == calls
+    for c in calls:
+        assert c.queries
+        assert 0 < c.sql_seconds <= c.seconds
+        assert c.pandas_seconds >= 0
+        assert c.peak_memory > 0
+        assert all(q.sql and q.plan is None for q in c.queries)
+    assert calls[0].kwargs == {'accounts': ['A_chk0']}
+    assert sum(q.rows for q in calls[0].queries) >= len(ledger)
+    assert sum(q.rows for q in calls[1].queries) \
+        == sum(len(c) for c in chunks)
+    assert sum(q.rows for q in calls[2].queries) == len(splits)
+
+    summary = profiler.summary()
+    assert list(summary['report']) == [c.report for c in calls]
+    assert list(summary['queries']) == [len(c.queries) for c in calls]
+    queries = profiler.queries()
+    assert len(queries) == summary['queries'].sum()
+    assert set(queries['call']) == set(range(len(calls)))
+
+    profiler.clear()
+    assert len(profiler.summary()) == 0
+
+
+def test_profiler_explain(filename):
+    profiler = kmymoney.Profiler(explain=True, max_calls=1)
+    with kmymoney.KMyMoney(filename, profiler=profiler) as kmm:
+        kmm.accounts()
+        kmm.ledger(accounts=['A_chk0'])
+    assert [c.report for c in profiler.calls] == ['ledger']
+    plans = [q.plan for q in profiler.calls[0].queries]
+    assert all(p is not None and len(p) > 0 for p in plans)
+
+
+def test_no_profiler(filename):
+    with kmymoney.KMyMoney(filename) as kmm:
+        assert kmm.profiler is None
+        kmm.ledger(accounts=['A_chk0'])
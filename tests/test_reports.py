@@ -0,0 +1,212 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+import benchmark
+
+
+LEDGER_KEY = ['date', 'accountName', 'payee', 'category', 'paiement', 'deposit']
+
+
+def assert_same_ledger(left, right):
+    pd.testing.assert_frame_equal(
+        left.sort_values(LEDGER_KEY, kind='stable').reset_index(drop=True),
+        right.sort_values(LEDGER_KEY, kind='stable').reset_index(drop=True),
+        check_dtype=False, check_like=True, rtol=1e-6)
+
+
+@pytest.mark.parametrize('accounts', [None, ['A_chk0', 'A_stk1']])
+@pytest.mark.parametrize('currency', ['EUR', 'USD'])
+def test_snapshot_ledger(kmm, accounts, currency):
+    mindate, maxdate = benchmark._mid_year(kmm)
+    sql = kmm.ledger(
+        accounts=accounts, currency=currency, mindate=mindate,
+        maxdate=maxdate)
+    snap = kmm.snapshot().ledger(
+        accounts=accounts, currency=currency, mindate=mindate,
+        maxdate=maxdate)
+    assert len(sql) > 0
+    assert_same_ledger(sql, snap)
+
+
+def test_snapshot_price_history(kmm):
+    pd.testing.assert_frame_equal(
+        kmm.price_history(currency='USD'),
+        kmm.snapshot().price_history(currency='USD'))
+
+
+def test_snapshot_memory_usage(kmm):
+    usage = kmm.snapshot().memory_usage()
+    assert set(usage.index) == {'accounts', 'splits', 'prices', 'payees'}
+    assert (usage > 0).all()
+
+
+def test_balances_at(kmm):
+    mindate, maxdate = benchmark._mid_year(kmm)
+    dates = ['2000-01-01', mindate, maxdate, '2100-01-01']
+    balances = kmm.balances_at(dates)
+    with kmm._connection() as conn:
+        for date in dates:
+            expected = dict(conn.execute(
+                f"""SELECT accountId, SUM({kmm._to_float('shares')})
+                FROM kmmSplits WHERE postDate <= ? GROUP BY accountId""",
+                (date, )))
+            for accountId, balance in balances[date].items():
+                assert balance == pytest.approx(
+                    expected.get(accountId, 0.0), abs=1e-6)
+            assert kmm.balance_at('A_chk0', date) == pytest.approx(
+                expected.get('A_chk0', 0.0), abs=1e-6)
+
+    assert kmm.balance_at('unknown', maxdate) == 0.0
+    assert list(kmm.balances_at([maxdate], accounts=['A_chk1']).index) \
+        == ['A_chk1']
+
+
+def test_networth_periods(kmm):
+    mindate, maxdate = benchmark._mid_year(kmm)
+    middle = maxdate[:4] + '-05-17'
+    networth = kmm.networth(maxdate=middle)
+    assert list(networth.columns[-3:]) == [
+        maxdate[:4] + '-03-31', maxdate[:4] + '-04-30', middle]
+    assert list(kmm.networth(by_year=True, maxdate=maxdate).columns[-1:]) \
+        == [maxdate]
+    assert list(kmm.networth(freq='Q', mindate=mindate, maxdate=maxdate)
+                .columns) == [
+        mindate[:4] + '-03-31', mindate[:4] + '-06-30',
+        mindate[:4] + '-09-30', maxdate]
+    assert kmm.networth(maxdate='2000-01-01') is None
+
+    pd.testing.assert_series_equal(
+        networth.loc['Total'],
+        networth.drop('Total').sum(),
+        check_names=False)
+
+
+@pytest.mark.parametrize('currency', ['EUR', 'USD'])
+def test_networth_values(kmm, currency):
+    mindate, maxdate = benchmark._mid_year(kmm)
+    networth = kmm.networth(
+        freq='Q', mindate=mindate, maxdate=maxdate, currency=currency,
+        with_total=False)
+    for date in networth.columns:
+        for name, _, value in kmm.networth_at(date, currency=currency):
+            assert networth.loc[name, date] == pytest.approx(value, abs=1e-6)
+
+
+@pytest.mark.parametrize('accounts', [None, ['A_chk0', 'A_stk1']])
+def test_ledger_mindate(kmm, accounts):
+    mindate, maxdate = benchmark._mid_year(kmm)
+    full = kmm.ledger(accounts=accounts, maxdate=maxdate)
+    ledger = kmm.ledger(accounts=accounts, mindate=mindate, maxdate=maxdate)
+    assert 0 < len(ledger) < len(full)
+    assert_same_ledger(ledger, full[full['date'] >= mindate])
+
+
+@pytest.mark.parametrize('accounts', [None, ['A_stk0']])
+def test_compact_ledger(kmm, accounts):
+    ledger = kmm.ledger(accounts=accounts)
+    compact = kmm.ledger(accounts=accounts, compact=True)
+    assert compact['date'].dtype == 'datetime64[ns]'
+    for column in ('accountName', 'payee', 'category', 'reconcile'):
+        assert compact[column].dtype == 'category'
+        assert (compact[column].astype(object) == ledger[column]).all()
+    if accounts is None:
+        assert compact.memory_usage(deep=True).sum() \
+            < ledger.memory_usage(deep=True).sum()
+
+    # Amounts are not rounded, only exact values become float32
+    numbers = ledger.select_dtypes('number').columns
+    pd.testing.assert_frame_equal(
+        compact[numbers].astype(float), ledger[numbers], check_exact=True)
+
+
+@pytest.mark.parametrize('partial', [False, True])
+def test_by_category_matches_sql(kmm, partial):
+    mindate, maxdate = benchmark._mid_year(kmm)
+    if partial:
+        # Partial months at both ends of the range
+        mindate, maxdate = mindate[:4] + '-02-10', maxdate[:4] + '-11-20'
+    expected = kmm._categories(mindate=mindate, maxdate=maxdate) \
+        .groupby('category')[['paiement', 'deposit', 'amount']].sum()
+    got = kmm.by_category(mindate=mindate, maxdate=maxdate)
+    assert len(got) > 0
+    pd.testing.assert_frame_equal(
+        got.sort_index(), expected.sort_index(), check_dtype=False,
+        check_index_type=False, rtol=1e-6)
+
+
+def test_by_category_empty_range(kmm):
+    got = kmm.by_category(mindate='2000-01-01', maxdate='2000-12-31')
+    assert len(got) == 0
+    assert list(got.columns) == ['paiement', 'deposit', 'amount']
+
+
+def test_datetime_dates(kmm):
+    # As returned by the DatePicker widgets of the notebook
+    mindate, maxdate = benchmark._mid_year(kmm)
+    dates = {'mindate': datetime.date.fromisoformat(mindate),
+             'maxdate': pd.Timestamp(maxdate)}
+    strings = {'mindate': mindate, 'maxdate': maxdate}
+
+    for report in (kmm, kmm.snapshot()):
+        for name in ('ledger', 'networth', 'by_category', 'cost_basis'):
+            pd.testing.assert_frame_equal(
+                getattr(report, name)(**dates),
+                getattr(report, name)(**strings))
+        pd.testing.assert_frame_equal(
+            report.positions(date=dates['maxdate']),
+            report.positions(date=maxdate))
+        assert report.balance_at('A_chk0', dates['maxdate']) \
+            == report.balance_at('A_chk0', maxdate)
+        pd.testing.assert_frame_equal(
+            report.balances_at(list(dates.values())),
+            report.balances_at(list(strings.values())))
+
+    pd.testing.assert_frame_equal(
+        pd.concat(kmm.iter_ledger(**dates)), pd.concat(
+            kmm.iter_ledger(**strings)))
+    assert kmm.networth_at(dates['maxdate']) == kmm.networth_at(maxdate)
+    pd.testing.assert_frame_equal(
+        kmm.splits().between(**dates).to_pandas(),
+        kmm.splits().between(**strings).to_pandas())
+
+
+@pytest.mark.parametrize('accounts', [None, ['A_chk0', 'A_stk0', 'A_stk1']])
+@pytest.mark.parametrize('currency', ['EUR', 'USD'])
+def test_daily_networth(kmm, accounts, currency):
+    mindate, maxdate = benchmark._mid_year(kmm)
+    params = dict(accounts=accounts, currency=currency, mindate=mindate,
+                  maxdate=maxdate)
+    daily = kmm.networth(freq='D', **params)
+    assert len(daily.columns) == 365
+    assert daily.columns[0] == mindate and daily.columns[-1] == maxdate
+
+    # Same as binary searches for each period (used for any other freq)
+    pd.testing.assert_frame_equal(
+        daily, kmm.networth(freq='1D', **params), rtol=1e-9)
+
+    business = kmm.networth(freq='B', **params)
+    assert all(pd.Timestamp(c).dayofweek < 5 for c in business.columns)
+    pd.testing.assert_frame_equal(business, daily[business.columns])
+
+    compact = kmm.networth(freq='D', dtype='float32', **params)
+    assert (compact.dtypes == 'float32').all()
+    # About 7 significant digits, relative to the largest values (the
+    # total is a difference between large balances)
+    pd.testing.assert_frame_equal(
+        compact, daily, check_dtype=False, rtol=1e-6,
+        atol=1e-6 * daily.abs().max().max())
+
+
+def test_daily_networth_edges(kmm):
+    # Before the first transaction
+    assert kmm.networth(freq='D', maxdate='2000-01-01') is None
+
+    first = kmm.ledger()['date'].min()
+    before = str((pd.Timestamp(first) - pd.Timedelta(days=3)).date())
+    daily = kmm.networth(
+        freq='D', mindate=before, maxdate=first, with_total=False)
+    assert daily.columns[-1] == first
+    assert daily.iloc[:, :-1].isna().all().all()
+    assert daily[first].notna().any()
@@ -0,0 +1,92 @@
+import os
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import benchmark
+import kmymoney
+
+
+@pytest.fixture
+def sidecar(filename, tmp_path):
+    with kmymoney.KMyMoney(
+            filename, sidecar=str(tmp_path / 'small.sidecar')) as kmm:
+        yield kmm
+
+
+def _plan(plan):
+    return '\n'.join(plan['detail'])
+
+
+def test_ledger_uses_sidecar_indexes(sidecar):
+    mindate, maxdate = benchmark._mid_year(sidecar)
+    plan = _plan(sidecar.explain(*sidecar._ledger_query(
+        accounts=['A_chk0'], mindate=mindate, maxdate=maxdate)))
+    assert 'USING INDEX splits_account_date (accountId=? AND postDate>?' \
+        in plan
+    assert 'SCAN kmmSplits' not in plan
+
+
+def test_networth_at_uses_prices_key(filename, tmp_path):
+    profiler = kmymoney.Profiler(explain=True)
+    with kmymoney.KMyMoney(
+            filename, sidecar=str(tmp_path / 'small.sidecar'),
+            profiler=profiler) as kmm:
+        kmm.networth_at(benchmark._mid_year(kmm)[1])
+    plans = [_plan(q.plan) for q in profiler.calls[-1].queries]
+    assert any('accel.prices USING INDEX sqlite_autoindex_prices_1' in p
+               for p in plans)
+    assert any('USING INDEX splits_account_date' in p for p in plans)
+
+
+def test_sidecar_rebuilt(copy, tmp_path):
+    path = str(tmp_path / 'copy.sidecar')
+    with kmymoney.KMyMoney(copy, sidecar=path, cache_size=0) as first, \
+            kmymoney.KMyMoney(copy, sidecar=path, cache_size=0) as second:
+        assert len(first.ledger(accounts=['A_chk0'])) > 0
+        assert len(second.ledger(accounts=['A_chk0'])) > 0
+
+        with sqlite3.connect(copy) as c:
+            c.execute("DELETE FROM kmmSplits WHERE accountId = 'A_chk0'")
+            c.execute("UPDATE kmmFileInfo SET lastModified = 'changed'")
+        assert len(first.ledger(accounts=['A_chk0'])) == 0
+        assert len(second.ledger(accounts=['A_chk0'])) == 0
+
+    # Reused by a new session
+    with kmymoney.KMyMoney(copy, sidecar=path) as kmm:
+        assert len(kmm.ledger(accounts=['A_chk0'])) == 0
+
+
+def test_sidecar_of_another_file(filename, copy, tmp_path):
+    path = str(tmp_path / 'shared.sidecar')
+    with sqlite3.connect(copy) as c:
+        c.execute("DELETE FROM kmmSplits WHERE accountId = 'A_chk0'")
+
+    with kmymoney.KMyMoney(filename, sidecar=path, cache_size=0) as kmm, \
+            kmymoney.KMyMoney(copy, sidecar=path, cache_size=0) as other:
+        expected = len(kmm.ledger(accounts=['A_chk0']))
+        with pytest.raises(ValueError, match='is the sidecar of'):
+            other.ledger(accounts=['A_chk0'])
+        assert len(kmm.ledger(accounts=['A_chk0'])) == expected
+
+
+def test_outdated_sidecar(filename, tmp_path):
+    path = str(tmp_path / 'old.sidecar')
+    with sqlite3.connect(path) as c:
+        c.execute("CREATE TABLE meta (signature TEXT)")
+        c.execute("INSERT INTO meta VALUES ('x')")
+    with kmymoney.KMyMoney(filename, sidecar=path) as kmm:
+        assert len(kmm.ledger(accounts=['A_chk0'])) > 0
+
+
+def test_run_reports_sidecars(filename, copy, tmp_path):
+    directory = str(tmp_path / 'sidecars')
+    results, timings = kmymoney.run_reports(
+        [filename, copy], reports=['networth'], max_workers=2,
+        sidecar=directory)
+    assert timings['error'].isna().all()
+    assert len(os.listdir(directory)) == 2
+    with kmymoney.KMyMoney(filename) as kmm:
+        pd.testing.assert_frame_equal(
+            results['networth'].loc[(filename, 'EUR')], kmm.networth())
@@ -0,0 +1,116 @@
+import sqlite3
+
+import pandas as pd
+
+import benchmark
+import kmymoney
+
+
+def _modify(filename):
+    """
+    Add, delete and modify (in place) some transactions and prices, as
+    another tool than KMyMoney could, i.e. without updating kmmAccounts.
+    Return the ids of the accounts impacted.
+    """
+    with sqlite3.connect(filename) as c:
+        tx = [r[0] for r in c.execute(
+            "SELECT id FROM kmmTransactions ORDER BY id LIMIT 500")]
+        impacted = set()
+
+        def accounts(transactionId):
+            return {r[0] for r in c.execute(
+                "SELECT accountId FROM kmmSplits WHERE transactionId = ?",
+                (transactionId, ))}
+
+        # A new transaction
+        date = c.execute("SELECT postDate FROM kmmSplits WHERE"
+                         " transactionId = ?", (tx[300], )).fetchone()[0]
+        c.execute(
+            """INSERT INTO kmmTransactions (id, txType, postDate, memo,
+               entryDate, currencyId) VALUES ('T_new', 'N', ?, '', ?, 'EUR')""",
+            (date, date))
+        for splitId, accountId, amount in (
+                (0, 'A_chk1', '-123456/100'), (1, 'A_exp3', '123456/100')):
+            c.execute(
+                """INSERT INTO kmmSplits (transactionId, txType, splitId,
+                   payeeId, action, reconcileFlag, value, shares, price, memo,
+                   accountId, postDate) VALUES
+                   ('T_new', 'N', ?, 'P000001', '', '0', ?, ?, '1/1', '', ?, ?)
+                """,
+                (splitId, amount, amount, accountId, date))
+        impacted |= {'A_chk1', 'A_exp3'}
+
+        # A deleted transaction
+        impacted |= accounts(tx[100])
+        c.execute("DELETE FROM kmmSplits WHERE transactionId = ?", (tx[100], ))
+
+        # A transaction moved to another date
+        impacted |= accounts(tx[200])
+        c.execute(
+            "UPDATE kmmSplits SET postDate = ? WHERE transactionId = ?",
+            (date, tx[200]))
+
+        # A transaction with a new amount
+        impacted |= accounts(tx[400])
+        c.execute(
+            """UPDATE kmmSplits SET value = shares || '0', shares = shares || '0'
+            WHERE transactionId = ?""",
+            (tx[400], ))
+
+        # New, modified and deleted prices
+        c.execute(
+            """UPDATE kmmPrices SET price = '1/1'
+            WHERE rowid = (SELECT MIN(rowid) FROM kmmPrices)""")
+        c.execute(
+            """DELETE FROM kmmPrices
+            WHERE rowid = (SELECT MAX(rowid) FROM kmmPrices)""")
+        c.execute(
+            """INSERT OR REPLACE INTO kmmPrices (fromId, toId, priceDate, price)
+            SELECT fromId, toId, ?, '2/1' FROM kmmPrices LIMIT 1""",
+            (date, ))
+
+        c.execute("UPDATE kmmFileInfo SET lastModified = 'changed'")
+    return impacted
+
+
+def test_incremental_snapshot(copy):
+    with kmymoney.KMyMoney(copy) as kmm:
+        mindate, maxdate = benchmark._mid_year(kmm)
+        old = kmm.snapshot(incremental=True)
+        old.networth()          # compute the balance index
+        old.by_category()       # and the category rollup
+
+        impacted = _modify(copy)
+        new = kmm.snapshot(incremental=True)
+        with kmm._connection() as conn:
+            fresh = kmymoney.Snapshot(kmm, conn)
+
+    assert new is not old
+    assert old._changed_accounts(
+        new._account_rows, new._split_checksums) == impacted
+
+    reports = [
+        lambda s: s.ledger(),
+        lambda s: s.ledger(accounts=['A_chk1'], mindate=mindate),
+        lambda s: s.networth(),
+        lambda s: s.networth(by_year=True, currency='USD'),
+        lambda s: s.balances_at([mindate, maxdate]),
+        lambda s: s.by_category(mindate=mindate, maxdate=maxdate),
+        lambda s: s.by_category(level=1),
+        lambda s: s.price_history(),
+        lambda s: s.positions(),
+    ]
+    for report in reports:
+        pd.testing.assert_frame_equal(report(new), report(fresh))
+
+
+def test_incremental_snapshot_unchanged(copy):
+    with kmymoney.KMyMoney(copy) as kmm:
+        old = kmm.snapshot(incremental=True)
+        with sqlite3.connect(copy) as c:
+            c.execute("UPDATE kmmFileInfo SET lastModified = 'changed'")
+        new = kmm.snapshot(incremental=True)
+    assert new is not old
+    assert old._changed_accounts(
+        new._account_rows, new._split_checksums) == set()
+    pd.testing.assert_frame_equal(new.ledger(), old.ledger())
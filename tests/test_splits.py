@@ -0,0 +1,53 @@
+import pandas as pd
+
+import benchmark
+
+
+def _filtered(kmm, query, expected):
+    result = query.to_pandas()
+    assert len(result) > 0
+    pd.testing.assert_frame_equal(result, expected.reset_index(drop=True))
+    assert [tuple(r) for r in query] == [
+        tuple(r) for r in result.itertuples(index=False)]
+
+
+def test_split_query(kmm):
+    mindate, maxdate = benchmark._mid_year(kmm)
+    query = kmm.splits()
+    splits = query.to_pandas()
+    assert len(splits) == len(kmm.split_amounts())
+
+    in_account = splits['accountId'].isin(['A_chk0', 'A_stk0'])
+    in_year = splits['date'].between(mindate, maxdate)
+    _filtered(kmm, query.accounts(['A_chk0', 'A_stk0']), splits[in_account])
+    _filtered(kmm, query.accounts('A_chk0'),
+              splits[splits['accountId'] == 'A_chk0'])
+    _filtered(kmm, query.between(mindate, maxdate), splits[in_year])
+    _filtered(kmm, query.between(maxdate=mindate),
+              splits[splits['date'] <= mindate])
+
+    payees = list(splits['payee'].value_counts().index[:2])
+    _filtered(kmm, query.payee(*payees), splits[splits['payee'].isin(payees)])
+
+    fees = splits[splits['accountId'] == 'A_fees']['transactionId']
+    _filtered(
+        kmm, query.category('A_fees'),
+        splits[splits['transactionId'].isin(fees)
+               & (splits['accountId'] != 'A_fees')])
+
+    # Filters are combined, and queries can be reused
+    year = query.between(mindate, maxdate)
+    _filtered(kmm, year.accounts(['A_chk0', 'A_stk0']),
+              splits[in_account & in_year])
+    _filtered(kmm, year, splits[in_year])
+
+
+def test_split_query_parameters(kmm):
+    first, params = kmm.splits().accounts(['A_chk0', 'A_stk0']).between(
+        '2020-01-01').payee('Payee1').sql()
+    second, _ = kmm.splits().accounts(['A_exp0', "A'x"]).between(
+        '2021-01-01').payee("Payee' OR 1").sql()
+    assert first == second
+    assert set(params.values()) == {'A_chk0', 'A_stk0', '2020-01-01', 'Payee1'}
+    assert len(kmm.splits().accounts(["A'x"]).payee("x' OR 1").to_pandas()) \
+        == 0